@@ -0,0 +1,293 @@
+"""
+記事生成グラフのベンチマークです。
+フェイクのチャットモデルとフェイクのキーワードサービスを使い、graph.pyのグラフをエンドツーエンドで実行して
+ノードごとのレイテンシ・同時実行数ごとのスループット・チェックポイントサイズ（旧形式との比較を含む）・スレッドあたりのピークメモリをJSONで出力します。
+
+実行例（slgディレクトリで実行）:
+    python -m benchmarks.bench_graph --jobs 32 --concurrency 1 4 16 --output bench_output.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import threading
+import time
+import tracemalloc
+import uuid
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langgraph.types import Command, Send
+
+import blog_makearticle2.src.graph as graph_module
+from blog_makearticle2.src import utils as keyword_utils
+from blog_makearticle2.src.batch import build_config, build_initial_state
+from blog_makearticle2.src.fake_ads import FakeGoogleAdsClient, FakeKeywordPlanIdeaService
+from blog_makearticle2.src.fake_llm import FakeChatModel
+from blog_makearticle2.src.instrumentation import metrics, metrics_callback
+from blog_makearticle2.src.profile_records import render_company, render_persona, render_product, render_profile
+
+
+# チェックポイントのシリアライズ時間を計測する際の繰り返し回数
+SERIALIZE_REPEATS = 50
+
+
+def percentiles(values: list[float]) -> dict:
+    """p50/p90/p99と平均・最大値を返します（単位はミリ秒）。"""
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def _rank(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": _rank(50) * 1000,
+        "p90_ms": _rank(90) * 1000,
+        "p99_ms": _rank(99) * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+class NodeTimer(BaseCallbackHandler):
+    """グラフのノード（langgraph_nodeと同名のチェーン）の実行時間を記録するコールバックです。"""
+
+    def __init__(self):
+        self.started = {}
+        self.durations = {}
+        self._lock = threading.Lock()
+
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        if node and kwargs.get("name") == node:
+            self.started[run_id] = (node, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def _finish(self, run_id):
+        started = self.started.pop(run_id, None)
+        if started is None:
+            return
+        node, start = started
+        with self._lock:
+            self.durations.setdefault(node, []).append(time.perf_counter() - start)
+
+
+def make_jobs(count: int, duplicates: int = 1) -> list[dict]:
+    """
+    ベンチマーク用のジョブ（ペルソナ × キーワード）を作成します。
+    `duplicates`が2以上の場合は、同じ入力のジョブをその数ずつ続けて並べます（同時に届いた同一リクエストの再現）。
+    """
+    return [
+        {
+            "siteId": "c15000000001",
+            "companyId": 1,
+            "productId": 1,
+            "personaId": 1 + (i // duplicates) % 2,
+            "write_word": f"btob デジタル マーケティング {i // duplicates}",
+        }
+        for i in range(count)
+    ]
+
+
+async def run_article(job: dict, regenerations: int, callbacks: list, section_feedback: int = 0) -> dict:
+    """
+    1件のジョブを、指定回数の再生成の後に承認（"yes"）するまで実行します。
+    `section_feedback`が0の場合は"no"でアウトライン全体を、1以上の場合は先頭からその数のセクションだけを再生成します。
+    """
+    graph = graph_module.graph
+    config = build_config(job, str(uuid.uuid4()))
+    config["callbacks"] = callbacks
+    start = time.perf_counter()
+    await graph.ainvoke(build_initial_state(job), config)
+    feedback = "no"
+    if section_feedback:
+        feedback = {"sections": {number: "具体例を追加してください" for number in range(1, section_feedback + 1)}}
+    for _ in range(regenerations):
+        await graph.ainvoke(Command(resume=feedback), config)
+    await graph.ainvoke(Command(resume="yes"), config)
+    return {"config": config, "elapsed": time.perf_counter() - start}
+
+
+def _legacy_profile(values: dict) -> dict:
+    """プロファイル情報のレコードを、旧形式（レンダリング済みのテキスト）に置き換えた辞書を返します。"""
+    if not any(key in values for key in ("company", "product", "persona")):
+        return values
+    values = dict(values)
+    company, product, persona = (values.pop(key, None) for key in ("company", "product", "persona"))
+    values["company_info"] = render_company(company)
+    values["product_info"] = render_product(product)
+    values["persona_info"] = render_persona(persona)
+    values["profile_context"] = render_profile(company, product, persona)
+    return values
+
+
+def _legacy_section_task(task: dict) -> dict:
+    """SectionTaskのレコードを、旧形式のprofile_context（レンダリング済みのテキスト）に置き換えます。"""
+    task = dict(task)
+    company, product, persona = (task.pop(key, None) for key in ("company", "product", "persona"))
+    task["profile_context"] = render_profile(company, product, persona)
+    return task
+
+
+def legacy_checkpoint(checkpoint: dict) -> dict:
+    """
+    比較用に、チェックポイントをプロファイル情報をテキストで保持していた旧形式に変換します。
+    旧形式では、会社・プロダクト・ペルソナの各テキストと、それらを結合したprofile_contextをstateに、
+    セクションごとのprofile_contextをWriteSectionへのSendに保持していました。
+    """
+    legacy = dict(checkpoint)
+    legacy["channel_values"] = _legacy_profile(checkpoint["channel_values"])
+    legacy["pending_sends"] = [
+        Send(send.node, _legacy_section_task(send.arg)) if isinstance(send.arg, dict) else send
+        for send in checkpoint.get("pending_sends", [])
+    ]
+    return legacy
+
+
+def checkpoint_bytes(config: dict) -> dict:
+    """
+    スレッドに保存されているチェックポイントのシリアライズ後のサイズと、シリアライズにかかった時間を返します。
+    現在の形式（compact）と、プロファイル情報をテキストで保持していた旧形式（legacy）の両方を計測します。
+    """
+    checkpointer = graph_module.graph.checkpointer
+    thread_config = {"configurable": {"thread_id": config["configurable"]["thread_id"]}}
+    checkpoints = [item.checkpoint for item in checkpointer.list(thread_config)]
+
+    def _measure(items):
+        sizes, durations = [], []
+        for checkpoint in items:
+            sizes.append(len(checkpointer.serde.dumps_typed(checkpoint)[1]))
+            # 1回ごとのばらつきが大きいため、繰り返した中央値を使う
+            repeats = []
+            for _ in range(SERIALIZE_REPEATS):
+                start = time.perf_counter()
+                checkpointer.serde.dumps_typed(checkpoint)
+                repeats.append(time.perf_counter() - start)
+            durations.append(statistics.median(repeats))
+        return {
+            "latest": sizes[0] if sizes else 0,
+            "retained_total": sum(sizes),
+            "serialize_us_mean": statistics.fmean(durations) * 1e6 if durations else 0.0,
+        }
+
+    return {
+        "retained_count": len(checkpoints),
+        "compact": _measure(checkpoints),
+        "legacy": _measure([legacy_checkpoint(checkpoint) for checkpoint in checkpoints]),
+    }
+
+
+async def bench_throughput(
+    jobs: list[dict], concurrency: int, regenerations: int, timer: NodeTimer, section_feedback: int = 0
+) -> dict:
+    """指定した同時実行数でジョブを実行し、スループットとエンドツーエンドのレイテンシを計測します。"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _run(job):
+        async with semaphore:
+            return await run_article(job, regenerations, [timer], section_feedback)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(_run(job) for job in jobs))
+    wall = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "jobs": len(jobs),
+        "wall_s": wall,
+        "throughput_jobs_per_s": len(jobs) / wall,
+        "end_to_end": percentiles([r["elapsed"] for r in results]),
+        "checkpoint_bytes": checkpoint_bytes(results[-1]["config"]),
+    }
+
+
+async def bench_memory(jobs: list[dict], regenerations: int) -> dict:
+    """ジョブを1件ずつ実行し、スレッドあたりのピークメモリ（tracemalloc）を計測します。"""
+    tracemalloc.start()
+    peaks = []
+    try:
+        for job in jobs:
+            baseline, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            await run_article(job, regenerations, [])
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - baseline)
+    finally:
+        tracemalloc.stop()
+    return {
+        "threads": len(peaks),
+        "peak_bytes_median": statistics.median(peaks),
+        "peak_bytes_max": max(peaks),
+    }
+
+
+async def bench_keyword_volume(count: int) -> dict:
+    """QueryKeywordVolumeノードをフェイクのキーワードサービスで実行し、レイテンシを計測します。"""
+    durations = []
+    for i in range(count):
+        start = time.perf_counter()
+        await graph_module.QueryKeywordVolume({"target_keyword": f"社員研修 {i}"}, {})
+        durations.append(time.perf_counter() - start)
+    return percentiles(durations)
+
+
+async def main(args) -> dict:
+    graph_module.set_model(FakeChatModel(
+        first_token_latency=args.first_token_latency,
+        token_latency=args.token_latency,
+        completion_tokens=args.completion_tokens,
+        callbacks=[metrics_callback],
+    ))
+    keyword_utils.set_googleads_client(
+        FakeGoogleAdsClient(FakeKeywordPlanIdeaService(latency=args.ads_latency))
+    )
+
+    timer = NodeTimer()
+    jobs = make_jobs(args.jobs, args.duplicates)
+    throughput = []
+    for concurrency in args.concurrency:
+        throughput.append(
+            await bench_throughput(jobs, concurrency, args.regenerations, timer, args.section_feedback)
+        )
+
+    return {
+        "settings": vars(args),
+        "node_latency": {node: percentiles(values) for node, values in sorted(timer.durations.items())},
+        "throughput": throughput,
+        "memory_per_thread": await bench_memory(jobs[: args.memory_jobs], args.regenerations),
+        "keyword_volume": await bench_keyword_volume(args.memory_jobs),
+        "metrics": metrics.snapshot(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the article graph with fake backends.")
+    parser.add_argument("--jobs", type=int, default=32, help="Number of jobs per concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="Concurrency levels")
+    parser.add_argument("--regenerations", type=int, default=1, help="Number of 'no' answers before approval")
+    parser.add_argument(
+        "--section-feedback", type=int, default=0,
+        help="Regenerate only this many sections per round instead of the whole outline (0 = whole outline)",
+    )
+    parser.add_argument("--duplicates", type=int, default=1, help="Identical jobs per distinct input")
+    parser.add_argument("--first-token-latency", type=float, default=0.05, help="Fake LLM first token latency (s)")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Fake LLM per-token latency (s)")
+    parser.add_argument("--completion-tokens", type=int, default=200, help="Fake LLM completion tokens")
+    parser.add_argument("--ads-latency", type=float, default=0.05, help="Fake keyword service latency (s)")
+    parser.add_argument("--memory-jobs", type=int, default=5, help="Jobs used for the memory measurement")
+    parser.add_argument("--output", type=str, default="bench_output.json", help="Path of the JSON report")
+    args = parser.parse_args()
+
+    report = asyncio.run(main(args))
+    with open(args.output, "w") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
@@ -0,0 +1,122 @@
+"""
+モデル呼び出しのスケジューラ（流量制限・再試行・ヘッジ・代替モデル）のベンチマークです。
+ローカルのフェイクのOpenAIエンドポイント（fake_openai.py）に対して、スケジューラを通さない場合と通す場合で
+同じ数のリクエストを並行に送り、成功数・レイテンシ・エンドポイントが受け取ったリクエスト数をJSONで出力します。
+
+実行例（slgディレクトリで実行）:
+    python -m benchmarks.bench_scheduler --requests 200 --concurrency 16 --failure-rate 0.1 --stall-rate 0.02 --hedge-percentile 90
+"""
+
+import argparse
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_openai import ChatOpenAI
+
+from benchmarks.bench_graph import percentiles
+from blog_makearticle2.src.fake_openai import FakeOpenAIServer
+from blog_makearticle2.src.instrumentation import metrics
+from blog_makearticle2.src.scheduler import ModelCallScheduler, build_http_clients
+
+
+def make_model(base_url: str, scheduler: ModelCallScheduler | None, model: str, timeout: float) -> ChatOpenAI:
+    """フェイクのエンドポイントに接続するChatOpenAIを作成します。スケジューラがNoneの場合は再試行なしで直接送ります。"""
+    kwargs = {}
+    if scheduler is not None:
+        http_client, http_async_client = build_http_clients(scheduler, timeout=timeout)
+        kwargs = {"http_client": http_client, "http_async_client": http_async_client}
+    return ChatOpenAI(
+        openai_api_key=os.environ.get("OPENAI_API_KEY", "benchmark"),
+        openai_api_base=base_url,
+        model=model,
+        streaming=True,
+        stream_usage=True,
+        max_retries=0,
+        timeout=timeout,
+        **kwargs,
+    )
+
+
+def run(model: ChatOpenAI, requests: int, concurrency: int) -> dict:
+    """リクエストを並行に送り、成功数・失敗の種類・レイテンシを返します。"""
+
+    def _call(i):
+        start = time.perf_counter()
+        try:
+            response = model.invoke(f"社員研修 {i} のアウトラインを作成してください。")
+            return time.perf_counter() - start, None, response.response_metadata.get("model_name")
+        except Exception as e:
+            return time.perf_counter() - start, type(e).__name__, None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(_call, range(requests)))
+    wall = time.perf_counter() - start
+    return {
+        "wall_s": wall,
+        "succeeded": sum(1 for _, error, _ in results if error is None),
+        "errors": dict(Counter(error for _, error, _ in results if error)),
+        "models": dict(Counter(model_name for _, error, model_name in results if error is None)),
+        "latency": percentiles([elapsed for elapsed, error, _ in results if error is None]),
+    }
+
+
+def main(args) -> dict:
+    report = {"settings": vars(args)}
+    modes = {
+        "direct": None,
+        "scheduled": ModelCallScheduler(
+            requests_per_minute=args.rpm,
+            tokens_per_minute=args.tpm,
+            max_retries=args.max_retries,
+            backoff_base=args.backoff_base,
+            hedge_percentile=args.hedge_percentile,
+            hedge_min_samples=args.hedge_min_samples,
+            fallback_model=args.fallback_model,
+        ),
+    }
+    for name, scheduler in modes.items():
+        metrics.reset()
+        with FakeOpenAIServer(
+            latency=args.latency,
+            failure_rate=args.failure_rate,
+            stall_rate=args.stall_rate,
+            stall_seconds=args.stall_seconds,
+            failing_models=tuple(args.failing_model),
+        ) as server:
+            model = make_model(server.base_url, scheduler, args.model, args.timeout)
+            result = run(model, args.requests, args.concurrency)
+            result["endpoint_requests"] = dict(Counter(server.requests))
+        result["scheduler_events"] = metrics.snapshot()["llm_requests"]
+        report[name] = result
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the model-call scheduler against a fake OpenAI endpoint.")
+    parser.add_argument("--requests", type=int, default=100, help="Number of requests per mode")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent requests")
+    parser.add_argument("--model", type=str, default="gpt-4o-mini", help="Primary model name")
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake endpoint latency (s)")
+    parser.add_argument("--failure-rate", type=float, default=0.1, help="Share of requests answered with 429")
+    parser.add_argument("--stall-rate", type=float, default=0.02, help="Share of requests that stall")
+    parser.add_argument("--stall-seconds", type=float, default=5.0, help="How long stalled requests hang (s)")
+    parser.add_argument("--failing-model", action="append", default=[], help="Model that always gets 429")
+    parser.add_argument("--timeout", type=float, default=10.0, help="Request timeout (s)")
+    parser.add_argument("--rpm", type=float, default=None, help="Requests per minute limit")
+    parser.add_argument("--tpm", type=float, default=None, help="Tokens per minute limit")
+    parser.add_argument("--max-retries", type=int, default=3, help="Retries per request")
+    parser.add_argument("--backoff-base", type=float, default=0.05, help="Backoff base (s)")
+    parser.add_argument("--hedge-percentile", type=float, default=90, help="Hedge after this latency percentile")
+    parser.add_argument("--hedge-min-samples", type=int, default=10, help="Samples needed before hedging")
+    parser.add_argument("--fallback-model", type=str, default=None, help="Alternate model name")
+    parser.add_argument("--output", type=str, default="bench_scheduler_output.json", help="Path of the JSON report")
+    args = parser.parse_args()
+
+    report = main(args)
+    with open(args.output, "w") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
@@ -0,0 +1,86 @@
+"""
+graph.pyのインポート時間を `python -X importtime` で計測し、予算を超えていないかを確認します。
+新しいインタプリタで複数回インポートして最小値を予算と比較し、重いモジュール（langchain_openai・pandas・google-adsなど）が
+インポート時に読み込まれていないことも確認します。予算を超えた場合や禁止モジュールが読み込まれた場合は終了コード1で終了します。
+
+実行例（slgディレクトリで実行）:
+    python -m benchmarks.import_time --budget-ms 1500
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# インポート時に読み込まれてはいけないモジュール（ノードの実行時に遅延して読み込む）
+DEFERRED_MODULES = (
+    "langchain_openai",
+    "openai",
+    "pandas",
+    "numpy",
+    "google.ads.googleads",
+    "tiktoken",
+)
+
+
+def measure_import(module: str) -> dict[str, tuple[int, int]]:
+    """
+    新しいインタプリタでモジュールをインポートし、モジュール名 -> (自身の時間, 累積時間) をマイクロ秒で返します。
+    """
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "import-time")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env=env,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to import {module}:\n{result.stderr}")
+
+    timings = {}
+    for line in result.stderr.splitlines():
+        # 形式: "import time:   self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+    return timings
+
+
+def main(args) -> int:
+    runs = [measure_import(args.module) for _ in range(args.runs)]
+    totals = [timings[args.module][1] for timings in runs]
+    # 最小値を使い、ディスクキャッシュなどによるばらつきを除く
+    best = runs[totals.index(min(totals))]
+    loaded = [name for name in DEFERRED_MODULES if name in best]
+    heaviest = sorted(best.items(), key=lambda item: item[1][1], reverse=True)[: args.top]
+
+    report = {
+        "module": args.module,
+        "budget_ms": args.budget_ms,
+        "import_ms_min": min(totals) / 1000,
+        "import_ms_runs": [total / 1000 for total in totals],
+        "deferred_modules_loaded": loaded,
+        "heaviest_cumulative_ms": {name: cumulative / 1000 for name, (_, cumulative) in heaviest},
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    failed = False
+    if min(totals) / 1000 > args.budget_ms:
+        print(f"FAIL: import of {args.module} took {min(totals) / 1000:.0f} ms (budget {args.budget_ms} ms)")
+        failed = True
+    if loaded:
+        print(f"FAIL: deferred modules were imported at startup: {', '.join(loaded)}")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks the cold import time of the graph module.")
+    parser.add_argument("--module", type=str, default="blog_makearticle2.src.graph", help="Module to import")
+    parser.add_argument("--budget-ms", type=float, default=1500, help="Import time budget (ms)")
+    parser.add_argument("--runs", type=int, default=3, help="Number of fresh interpreters to measure")
+    parser.add_argument("--top", type=int, default=10, help="Number of heaviest modules to report")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,84 @@
+import asyncio
+import uuid
+from typing import AsyncIterator, TypedDict
+
+from blog_makearticle2.src.graph import graph
+from blog_makearticle2.src.state import initial_state
+
+
+class BatchJob(TypedDict):
+    """バッチ実行する1件分のジョブ定義です。キー名はconfigの`configurable`に合わせています。"""
+    siteId: str
+    companyId: int
+    productId: int
+    personaId: int
+    write_word: str
+
+
+def build_config(job: BatchJob, thread_id: str) -> dict:
+    """ジョブ定義からグラフ実行用のconfigを作成します。"""
+    return {"configurable": {
+        "thread_id": thread_id,
+        "siteId": job["siteId"],
+        "companyId": job["companyId"],
+        "productId": job["productId"],
+        "personaId": job["personaId"],
+        }
+    }
+
+
+def build_initial_state(job: BatchJob) -> dict:
+    """ジョブ定義からグラフの初期状態を作成します。"""
+    return {
+        "messages": list(initial_state["messages"]),
+        "write_word": job["write_word"],
+    }
+
+
+async def run_job(job: BatchJob, graph=graph) -> dict:
+    """
+    1件のジョブを専用のスレッドIDで実行します。
+    HumanFeedbackで中断した場合はstatusを"pending"として返し、再開に必要なthread_idを含めます。
+    """
+    thread_id = str(uuid.uuid4())
+    config = build_config(job, thread_id)
+    result = {"job": job, "thread_id": thread_id}
+    try:
+        values = await graph.ainvoke(build_initial_state(job), config)
+        snapshot = await graph.aget_state(config)
+    except Exception as e:
+        return {**result, "status": "failed", "error": repr(e)}
+
+    result["values"] = values
+    if snapshot.next:
+        # interruptで停止している場合は、後からCommand(resume=...)で再開できるよう保留として返す
+        result["status"] = "pending"
+        result["interrupts"] = [
+            interrupt.value for task in snapshot.tasks for interrupt in task.interrupts
+        ]
+    else:
+        result["status"] = "completed"
+    return result
+
+
+async def run_batch(
+    jobs: list[BatchJob], max_concurrency: int = 8, graph=graph
+) -> AsyncIterator[dict]:
+    """
+    複数のジョブを同時実行数の上限付きで並行実行します。
+    結果は投入順ではなく、完了したジョブから順に返します。
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _run(job: BatchJob) -> dict:
+        async with semaphore:
+            return await run_job(job, graph=graph)
+
+    tasks = [asyncio.create_task(_run(job)) for job in jobs]
+    try:
+        for completed in asyncio.as_completed(tasks):
+            yield await completed
+    finally:
+        # 呼び出し側が途中で反復をやめた場合は、残りのジョブをキャンセルする
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,317 @@
+"""
+マニフェストに定義した大量のアウトライン作成ジョブを、複数のプロセスに分けて実行するCLIです。
+
+- マニフェスト（.jsonl・.json・.csv）の各ジョブは siteId・companyId・productId・personaId・write_word を持ちます。
+  `key`列があればジョブのキーとして使い、なければこれらの値からキーを作成します。
+- 未完了のジョブをシャード（`--shard-size`件ずつ）に分け、プロセスプールで実行します。
+  各ワーカープロセスはモデルのクライアントとプロファイルのキャッシュを個別に持ち、シャード内のジョブを`--concurrency`件ずつ並行に実行します。
+- スケジューラの流量制限（LLM_RATE_LIMIT_RPM・LLM_RATE_LIMIT_TPM）はプロセスごとに働くため、
+  設定した値をワーカー数で割った値を各ワーカーの上限にし、全ワーカーの合計が設定した値を超えないようにします。
+- ジョブが終わるたびに結果を出力のJSONLに1行追記し、フラッシュします。
+- 再実行時は出力のJSONLを読み、完了済み（completed・pending）のジョブを飛ばします。失敗したジョブは実行し直します。
+  スレッドIDはジョブのキーから決まるため、CHECKPOINTER=sqliteの場合は中断したジョブをチェックポイントから再開し、
+  チェックポイント上で完了済みのジョブはモデルを呼び出さずに結果を記録します。
+- 既定ではHumanFeedbackで`--approve`の値（"yes"）を返して自動承認し、記事の本文まで作成します。
+  `--interactive`を指定した場合は承認せず、HumanFeedbackで停止したジョブをpendingとして記録します。
+
+実行例（slgディレクトリで実行）:
+    python -m blog_makearticle2.src.bulk manifest.jsonl --output results.jsonl --workers 4 --concurrency 8
+"""
+
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# マニフェストの各ジョブに必要な列
+JOB_FIELDS = ("siteId", "companyId", "productId", "personaId", "write_word")
+# 再実行時に実行し直さない結果のstatus
+DONE_STATUSES = ("completed", "pending")
+# ワーカー数で割って各ワーカーに渡す流量制限の環境変数（scheduler.build_schedulerが読む）
+RATE_LIMIT_ENV = ("LLM_RATE_LIMIT_RPM", "LLM_RATE_LIMIT_TPM")
+# HumanFeedbackでの自動承認を繰り返す回数の上限（承認後に再び中断した場合の無限ループを防ぐ）
+MAX_APPROVALS = 3
+
+
+def job_key(job: dict) -> str:
+    """ジョブのキーを返します。`key`がない場合は、ジョブの各列の値から作成します。"""
+    if job.get("key"):
+        return str(job["key"])
+    payload = json.dumps([str(job[field]).strip() for field in JOB_FIELDS], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def load_manifest(path: str) -> list[dict]:
+    """マニフェストを読み込み、ジョブのリストを返します。必要な列がないジョブがある場合はValueErrorを送出します。"""
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            jobs = list(csv.DictReader(f))
+        elif path.endswith(".json"):
+            jobs = json.load(f)
+        else:
+            jobs = [json.loads(line) for line in f if line.strip()]
+
+    for number, job in enumerate(jobs, start=1):
+        missing = [field for field in JOB_FIELDS if job.get(field) in (None, "")]
+        if missing:
+            raise ValueError(f"Job {number} in {path} is missing {', '.join(missing)}")
+    return jobs
+
+
+def load_done_keys(path: str) -> set[str]:
+    """
+    出力のJSONLから、完了済みのジョブのキーを返します。
+    書き込み途中で停止した場合の不完全な最終行は読み飛ばします。
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("status") in DONE_STATUSES:
+                done.add(record["key"])
+    return done
+
+
+class ResultWriter:
+    """結果を1件ずつJSONLに追記し、そのたびにフラッシュしてディスクに書き出します。"""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a+", encoding="utf-8")
+        # 前回の実行が行の途中で停止していた場合は改行を補い、次の結果と同じ行にならないようにする
+        if self._file.tell() > 0:
+            self._file.seek(self._file.tell() - 1)
+            if self._file.read(1) != "\n":
+                self._file.write("\n")
+
+    def write(self, record: dict):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def split_shards(jobs: list, shard_size: int) -> list[list]:
+    return [jobs[i:i + shard_size] for i in range(0, len(jobs), shard_size)]
+
+
+#######------------------------------------------------------------
+# ワーカープロセス側の処理
+
+# initializerで受け取る結果のキューと実行設定（プロセスごとに1つ）
+_worker = {}
+
+
+def worker_rate_limits(workers: int) -> dict[str, str]:
+    """
+    流量制限の環境変数の値をワーカー数で割り、各ワーカーに設定する {環境変数名: 値} を返します。
+    graph.pyと同じく.envも読むため、.envにだけ設定した流量制限も分割されます。設定されていない流量制限は含めません。
+    """
+    from dotenv import load_dotenv
+
+    load_dotenv(".env")
+    limits = {}
+    for name in RATE_LIMIT_ENV:
+        value = os.environ.get(name)
+        if value:
+            limits[name] = str(float(value) / workers)
+    return limits
+
+
+def _init_worker(results, concurrency: int, approve, interactive: bool, rate_limits: dict | None = None):
+    # graphをインポートする前に設定するため、.envの値より優先される（load_dotenvは設定済みの環境変数を上書きしない）
+    os.environ.update(rate_limits or {})
+    _worker.update(results=results, concurrency=concurrency, approve=approve, interactive=interactive)
+
+
+def _final_outline(values: dict) -> str | None:
+    from langchain_core.messages import AIMessage
+
+    for message in reversed(values.get("messages", [])):
+        if isinstance(message, AIMessage):
+            return str(message.content)
+    return None
+
+
+async def _run_job(graph, job: dict) -> dict:
+    """
+    1件のジョブを実行し、結果のレコードを返します。
+    チェックポイントが残っている場合は、最初から実行せずにHumanFeedbackでの中断から再開します。
+    チェックポイント上で完了済みのジョブ（結果を書き込む前に停止した場合など）は、グラフを実行せずにその結果を返します。
+    """
+    from langgraph.types import Command
+    from blog_makearticle2.src.batch import build_config, build_initial_state
+
+    key = job_key(job)
+    thread_id = f"bulk-{key}"
+    config = build_config(job, thread_id)
+    record = {"key": key, "job": job, "thread_id": thread_id, "worker": os.getpid()}
+    start = time.perf_counter()
+    try:
+        snapshot = await graph.aget_state(config)
+        if not snapshot.values:
+            # 未実行のジョブだけを初期状態から実行する（完了済みのスレッドに初期状態を渡すと、生成をやり直してしまう）
+            await graph.ainvoke(build_initial_state(job), config)
+            snapshot = await graph.aget_state(config)
+        elif snapshot.next and not any(task.interrupts for task in snapshot.tasks):
+            # 前回の実行が途中で失敗・停止したジョブは、残りのノードから実行を続ける
+            await graph.ainvoke(None, config)
+            snapshot = await graph.aget_state(config)
+        approvals = 0
+        while snapshot.next and not _worker["interactive"] and approvals < MAX_APPROVALS:
+            await graph.ainvoke(Command(resume=_worker["approve"]), config)
+            snapshot = await graph.aget_state(config)
+            approvals += 1
+    except Exception as e:
+        return {**record, "status": "failed", "error": repr(e), "elapsed_s": time.perf_counter() - start}
+
+    values = snapshot.values
+    return {
+        **record,
+        "status": "pending" if snapshot.next else "completed",
+        "outline": _final_outline(values),
+        "article": values.get("article"),
+        "elapsed_s": time.perf_counter() - start,
+    }
+
+
+async def _run_shard_async(jobs: list[dict]):
+    # グラフ（モデルのクライアント・プロファイルのキャッシュを含む）はワーカープロセスごとに読み込む
+    from blog_makearticle2.src.graph import graph
+
+    semaphore = asyncio.Semaphore(_worker["concurrency"])
+
+    async def _run(job):
+        async with semaphore:
+            record = await _run_job(graph, job)
+        _worker["results"].put(("result", record))
+
+    await asyncio.gather(*(_run(job) for job in jobs))
+
+
+def run_shard(shard_id: int, jobs: list[dict]) -> int:
+    """シャードのジョブを実行し、結果をキューに送ります。すべて送った後に完了の通知を送ります。"""
+    asyncio.run(_run_shard_async(jobs))
+    _worker["results"].put(("shard_done", shard_id))
+    return len(jobs)
+
+
+#######------------------------------------------------------------
+# 親プロセス側の処理
+
+def run_bulk(
+    manifest: str,
+    output: str,
+    workers: int | None = None,
+    concurrency: int = 8,
+    shard_size: int = 100,
+    approve="yes",
+    interactive: bool = False,
+) -> dict:
+    """
+    マニフェストのうち未完了のジョブを実行し、結果を`output`に追記します。件数の集計を返します。
+    ワーカーが異常終了した場合も、それまでに届いた結果は書き込み済みのため、再実行すれば残りのジョブから続行します。
+    """
+    jobs = load_manifest(manifest)
+    done = load_done_keys(output)
+
+    # 同じキーのジョブがマニフェストに重複している場合は1回だけ実行する
+    pending, seen = [], set(done)
+    for job in jobs:
+        key = job_key(job)
+        if key not in seen:
+            seen.add(key)
+            pending.append(job)
+    summary = {"jobs": len(jobs), "skipped": len(jobs) - len(pending), "completed": 0, "pending": 0, "failed": 0}
+    if not pending:
+        return summary
+
+    shards = split_shards(pending, shard_size)
+    workers = min(workers or os.cpu_count() or 1, len(shards))
+    # フォークするとスレッドやHTTPクライアントの状態を引き継ぐため、ワーカーはspawnで起動する
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    writer = ResultWriter(output)
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(results, concurrency, approve, interactive, worker_rate_limits(workers)),
+        ) as executor:
+            futures = [executor.submit(run_shard, shard_id, shard) for shard_id, shard in enumerate(shards)]
+            finished_shards = set()
+            while True:
+                try:
+                    kind, payload = results.get(timeout=0.5)
+                except queue.Empty:
+                    # 正常に終わったシャードの結果をすべて受け取り、残りのシャードも終わっていれば終了する
+                    if all(future.done() for future in futures) and all(
+                        shard_id in finished_shards
+                        for shard_id, future in enumerate(futures)
+                        if future.exception() is None
+                    ):
+                        break
+                    continue
+                if kind == "shard_done":
+                    finished_shards.add(payload)
+                    continue
+                writer.write(payload)
+                summary[payload["status"]] += 1
+
+            errors = [future.exception() for future in futures if future.exception() is not None]
+            if errors:
+                summary["worker_errors"] = [repr(error) for error in errors]
+    finally:
+        writer.close()
+    summary["elapsed_s"] = time.perf_counter() - start
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Runs outline jobs from a manifest across a process pool and appends results to JSONL."
+    )
+    parser.add_argument("manifest", type=str, help="Manifest of jobs (.jsonl, .json or .csv)")
+    parser.add_argument("-o", "--output", type=str, default="bulk_results.jsonl", help="JSONL file to append results to")
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="Worker processes (default: CPU count); LLM_RATE_LIMIT_RPM and LLM_RATE_LIMIT_TPM are divided among them",
+    )
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent jobs per worker")
+    parser.add_argument("--shard-size", type=int, default=100, help="Jobs per shard sent to a worker")
+    parser.add_argument("--approve", type=str, default="yes", help="Feedback used to auto-approve at HumanFeedback")
+    parser.add_argument(
+        "--interactive", action="store_true",
+        help="Do not auto-approve; record jobs stopped at HumanFeedback as pending",
+    )
+    args = parser.parse_args()
+
+    summary = run_bulk(
+        args.manifest,
+        args.output,
+        workers=args.workers,
+        concurrency=args.concurrency,
+        shard_size=args.shard_size,
+        approve=args.approve,
+        interactive=args.interactive,
+    )
+    print(json.dumps(summary, ensure_ascii=False), file=sys.stderr)
+    sys.exit(1 if summary["failed"] or summary.get("worker_errors") else 0)
@@ -0,0 +1,235 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+logger = logging.getLogger(__name__)
+
+# スレッドごとに保持するチェックポイント数
+DEFAULT_KEEP_LAST = 5
+# 最後の更新からこの秒数を過ぎたスレッドは削除する
+DEFAULT_THREAD_TTL = 24 * 60 * 60
+# バックグラウンドでコンパクションを行う間隔（秒）
+DEFAULT_COMPACT_INTERVAL = 5 * 60
+
+
+class PrunedMemorySaver(MemorySaver):
+    """
+    スレッドごとに直近`keep_last`件のチェックポイントだけを保持するMemorySaverです。
+    `compact()`で、`thread_ttl`秒以上更新のないスレッドを削除します。
+    """
+
+    def __init__(self, *, keep_last: int = DEFAULT_KEEP_LAST, thread_ttl: float | None = DEFAULT_THREAD_TTL, **kwargs):
+        super().__init__(**kwargs)
+        self.keep_last = keep_last
+        self.thread_ttl = thread_ttl
+        self.last_activity = {}  # thread_id -> 最終更新時刻
+        self.lock = threading.RLock()
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        with self.lock:
+            next_config = super().put(config, checkpoint, metadata, new_versions)
+            thread_id = config["configurable"]["thread_id"]
+            self.last_activity[thread_id] = time.time()
+            self._prune_thread(thread_id, config["configurable"]["checkpoint_ns"])
+        return next_config
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        with self.lock:
+            super().put_writes(config, writes, task_id, task_path)
+
+    def delete_thread(self, thread_id):
+        with self.lock:
+            super().delete_thread(thread_id)
+            self.last_activity.pop(thread_id, None)
+
+    def _prune_thread(self, thread_id, checkpoint_ns):
+        """スレッドの古いチェックポイントと、それだけが参照していた書き込み・チャネル値を削除します。"""
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        if len(checkpoints) <= self.keep_last:
+            return
+        # チェックポイントIDは時系列順に並ぶため、降順で先頭keep_last件を残す
+        ordered = sorted(checkpoints, reverse=True)
+        for checkpoint_id in ordered[self.keep_last:]:
+            del checkpoints[checkpoint_id]
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+
+        # 残したチェックポイントが参照していないチャネル値を削除する
+        referenced = set()
+        for saved_checkpoint, _, _ in checkpoints.values():
+            for channel, version in self.serde.loads_typed(saved_checkpoint)["channel_versions"].items():
+                referenced.add((thread_id, checkpoint_ns, channel, version))
+        for key in [k for k in self.blobs if k[0] == thread_id and k[1] == checkpoint_ns]:
+            if key not in referenced:
+                del self.blobs[key]
+
+    def compact(self):
+        """更新が途絶えたスレッドを削除します。"""
+        if self.thread_ttl is None:
+            return
+        deadline = time.time() - self.thread_ttl
+        with self.lock:
+            idle = [t for t, updated_at in self.last_activity.items() if updated_at < deadline]
+            for thread_id in idle:
+                self.delete_thread(thread_id)
+        if idle:
+            logger.info("Evicted %d idle checkpoint threads", len(idle))
+
+
+class PrunedSqliteSaver(SqliteSaver):
+    """
+    チェックポイントをローカルのSQLiteに保存し、スレッドごとに直近`keep_last`件だけを保持するSqliteSaverです。
+    プロセスを再起動しても、HumanFeedbackで中断中のスレッドを再開できます。
+    `compact()`で、`thread_ttl`秒以上更新のないスレッドの削除とデータベースファイルの縮小を行います。
+    """
+
+    def __init__(self, conn, *, keep_last: int = DEFAULT_KEEP_LAST, thread_ttl: float | None = DEFAULT_THREAD_TTL, **kwargs):
+        super().__init__(conn, **kwargs)
+        self.keep_last = keep_last
+        self.thread_ttl = thread_ttl
+
+    def setup(self):
+        if self.is_setup:
+            return
+        super().setup()
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS thread_activity (
+                thread_id TEXT PRIMARY KEY,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS thread_activity_updated_at ON thread_activity (updated_at);
+            """
+        )
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        next_config = super().put(config, checkpoint, metadata, new_versions)
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        with self.cursor() as cur:
+            cur.execute(
+                "INSERT OR REPLACE INTO thread_activity (thread_id, updated_at) VALUES (?, ?)",
+                (thread_id, time.time()),
+            )
+            # 直近keep_last件より古いチェックポイントと、それに紐づく書き込みを削除する
+            cur.execute(
+                """
+                DELETE FROM checkpoints
+                WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN (
+                    SELECT checkpoint_id FROM checkpoints
+                    WHERE thread_id = ? AND checkpoint_ns = ?
+                    ORDER BY checkpoint_id DESC LIMIT ?
+                )
+                """,
+                (thread_id, checkpoint_ns, thread_id, checkpoint_ns, self.keep_last),
+            )
+            if cur.rowcount:
+                cur.execute(
+                    """
+                    DELETE FROM writes
+                    WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN (
+                        SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?
+                    )
+                    """,
+                    (thread_id, checkpoint_ns, thread_id, checkpoint_ns),
+                )
+        return next_config
+
+    def delete_thread(self, thread_id):
+        super().delete_thread(thread_id)
+        with self.cursor() as cur:
+            cur.execute("DELETE FROM thread_activity WHERE thread_id = ?", (str(thread_id),))
+
+    def compact(self):
+        """更新が途絶えたスレッドを削除し、WALとデータベースファイルを縮小します。"""
+        if self.thread_ttl is not None:
+            deadline = time.time() - self.thread_ttl
+            with self.cursor() as cur:
+                idle = [
+                    row[0] for row in cur.execute(
+                        "SELECT thread_id FROM thread_activity WHERE updated_at < ?", (deadline,)
+                    )
+                ]
+            for thread_id in idle:
+                self.delete_thread(thread_id)
+            if idle:
+                logger.info("Evicted %d idle checkpoint threads", len(idle))
+        with self.cursor() as cur:
+            cur.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            cur.execute("PRAGMA incremental_vacuum")
+
+    # SqliteSaverは非同期APIを提供しないため、同期APIをスレッドで実行して graph.ainvoke でも使えるようにする
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        items = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in items:
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id):
+        return await asyncio.to_thread(self.delete_thread, thread_id)
+
+
+def start_compaction(saver, interval: float = DEFAULT_COMPACT_INTERVAL) -> threading.Event:
+    """
+    バックグラウンドのデーモンスレッドで定期的に`saver.compact()`を実行します。
+    返されたEventをsetすると停止します。
+    """
+    stop = threading.Event()
+
+    def _run():
+        while not stop.wait(interval):
+            try:
+                saver.compact()
+            except Exception:
+                logger.exception("Checkpoint compaction failed")
+
+    threading.Thread(target=_run, name="checkpoint-compaction", daemon=True).start()
+    return stop
+
+
+def build_checkpointer():
+    """
+    環境変数の設定に応じてチェックポインタを作成し、バックグラウンドのコンパクションを開始します。
+    - CHECKPOINTER: "memory"（デフォルト）または "sqlite"
+    - CHECKPOINT_DB_PATH: SQLiteのファイルパス
+    - CHECKPOINT_KEEP_LAST: スレッドごとに保持するチェックポイント数
+    - CHECKPOINT_THREAD_TTL: 更新のないスレッドを削除するまでの秒数
+    - CHECKPOINT_COMPACT_INTERVAL: コンパクションの実行間隔（秒）
+    """
+    # .envで空欄のまま読み込まれた設定（""）は未設定として既定値を使う
+    backend = os.environ.get("CHECKPOINTER") or "memory"
+    keep_last = int(os.environ.get("CHECKPOINT_KEEP_LAST") or DEFAULT_KEEP_LAST)
+    thread_ttl = float(os.environ.get("CHECKPOINT_THREAD_TTL") or DEFAULT_THREAD_TTL)
+    interval = float(os.environ.get("CHECKPOINT_COMPACT_INTERVAL") or DEFAULT_COMPACT_INTERVAL)
+
+    if backend == "memory":
+        saver = PrunedMemorySaver(keep_last=keep_last, thread_ttl=thread_ttl)
+    elif backend == "sqlite":
+        path = os.environ.get("CHECKPOINT_DB_PATH") or ".checkpoints/checkpoints.sqlite"
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(path, check_same_thread=False)
+        # 削除した領域をincremental_vacuumで解放できるようにする（新規作成したファイルにのみ反映される）
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        saver = PrunedSqliteSaver(conn, keep_last=keep_last, thread_ttl=thread_ttl)
+    else:
+        raise ValueError(f"Unknown CHECKPOINTER: {backend}")
+
+    start_compaction(saver, interval)
+    return saver
@@ -0,0 +1,118 @@
+import functools
+import logging
+
+from langchain_core.messages import AIMessage, BaseMessage
+
+from blog_makearticle2.src.prompts import build_outline_messages
+
+logger = logging.getLogger(__name__)
+
+# アウトライン生成時に送るコンテキストのトークン上限（configの`maxContextTokens`で上書きできる）
+DEFAULT_MAX_CONTEXT_TOKENS = 12000
+
+# メッセージ1件あたりのロール等によるトークンのオーバーヘッド
+_TOKENS_PER_MESSAGE = 4
+
+
+@functools.lru_cache(maxsize=None)
+def _get_encoding(model_name: str):
+    """tiktokenのエンコーダを返します。利用できない場合はNoneを返します。"""
+    try:
+        import tiktoken
+
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        # エンコーダの定義ファイルを取得できない環境では文字数で近似する
+        logger.warning("tiktoken encoding is unavailable; falling back to character counts")
+        return None
+
+
+def count_text_tokens(text: str, model_name: str = "gpt-4o-mini") -> int:
+    """テキストのトークン数をローカルのトークナイザで数えます。"""
+    encoding = _get_encoding(model_name)
+    if encoding is None:
+        # 日本語は1文字あたりおよそ1トークンのため、文字数を上限側の近似として使う
+        return len(text)
+    return len(encoding.encode(text))
+
+
+def truncate_text_tokens(text: str, max_tokens: int, model_name: str = "gpt-4o-mini") -> str:
+    """テキストを先頭から`max_tokens`トークン分に切り詰めます。"""
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding(model_name)
+    if encoding is None:
+        return text[:max_tokens]
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+
+def count_message_tokens(messages: list, model_name: str = "gpt-4o-mini") -> int:
+    """メッセージ列全体のトークン数を数えます。"""
+    total = 0
+    for message in messages:
+        content = message.content if isinstance(message, BaseMessage) else str(message)
+        total += count_text_tokens(content, model_name) + _TOKENS_PER_MESSAGE
+    return total
+
+
+def build_outline_context(
+    messages: list,
+    profile_block: str,
+    write_word: str,
+    feedback: str | None = None,
+    max_tokens: int = DEFAULT_MAX_CONTEXT_TOKENS,
+    model_name: str = "gpt-4o-mini",
+    feedback_prompt: str | None = None,
+    profile_excerpt: str = "",
+) -> list:
+    """
+    アウトライン再生成ループで送るメッセージ列を、一定のトークン数に収まるよう組み立てます。
+    最初のAIメッセージより前の依頼文、プロファイル情報、最新のアウトライン、最新のフィードバックのみを残し、
+    それより古い生成ラウンドは破棄します。上限を超える場合はプロファイル情報を切り詰め、
+    プロファイル情報を除いても超える場合は最新のアウトラインを末尾から切り詰めます。
+    依頼文とフィードバックだけで上限を超える場合は切り詰めずに送り、警告をログに記録します。
+    `feedback_prompt`を指定した場合は、フィードバックの指示の代わりにそれを最後に送ります。
+    `profile_excerpt`（キーワードに関連するプロファイル情報）はキーワードの後ろに置き、切り詰めません。
+    """
+    # 最初のアウトラインより前のメッセージを依頼文として扱う
+    first_ai = next((i for i, m in enumerate(messages) if isinstance(m, AIMessage)), len(messages))
+    seed_messages = list(messages[:first_ai])
+    latest_outline = next((m for m in reversed(messages) if isinstance(m, AIMessage)), None)
+
+    # プロファイル情報を除いた部分のトークン数から、プロファイル情報に使えるトークン数を算出する
+    without_profile = build_outline_messages(
+        seed_messages, "", write_word, latest_outline, feedback, feedback_prompt, profile_excerpt
+    )
+    overflow = count_message_tokens(without_profile, model_name) - max_tokens
+    budget = max(0, -overflow)
+    profile_tokens = count_text_tokens(profile_block, model_name)
+    if profile_tokens > budget:
+        logger.info(
+            "Outline context exceeds the budget (%d > %d tokens); truncating the profile block",
+            profile_tokens, budget,
+        )
+        profile_block = truncate_text_tokens(profile_block, budget, model_name)
+
+    if overflow > 0 and latest_outline is not None:
+        # プロファイル情報を除いても上限を超える場合は、最新のアウトラインを超過分だけ切り詰める
+        content = str(latest_outline.content)
+        keep = count_text_tokens(content, model_name) - overflow
+        logger.info("Outline context exceeds the budget by %d tokens; truncating the latest outline", overflow)
+        latest_outline = latest_outline.model_copy(update={"content": truncate_text_tokens(content, keep, model_name)})
+
+    result = build_outline_messages(
+        seed_messages, profile_block, write_word, latest_outline, feedback, feedback_prompt, profile_excerpt
+    )
+    total = count_message_tokens(result, model_name)
+    if total > max_tokens:
+        logger.warning(
+            "Outline context still exceeds the budget (%d > %d tokens); the request and feedback alone do not fit",
+            total, max_tokens,
+        )
+    return result
@@ -0,0 +1,110 @@
+"""Google Ads APIに接続せずにキーワードアイデアを返すローカル用のフェイクです。"""
+
+import hashlib
+import time
+from types import SimpleNamespace
+
+# 実際のKeywordPlanCompetitionLevelEnumと同じ名前の競合度
+_COMPETITION_LEVELS = ("LOW", "MEDIUM", "HIGH", "UNSPECIFIED")
+
+# シードキーワードから派生キーワードを作るための語
+_DEFAULT_SUFFIXES = ("とは", "比較", "おすすめ", "事例", "メリット", "費用", "ツール", "やり方")
+
+
+def _stable_int(text: str) -> int:
+    """実行ごとに変わらない整数を文字列から作成します。"""
+    return int.from_bytes(hashlib.md5(text.encode("utf-8")).digest()[:4], "big")
+
+
+def _make_idea(text: str):
+    """KeywordPlanIdeaServiceが返すGenerateKeywordIdeaResultと同じ属性を持つオブジェクトを作成します。"""
+    seed = _stable_int(text)
+    return SimpleNamespace(
+        text=text,
+        keyword_idea_metrics=SimpleNamespace(
+            avg_monthly_searches=(seed % 50) * 100,
+            competition=SimpleNamespace(name=_COMPETITION_LEVELS[seed % len(_COMPETITION_LEVELS)]),
+        ),
+    )
+
+
+class FakeKeywordPlanIdeaService:
+    """
+    KeywordPlanIdeaServiceのフェイクです。
+    シードキーワードごとに決まった派生キーワードと指標を返すため、同じリクエストには常に同じ結果を返します。
+    """
+
+    def __init__(self, suffixes=_DEFAULT_SUFFIXES, latency: float = 0.0):
+        self.suffixes = suffixes
+        self.latency = latency
+        self.requests = []  # 受け取ったリクエスト（呼び出し回数の確認用）
+
+    def generate_keyword_ideas(self, request):
+        self.requests.append(request)
+        if self.latency:
+            time.sleep(self.latency)
+
+        keywords = list(request.keyword_seed.keywords) + list(request.keyword_and_url_seed.keywords)
+        if not keywords and (request.url_seed.url or request.keyword_and_url_seed.url):
+            keywords = [request.url_seed.url or request.keyword_and_url_seed.url]
+
+        ideas = []
+        for keyword in keywords:
+            ideas.append(_make_idea(keyword))
+            ideas.extend(_make_idea(f"{keyword} {suffix}") for suffix in self.suffixes)
+        return ideas
+
+
+class _FakeGoogleAdsService:
+    def language_constant_path(self, language_id):
+        return f"languageConstants/{language_id}"
+
+
+class _FakeGeoTargetConstantService:
+    def geo_target_constant_path(self, location_id):
+        return f"geoTargetConstants/{location_id}"
+
+
+def _make_request():
+    """GenerateKeywordIdeasRequestと同じフィールドを持つオブジェクトを作成します。"""
+    return SimpleNamespace(
+        customer_id=None,
+        language=None,
+        geo_target_constants=[],
+        include_adult_keywords=False,
+        keyword_plan_network=None,
+        url_seed=SimpleNamespace(url=""),
+        keyword_seed=SimpleNamespace(keywords=[]),
+        keyword_and_url_seed=SimpleNamespace(url="", keywords=[]),
+    )
+
+
+class FakeGoogleAdsClient:
+    """
+    utils.mainが利用する範囲だけを実装したGoogleAdsClientのフェイクです。
+    ネットワークに接続しないため、ローカルでの動作確認やベンチマークに利用できます。
+    """
+
+    def __init__(self, keyword_plan_idea_service: FakeKeywordPlanIdeaService | None = None):
+        self.keyword_plan_idea_service = keyword_plan_idea_service or FakeKeywordPlanIdeaService()
+        self.enums = SimpleNamespace(
+            KeywordPlanCompetitionLevelEnum=SimpleNamespace(
+                **{level: level for level in _COMPETITION_LEVELS}
+            ),
+            KeywordPlanNetworkEnum=SimpleNamespace(
+                GOOGLE_SEARCH_AND_PARTNERS="GOOGLE_SEARCH_AND_PARTNERS"
+            ),
+        )
+        self._services = {
+            "KeywordPlanIdeaService": self.keyword_plan_idea_service,
+            "GoogleAdsService": _FakeGoogleAdsService(),
+            "GeoTargetConstantService": _FakeGeoTargetConstantService(),
+        }
+
+    def get_service(self, name, version=None):
+        return self._services[name]
+
+    def get_type(self, name, version=None):
+        if name != "GenerateKeywordIdeasRequest":
+            raise ValueError(f"Unsupported type: {name}")
+        return _make_request()
@@ -0,0 +1,93 @@
+"""OpenAI APIに接続せずに決まった応答を返すローカル用のチャットモデルです。"""
+
+import hashlib
+import time
+from typing import Any, Iterator
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    レイテンシとトークン数を設定できる決定的なチャットモデルです。
+    同じ入力には常に同じ見出し付きのアウトラインを返し、usage_metadataも付与します。
+    """
+
+    model_name: str = "fake-chat"
+    # 最初のトークンが返るまでの秒数
+    first_token_latency: float = 0.0
+    # 2トークン目以降の1トークンあたりの秒数
+    token_latency: float = 0.0
+    # 生成するトークン数（1トークン = 1チャンク）
+    completion_tokens: int = 200
+    # 1回の応答に含める見出しの数
+    sections: int = 5
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"model_name": self.model_name, "completion_tokens": self.completion_tokens}
+
+    def _tokens(self, messages: list[BaseMessage]) -> list[str]:
+        """入力に応じて決まる応答をトークン（チャンク）のリストとして作成します。"""
+        digest = hashlib.md5("".join(str(m.content) for m in messages).encode("utf-8")).hexdigest()
+        lines = [f"# アウトライン {digest[:8]}\n"]
+        for i in range(1, self.sections + 1):
+            lines.append(f"## 見出し{i}\n")
+            lines.append(f"- 見出し{i}の要点\n")
+        tokens = list("".join(lines))
+        # 指定されたトークン数に揃える
+        if len(tokens) < self.completion_tokens:
+            tokens += ["。"] * (self.completion_tokens - len(tokens))
+        return tokens[: self.completion_tokens]
+
+    def _usage(self, messages: list[BaseMessage]) -> dict:
+        input_tokens = sum(len(str(m.content)) for m in messages)
+        return {
+            "input_tokens": input_tokens,
+            "output_tokens": self.completion_tokens,
+            "total_tokens": input_tokens + self.completion_tokens,
+        }
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        tokens = self._tokens(messages)
+        time.sleep(self.first_token_latency + self.token_latency * max(len(tokens) - 1, 0))
+        message = AIMessage(
+            content="".join(tokens),
+            usage_metadata=self._usage(messages),
+            response_metadata={"model_name": self.model_name},
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        tokens = self._tokens(messages)
+        for i, token in enumerate(tokens):
+            time.sleep(self.first_token_latency if i == 0 else self.token_latency)
+            # on_llm_new_tokenはBaseChatModel側で呼ばれるため、ここではチャンクを返すだけにする
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+        # 最後のチャンクにトークン使用量を付与する（OpenAIのstream_usageと同じ形）
+        yield ChatGenerationChunk(
+            message=AIMessageChunk(
+                content="",
+                usage_metadata=self._usage(messages),
+                response_metadata={"model_name": self.model_name},
+            )
+        )
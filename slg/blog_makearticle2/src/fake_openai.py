@@ -0,0 +1,214 @@
+"""
+OpenAIのChat Completions APIを模したローカルのHTTPサーバーです。
+応答までの遅延・429/500の発生率・応答しない（ストール）リクエストの発生率をモデルごとに設定でき、
+スケジューラ（scheduler.py）の流量制限・再試行・ヘッジ・代替モデルへの切り替えを外部に接続せずに確認できます。
+
+起動例（slgディレクトリで実行）:
+    python -m blog_makearticle2.src.fake_openai --port 8090 --failure-rate 0.2
+    OPENAI_BASE_URL=http://127.0.0.1:8090/v1 ...
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _outline_text(messages: list, sections: int = 5) -> str:
+    """入力に応じて決まる見出し付きの応答を作成します。"""
+    digest = hashlib.md5(json.dumps(messages, ensure_ascii=False).encode("utf-8")).hexdigest()
+    lines = [f"# アウトライン {digest[:8]}\n"]
+    for i in range(1, sections + 1):
+        lines.append(f"## 見出し{i}\n- 見出し{i}の要点\n")
+    return "".join(lines)
+
+
+class FakeOpenAIServer:
+    """
+    Chat Completions API（/v1/chat/completions）のフェイクです。ストリーミング（SSE）とstream_options.include_usageに対応します。
+    `failing_models`に含まれるモデルへのリクエストは常に429を返すため、代替モデルへの切り替えを確認できます。
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        token_latency: float = 0.0,
+        failure_rate: float = 0.0,
+        failure_status: int = 429,
+        stall_rate: float = 0.0,
+        stall_seconds: float = 30.0,
+        failing_models: tuple = (),
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.failing_models = set(failing_models)
+        self.requests = []  # 受け取ったリクエストのモデル名（呼び出し回数の確認用）
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """呼び出したスレッドでリクエストを処理し続けます。"""
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _decide(self, model: str) -> str:
+        """リクエストの結果（ok・fail・stall）を決めます。"""
+        with self._lock:
+            self.requests.append(model)
+            if model in self.failing_models:
+                return "fail"
+            roll = self._random.random()
+        if roll < self.failure_rate:
+            return "fail"
+        if roll < self.failure_rate + self.stall_rate:
+            return "stall"
+        return "ok"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self.send_error(404)
+                    return
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                model = payload.get("model", "fake")
+                outcome = server._decide(model)
+
+                if outcome == "stall":
+                    time.sleep(server.stall_seconds)
+                if server.latency:
+                    time.sleep(server.latency)
+                if outcome == "fail":
+                    body = json.dumps({"error": {"message": "fake failure", "type": "rate_limit_error"}}).encode()
+                    self.send_response(server.failure_status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.send_header("Retry-After", "0")
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+
+                text = _outline_text(payload.get("messages", []))
+                prompt_tokens = sum(len(str(m.get("content", ""))) for m in payload.get("messages", []))
+                usage = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(text),
+                    "total_tokens": prompt_tokens + len(text),
+                }
+                completion_id = f"chatcmpl-fake-{hashlib.md5(text.encode()).hexdigest()[:12]}"
+                if payload.get("stream"):
+                    self._stream(completion_id, model, text, usage, payload)
+                else:
+                    body = json.dumps({
+                        "id": completion_id,
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{
+                            "index": 0,
+                            "message": {"role": "assistant", "content": text},
+                            "finish_reason": "stop",
+                        }],
+                        "usage": usage,
+                    }, ensure_ascii=False).encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+            def _stream(self, completion_id, model, text, usage, payload):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+
+                def _chunk(delta, finish_reason=None, chunk_usage=None):
+                    data = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [] if chunk_usage else [
+                            {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                        ],
+                    }
+                    if chunk_usage:
+                        data["usage"] = chunk_usage
+                    self.wfile.write(f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+
+                _chunk({"role": "assistant", "content": ""})
+                for line in text.splitlines(keepends=True):
+                    if server.token_latency:
+                        time.sleep(server.token_latency)
+                    _chunk({"content": line})
+                _chunk({}, finish_reason="stop")
+                if (payload.get("stream_options") or {}).get("include_usage"):
+                    _chunk({}, chunk_usage=usage)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+            def log_message(self, format, *args):
+                # アクセスログは出力しない
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a fake OpenAI Chat Completions endpoint.")
+    parser.add_argument("--port", type=int, default=8090, help="Port to listen on")
+    parser.add_argument("--latency", type=float, default=0.1, help="Seconds before the response headers")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="Share of requests that stall")
+    parser.add_argument("--stall-seconds", type=float, default=30.0, help="How long stalled requests hang")
+    parser.add_argument("--failing-model", action="append", default=[], help="Model that always gets 429")
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(
+        port=args.port,
+        latency=args.latency,
+        failure_rate=args.failure_rate,
+        stall_rate=args.stall_rate,
+        stall_seconds=args.stall_seconds,
+        failing_models=tuple(args.failing_model),
+    )
+    print(f"Serving a fake OpenAI endpoint at {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -1,139 +1,221 @@
+import logging
 import os
-import subprocess
-import pandas as pd
-from pandasql import sqldf
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from langchain_core.runnables.config import RunnableConfig
-from langgraph.types import interrupt, Command
-
-from blog_makearticle2.src.state import AgentState, initial_state, config
+from langchain_core.runnables.config import RunnableConfig, get_executor_for_config
+from langchain_core.messages import AIMessage
+from langchain_core.messages.ai import add_usage
+from langgraph.types import interrupt, Command, Send
+
+from blog_makearticle2.src.state import AgentState, SectionTask, initial_state, config
+from blog_makearticle2.src.profile_store import get_profile_store
+from blog_makearticle2.src.context import build_outline_context, DEFAULT_MAX_CONTEXT_TOKENS
+from blog_makearticle2.src.relevance import (
+    normalize_text,
+    DEFAULT_PROFILE_EXCERPT_TOKEN_BUDGET,
+    DEFAULT_PROFILE_TOKEN_BUDGET,
+    DEFAULT_SECTION_PROFILE_TOKEN_BUDGET,
+)
+from blog_makearticle2.src.profile_records import (
+    build_company_record,
+    build_persona_record,
+    build_product_record,
+    render_profile,
+    render_profile_excerpt,
+)
+from blog_makearticle2.src.singleflight import AsyncSingleFlight, SingleFlight, make_key
+from blog_makearticle2.src.prompts import (
+    ANALYST_SYSTEM_PROMPT,
+    build_section_messages,
+    render_section_feedback_prompt,
+    record_prompt_cache_usage,
+)
+from blog_makearticle2.src.outline import (
+    assemble_article,
+    join_outline,
+    outline_headings,
+    parse_section_feedback,
+    replace_section_body,
+    split_outline,
+)
+from blog_makearticle2.src.instrumentation import instrument_node, metrics, metrics_callback, start_metrics_server
 
 # Define the graph
-from langgraph.checkpoint.memory import MemorySaver
-from langgraph.graph import StateGraph, END
+from blog_makearticle2.src.checkpointer import build_checkpointer
+from langgraph.graph import StateGraph, START, END
+
+logger = logging.getLogger(__name__)
 
-# 環境変数の取得
+# 環境変数の取得（チェックポインタやメトリクスの設定に使うため、インポート時に読み込む）
 load_dotenv('.env') 
-openai_api_key = os.environ.get("OPENAI_API_KEY")
 
-# モデルの定義
-from langchain_openai import ChatOpenAI
-model = ChatOpenAI(openai_api_key=openai_api_key,model="gpt-4o-mini")
+# モデルの定義（langchain_openaiのインポートとクライアントの作成は時間がかかるため、最初のLLM呼び出しまで遅延させる）
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_model():
+    """プロセス内で共有するチャットモデルを返します。初回呼び出し時に作成します。"""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                from langchain_openai import ChatOpenAI
+                from blog_makearticle2.src.llm_cache import build_llm_cache
+                from blog_makearticle2.src.scheduler import build_scheduler, build_http_clients
+
+                # すべてのスレッドのリクエストを、共有の流量制限・再試行・ヘッジ・代替モデルの方針で送る（scheduler.py）
+                # ChatOpenAIのtimeoutはリクエストごとにhttpxクライアントのタイムアウトを上書きするため、両方に同じ値を渡す
+                timeout = float(os.environ.get("LLM_REQUEST_TIMEOUT") or 60)
+                http_client, http_async_client = build_http_clients(build_scheduler(), timeout=timeout)
+
+                # LLM_CACHE_PATHが設定されている場合は、同一プロンプトのレスポンスをローカルのキャッシュから返す
+                # streaming=Trueにより、生成中のトークンがコールバック経由で graph.astream(..., stream_mode="messages") に流れる
+                # stream_usage=Trueにより、ストリーミング時もトークン使用量がレスポンスに含まれる
+                _model = ChatOpenAI(
+                    openai_api_key=os.environ.get("OPENAI_API_KEY"),
+                    openai_api_base=os.environ.get("OPENAI_BASE_URL") or None,
+                    model="gpt-4o-mini",
+                    cache=build_llm_cache(),
+                    streaming=True,
+                    stream_usage=True,
+                    callbacks=[metrics_callback],  # トークン使用量と推定料金をノードごとに記録する
+                    http_client=http_client,
+                    http_async_client=http_async_client,
+                    timeout=timeout,  # 応答が止まったリクエストはタイムアウトさせ、スケジューラで再試行する
+                    max_retries=0,  # 再試行はスケジューラで行う
+                )
+    return _model
+
+
+def set_model(model):
+    """共有するチャットモデルを差し替えます（ベンチマークでフェイクのモデルを使う場合など）。Noneを渡すと次回呼び出し時に作成し直します。"""
+    global _model
+    with _model_lock:
+        _model = model
+
+# 同時に届いた同じ入力のプロファイル取得・LLM呼び出し・キーワードボリューム取得を1回にまとめる（singleflight.py）
+_profile_flight = SingleFlight("profile")
+_llm_flight = SingleFlight("llm")
+_keyword_flight = AsyncSingleFlight("keyword_volume")
+
+
+def invoke_model_once(messages: list, config: RunnableConfig, node: str) -> AIMessage:
+    """
+    モデルを呼び出し、応答を返します。同じモデル・同じメッセージ列の呼び出しが実行中であれば、その応答を共有します。
+    生成中のトークンがストリームに流れるのは実際に呼び出したスレッドのみで、待機側は完成した応答だけを受け取ります。
+    """
+    model = get_model()
+
+    def _invoke():
+        response = model.invoke(messages, config)
+        record_prompt_cache_usage(response, node)
+        return response
+
+    key = make_key(id(model), [(message.type, str(message.content).strip()) for message in messages])
+    # 応答のメッセージは各スレッドのstateに追加されるため、スレッド間で同じオブジェクトを共有しない
+    return _llm_flight.do(key, _invoke).model_copy()
+
+
+def profile_key(kind: str, *ids, query: str = "", budget: int = 0, excerpt_budget: int = 0) -> str:
+    """プロファイル情報の取得結果をまとめるためのキーを、IDと正規化したキーワード・トークン数の上限から作成します。"""
+    return make_key(kind, [str(id_) for id_ in ids], " ".join(normalize_text(query).split()), budget, excerpt_budget)
+
+# METRICS_PORTが設定されている場合は、/metrics と /metrics.json で計測結果を公開する
+if os.environ.get("METRICS_PORT"):
+    try:
+        start_metrics_server(int(os.environ["METRICS_PORT"]))
+    except OSError as e:
+        logger.warning("Failed to start the metrics server: %s", e)
+
+def get_profile_token_budget(config: RunnableConfig) -> int:
+    """
+    プロダクト・ペルソナの情報それぞれについて、キーワードによらずプロンプトの先頭側に置く部分のトークン数の上限を返します。
+    0の場合は絞り込みを行わず、すべての項目を先頭側に置きます。
+    """
+    budget = config.get("configurable", {}).get("profileTokenBudget")
+    if budget is None:
+        budget = os.environ.get("PROFILE_TOKEN_BUDGET") or DEFAULT_PROFILE_TOKEN_BUDGET
+    return int(budget)
+
+def get_profile_excerpt_token_budget(config: RunnableConfig) -> int:
+    """アウトライン作成時に、指定キーワードに関連する内容として追加するトークン数の上限を返します。0の場合は追加しません。"""
+    budget = config.get("configurable", {}).get("profileExcerptTokenBudget")
+    if budget is None:
+        budget = os.environ.get("PROFILE_EXCERPT_TOKEN_BUDGET") or DEFAULT_PROFILE_EXCERPT_TOKEN_BUDGET
+    return int(budget)
+
+def get_section_profile_token_budget(config: RunnableConfig) -> int:
+    """記事本文のセクションごとに、セクションに関連する内容として追加するトークン数の上限を返します。"""
+    budget = config.get("configurable", {}).get("sectionProfileTokenBudget")
+    if budget is None:
+        budget = os.environ.get("SECTION_PROFILE_TOKEN_BUDGET") or DEFAULT_SECTION_PROFILE_TOKEN_BUDGET
+    return int(budget)
+
+def fetch_company_record(site_id, company_id):
+    """インデックス済みのストアから会社データを取得し、レコードに変換します。"""
+    return build_company_record(site_id, company_id, get_profile_store().get_company(site_id, company_id))
+
+def fetch_product_record(site_id, product_id, query: str, budget: int, excerpt_budget: int):
+    """
+    インデックス済みのストアからプロダクトデータを取得し、キーワードによらない項目・文と、
+    クエリに関連する項目・文をそれぞれトークン数の上限まで選んだレコードに変換します。
+    """
+    row = get_profile_store().get_product(site_id, product_id)
+    return build_product_record(site_id, product_id, row, query, budget, excerpt_budget)
+
+def fetch_persona_record(site_id, product_id, persona_id, query: str, budget: int, excerpt_budget: int):
+    """
+    インデックス済みのストアからペルソナデータを取得し、キーワードによらない項目・文と、
+    クエリに関連する項目・文をそれぞれトークン数の上限まで選んだレコードに変換します。
+    """
+    row = get_profile_store().get_persona(site_id, product_id, persona_id)
+    return build_persona_record(site_id, product_id, persona_id, row, query, budget, excerpt_budget)
 
 #会社情報を取得するノード
 def QueryCompanyInfo(state: AgentState, config: dict):
     """
     指定された設定に基づいて、サービス情報をクエリします。
-    この関数は、指定された設定からサイトIDとサービスIDを取得し、データセットをロードしてサービス情報を取得するSQLクエリを実行します。
-    結果として得られた文字列を返します。
+    この関数は、指定された設定からサイトIDとサービスIDを取得し、プロファイルストアのインデックスから会社情報を取得します。
+    結果として得られたレコード（該当する行がない場合はNone）を返します。
     """ 
     # configからsite_idとcompany_idを取得
     site_id = config.get("configurable", {}).get("siteId")
     company_id = config.get("configurable", {}).get("companyId")
 
-    # データのロード
-    df = pd.read_csv("db/aibow_customerTable - companies.csv")
-
-    # SQLクエリを実行して該当するsite_idのフォームデータを取得
-    query = f"""
-    SELECT 
-        site_id,
-        company_name,
-        industry,
-        location,
-        website_url
-    FROM df 
-    WHERE site_id = '{site_id}' AND company_id = {company_id}
-    """
-    result = sqldf(query, locals())
-
-    # 結果を文字列として返す
-    if not result.empty:
-        query_result = "# 会社情報\n"
-        query_result += f"会社名: {result.iloc[0]['company_name']}\n"
-        query_result += f"業界: {result.iloc[0]['industry']}\n"
-        query_result += f"所在地: {result.iloc[0]['location']}\n"
-        query_result += f"ウェブサイト: {result.iloc[0]['website_url']}\n"
-        query_result += "\n会社情報のクエリ結果は以上です。\n"
-        return {"messages": [query_result]}
-    else:
-        query_result = "該当するデータが見つかりませんでした。"
-        return {"messages": [query_result]}
+    # 同じ会社の取得が実行中であれば、その結果を共有する
+    record = _profile_flight.do(profile_key("company", site_id, company_id), fetch_company_record, site_id, company_id)
+    return {"company": record}
 
 #サービス・プロダクト情報を取得するノード
 def QueryServiceProduct(state: AgentState, config: RunnableConfig) -> str:
     """
     指定された設定に基づいて、サービス・プロダクト情報をクエリします。
-    この関数は、指定された設定からサイトIDとプロダクトIDを取得し、データセットをロードしてサービス・プロダクト情報を取得するSQLクエリを実行します。
-    結果として得られた文字列を返します。
+    この関数は、指定された設定からサイトIDとプロダクトIDを取得し、プロファイルストアのインデックスから該当する行を取得します。
+    キーワードによらない内容と、指定キーワードに関連する内容をトークン数の上限まで選び、結果として得られたレコードを返します。
     """
 
     # configからsite_idとproduct_idを取得
     site_id = config.get("configurable", {}).get("siteId")
     product_id = config.get("configurable", {}).get("productId")
 
-    # データのロード
-    df = pd.read_csv("db/aibow_customerTable - products.csv")
-
-    # SQLクエリを実行して該当する site_id のプロダクトデータを取得
-    query = f"""
-    SELECT 
-        appeal_policy,
-        product_introduction,
-        functionality,
-        feature_1,
-        feature_2,
-        feature_3,
-        competitive_point,
-        problem_and_solution_1,
-        problem_and_solution_2,
-        problem_and_solution_3,
-        industry_pain_points,
-        target_approach_to_pain,
-        service_record,
-        client_partners,
-        credentials,
-        organization_size,
-        external_review,
-        price_advantage,
-        support_system,
-        faq
-    FROM df
-    WHERE site_id = '{site_id}' AND product_id = {product_id}
-    """
-    result = sqldf(query, locals())
-
-    # 結果を文字列として返す
-    if not result.empty:
-        query_result = "# 自社プロダクトの情報\n"
-        query_result += f"アピールポイント: {result.iloc[0]['appeal_policy']}\n"
-        query_result += f"製品紹介: {result.iloc[0]['product_introduction']}\n"
-        query_result += f"機能: {result.iloc[0]['functionality']}\n"
-        query_result += f"特徴: {result.iloc[0]['feature_1']}, {result.iloc[0]['feature_2']}, {result.iloc[0]['feature_3']}\n"
-        query_result += f"競争優位性: {result.iloc[0]['competitive_point']}\n"
-        query_result += f"課題と解決策: {result.iloc[0]['problem_and_solution_1']}, {result.iloc[0]['problem_and_solution_2']}, {result.iloc[0]['problem_and_solution_3']}\n"
-        query_result += f"業界のペインポイント: {result.iloc[0]['industry_pain_points']}\n"
-        query_result += f"ペインに対するアプローチ: {result.iloc[0]['target_approach_to_pain']}\n"
-        query_result += f"導入実績: {result.iloc[0]['service_record']}\n"
-        query_result += f"クライアント・パートナー: {result.iloc[0]['client_partners']}\n"
-        query_result += f"認証・実績: {result.iloc[0]['credentials']}\n"
-        query_result += f"組織規模: {result.iloc[0]['organization_size']}\n"
-        query_result += f"外部レビュー: {result.iloc[0]['external_review']}\n"
-        query_result += f"価格の優位性: {result.iloc[0]['price_advantage']}\n"
-        query_result += f"サポート体制: {result.iloc[0]['support_system']}\n"
-        query_result += f"FAQ: {result.iloc[0]['faq']}\n"
-        query_result += "自社プロダクトのクエリ結果は以上です。\n"
-        return {"messages": [query_result]}
-    else:
-        query_result = "No matching records found."  # 空の場合は文字列を返す
-        return {"messages": [query_result]}
+    # 同じプロダクト・同じキーワードの取得が実行中であれば、その結果を共有する
+    write_word = state.get("write_word", "")
+    budget = get_profile_token_budget(config)
+    excerpt_budget = get_profile_excerpt_token_budget(config)
+    record = _profile_flight.do(
+        profile_key("product", site_id, product_id, query=write_word, budget=budget, excerpt_budget=excerpt_budget),
+        fetch_product_record, site_id, product_id, write_word, budget, excerpt_budget,
+    )
+    return {"product": record}
 
 #顧客ペルソナを取得するノード
 def QueryCustomerPersona(state: AgentState, config: RunnableConfig) -> str:
     """
     指定された設定に基づいて、顧客ペルソナをクエリします。
-    この関数は、指定された設定からサイトIDとプロダクトIDを取得し、データセットをロードしてサービス・プロダクト情報を取得するSQLクエリを実行します。
-    結果として得られた文字列を返します。
+    この関数は、指定された設定からサイトIDとプロダクトIDを取得し、プロファイルストアのインデックスから該当する行を取得します。
+    キーワードによらない内容と、指定キーワードに関連する内容をトークン数の上限まで選び、結果として得られたレコードを返します。
     """
     
     # configからsite_idとpersona_idを取得
@@ -141,65 +223,26 @@ def QueryCustomerPersona(state: AgentState, config: RunnableConfig) -> str:
     persona_id = config.get("configurable", {}).get("personaId")
     product_id = config.get("configurable", {}).get("productId")
 
-    # データのロード
-    df = pd.read_csv("db/aibow_customerTable - customerpersonas.csv")
-
-    # SQLクエリを実行して該当する site_id のペルソナデータを取得
-    query = f"""
-    SELECT 
-        industry,
-        companySize,
-        employeeSize,
-        targetRegion,
-        existingClients,
-        customerPriceRange,
-        leadTimeToAdoption,
-        serviceDepartment,
-        position,
-        roleAndMission,
-        infoMethods,
-        selectionCriteria,
-        considerationTrigger,
-        businessIssues,
-        currentSolutionMethods,
-        productKnowledge,
-        persona_title,
-        age,
-        value,
-        pain
-    FROM df
-    WHERE site_id = '{site_id}' AND product_id = {product_id} AND persona_id = {persona_id}
+    # 同じペルソナ・同じキーワードの取得が実行中であれば、その結果を共有する
+    write_word = state.get("write_word", "")
+    budget = get_profile_token_budget(config)
+    excerpt_budget = get_profile_excerpt_token_budget(config)
+    record = _profile_flight.do(
+        profile_key("persona", site_id, product_id, persona_id, query=write_word, budget=budget, excerpt_budget=excerpt_budget),
+        fetch_persona_record, site_id, product_id, persona_id, write_word, budget, excerpt_budget,
+    )
+    return {"persona": record}
+
+def state_profile(state: AgentState) -> str:
+    """
+    stateのレコードを、プロンプトに渡すプロファイル情報のテキストにまとめます。
+    並列ノードの書き込み順に依存しないよう常に 会社 → プロダクト → ペルソナ の順にし、同じレコードからは同じテキストを作成します。
     """
-    result = sqldf(query, locals())
+    return render_profile(state.get("company"), state.get("product"), state.get("persona"))
 
-    # 結果を文字列として返す
-    if not result.empty:
-        query_result = "# 顧客ペルソナの情報\n"
-        query_result += f"業界: {result.iloc[0]['industry']}\n"
-        query_result += f"企業規模: {result.iloc[0]['companySize']}\n"
-        query_result += f"従業員数: {result.iloc[0]['employeeSize']}\n"
-        query_result += f"ターゲット地域: {result.iloc[0]['targetRegion']}\n"
-        query_result += f"既存クライアント: {result.iloc[0]['existingClients']}\n"
-        query_result += f"顧客の価格帯: {result.iloc[0]['customerPriceRange']}\n"
-        query_result += f"導入までのリードタイム: {result.iloc[0]['leadTimeToAdoption']}\n"
-        query_result += f"サービス部門: {result.iloc[0]['serviceDepartment']}\n"
-        query_result += f"ポジション: {result.iloc[0]['position']}\n"
-        query_result += f"役割とミッション: {result.iloc[0]['roleAndMission']}\n"
-        query_result += f"情報収集方法: {result.iloc[0]['infoMethods']}\n"
-        query_result += f"選定基準: {result.iloc[0]['selectionCriteria']}\n"
-        query_result += f"検討のきっかけ: {result.iloc[0]['considerationTrigger']}\n"
-        query_result += f"ビジネス課題: {result.iloc[0]['businessIssues']}\n"
-        query_result += f"現在の解決策: {result.iloc[0]['currentSolutionMethods']}\n"
-        query_result += f"プロダクトの知識: {result.iloc[0]['productKnowledge']}\n"
-        query_result += f"ペルソナのタイトル: {result.iloc[0]['persona_title']}\n"
-        query_result += f"年齢: {result.iloc[0]['age']}\n"
-        query_result += f"価値観: {result.iloc[0]['value']}\n"
-        query_result += f"ペインポイント: {result.iloc[0]['pain']}\n"
-        query_result += "顧客ペルソナのクエリ結果は以上です。\n"
-        return {"messages": [query_result]}
-    else:
-        query_result = "No matching records found."  # 空の場合は文字列を返す
-        return {"messages": [query_result]}
+def state_profile_excerpt(state: AgentState) -> str:
+    """stateのレコードのうち、指定キーワードに関連して追加で選んだ部分をテキストにまとめます。"""
+    return render_profile_excerpt(state.get("product"), state.get("persona"))
 
 # SEO記事のアウトラインを作成するノード
 def CreateOutline(state: AgentState, config: RunnableConfig) -> str:
@@ -212,27 +255,31 @@ def CreateOutline(state: AgentState, config: RunnableConfig) -> str:
     # stateから指定されたキーワードを取得
     write_word = state["write_word"]
 
-    # プロンプトの定義
-    outline_prompt = f"""
-    # 指定キーワード
-    {write_word}
-
-    # 定義
-    あなたはBtoB領域に特化した優秀なSEOライターです。
-
-    # 指示
-    ここまでの情報をもとにして、指定キーワードで検索順位上位を獲得するためのブログ記事のアウトラインを作成してください。
-    ## 補足情報
-    - アウトラインを作成する際は、ペルソナが抱えているであろう課題や疑問に焦点を当ててください。
-    - 記事内での比率は、ペルソナの課題や疑問に対する解決策が70%、自社プロダクトが30%程度となるよう記載してください。
-    - ペルソナが抱えている課題や疑問に対して、自社のサービス・プロダクトがどのように解決できるかを明確に示してください。
-    - 記事のタイトルは、ペルソナが検索するであろうキーワードを含むものにしてください。
-    - 記事の内容は、与えられている情報をすべて活用しようとせず、ペルソナが抱えている課題や疑問の解消を第一の目的としてください。
-    """
+    # 再生成の場合はスレッドごとの再生成回数を記録する
+    if state.get("remake_flag"):
+        metrics.record_regeneration(config.get("configurable", {}).get("thread_id"))
+
+    model = get_model()
+
+    # プロンプトは 指示 → プロファイル情報 → キーワード・キーワードに関連する情報 → 直前のアウトライン・フィードバック の順に組み立てる（prompts.py）
+    # プロファイル情報はキーワードによらないため、同じテナントのジョブ間でプロンプトの先頭部分が一致する
+    # 再生成ループでは、最新のアウトラインと最新のフィードバックのみを送り、トークン数を上限内に収める
+    max_context_tokens = config.get("configurable", {}).get("maxContextTokens", DEFAULT_MAX_CONTEXT_TOKENS)
+    messages = build_outline_context(
+        state["messages"],
+        state_profile(state),
+        write_word,
+        feedback=state.get("feedback") if state.get("remake_flag") else None,
+        max_tokens=max_context_tokens,
+        model_name=getattr(model, "model_name", "gpt-4o-mini"),
+        profile_excerpt=state_profile_excerpt(state),
+    )
 
     # OpenAI APIを呼び出してアウトラインを生成
-    outline_response = model.invoke(state["messages"] + [outline_prompt])
-    state["messages"].append(outline_response)
+    # configを渡すことで、生成中のトークンがチャンクとしてグラフのストリームに流れる
+    # invokeはストリームを最後まで受け取って組み立てたメッセージを返すため、それをstateに保存する
+    # 同じ入力のアウトライン生成が別のスレッドで実行中であれば、新たに呼び出さずにその結果を使う
+    outline_response = invoke_model_once(messages, config, "CreateOutline")
 
     return {"messages": [outline_response]}
 
@@ -243,79 +290,237 @@ def HumanFeedback(state: AgentState, config: RunnableConfig) -> str:
     この関数は、ヒューマンフィードバックを取得して、結果を返します。
     """
     # ヒューマンフィードバックを取得
-    feedback = interrupt("出力したアウトラインに満足していますか？（yes/no）:")
+    # 特定のセクションだけを直したい場合は {"sections": {セクション番号: コメント}} の形式で再開する
+    feedback = interrupt(
+        "出力したアウトラインに満足していますか？（yes/no、またはセクションごとのコメント {\"sections\": {番号: コメント}}）:"
+    )
     # stateの更新
     return {'feedback': feedback}
 
 # フィードバック評価ノード
-def EvaluateFeedback(state: AgentState) -> Command:
-    if state["feedback"] == 'yes':
-        return Command(update={"remake_flag": False}, goto=END)
-    else:
-        return Command(update={"remake_flag": True}, goto="CreateOutline")
+def EvaluateFeedback(state: AgentState, config: RunnableConfig) -> Command:
+    feedback = state["feedback"]
+    if feedback == 'yes':
+        # 承認されたアウトラインをセクションごとに分け、本文を並列に執筆する
+        return Command(
+            update={"remake_flag": False, "draft_sections": None},
+            goto=build_section_tasks(state, config),
+        )
+    # セクション単位のフィードバックの場合は、対象のセクションだけを再生成する
+    if parse_section_feedback(feedback):
+        return Command(update={"remake_flag": True}, goto="RegenerateSections")
+    if isinstance(feedback, dict):
+        # セクションの指定がない構造化フィードバックは、全体へのコメントとしてアウトライン全体を作り直す
+        return Command(update={"remake_flag": True, "feedback": str(feedback.get("comment") or "no")}, goto="CreateOutline")
+    return Command(update={"remake_flag": True}, goto="CreateOutline")
+
+# 指定されたセクションだけを再生成するノード
+def RegenerateSections(state: AgentState, config: RunnableConfig):
+    """
+    セクション単位のフィードバックに基づいて、直前のアウトラインのうち指定されたセクションだけを再生成します。
+    対象のセクションは並列に生成し、それ以外のセクションは直前のアウトラインの内容をそのまま使います。
+    再生成のコストは、アウトライン全体ではなく変更するセクションの数に比例します。
+    各セクションの呼び出しはinvoke_model_onceを通すため、別のスレッドで同じセクションの再生成が実行中であれば、その応答を共有します。
+    """
+    metrics.record_regeneration(config.get("configurable", {}).get("thread_id"))
+    model = get_model()
+
+    latest_outline = next(m for m in reversed(state["messages"]) if isinstance(m, AIMessage))
+    preamble, sections = split_outline(str(latest_outline.content))
+    targets = {
+        number: comment
+        for number, comment in parse_section_feedback(state["feedback"]).items()
+        if 1 <= number <= len(sections)
+    }
+    if not targets:
+        # 該当するセクションがない場合は、コメントをまとめてアウトライン全体を作り直す
+        comments = "\n".join(parse_section_feedback(state["feedback"]).values())
+        return Command(update={"feedback": comments or "no"}, goto="CreateOutline")
+
+    # 直前のアウトラインまでは通常の再生成と同じメッセージ列にし、プロンプトキャッシュを共有する
+    max_context_tokens = config.get("configurable", {}).get("maxContextTokens", DEFAULT_MAX_CONTEXT_TOKENS)
+    profile_block = state_profile(state)
+    profile_excerpt = state_profile_excerpt(state)
+    prompts = [
+        build_outline_context(
+            state["messages"],
+            profile_block,
+            state["write_word"],
+            max_tokens=max_context_tokens,
+            model_name=getattr(model, "model_name", "gpt-4o-mini"),
+            feedback_prompt=render_section_feedback_prompt(number, sections[number - 1], comment),
+            profile_excerpt=profile_excerpt,
+        )
+        for number, comment in targets.items()
+    ]
+    # model.batchと同じく、configのmax_concurrencyとコンテキスト（コールバック・ストリーム）を引き継ぐスレッドで並列に呼び出す
+    with get_executor_for_config(config) as executor:
+        responses = list(executor.map(lambda prompt: invoke_model_once(prompt, config, "RegenerateSections"), prompts))
+
+    usage = None
+    for (number, _), response in zip(targets.items(), responses):
+        sections[number - 1] = replace_section_body(sections[number - 1], str(response.content))
+        usage = add_usage(usage, getattr(response, "usage_metadata", None))
+
+    outline = AIMessage(content=join_outline(preamble, sections), usage_metadata=usage)
+    return Command(update={"messages": [outline]}, goto="HumanFeedback")
+
+def build_section_profile(state: AgentState, config: RunnableConfig, query: str) -> dict:
+    """
+    セクションの内容に関連するプロダクト・ペルソナの情報を選び、SectionTaskに渡すレコードを返します。
+    キーワードによらない部分はアウトライン作成時と同じ上限で選ぶため同じ内容になり、
+    セクションに関連する部分（excerpt）はストアの行全体から選び直します。
+    """
+    site_id = config.get("configurable", {}).get("siteId")
+    product_id = config.get("configurable", {}).get("productId")
+    persona_id = config.get("configurable", {}).get("personaId")
+    budget = get_profile_token_budget(config)
+    excerpt_budget = get_section_profile_token_budget(config)
+    return {
+        "company": state.get("company"),
+        "product": fetch_product_record(site_id, product_id, query, budget, excerpt_budget),
+        "persona": fetch_persona_record(site_id, product_id, persona_id, query, budget, excerpt_budget),
+    }
+
+def build_section_tasks(state: AgentState, config: RunnableConfig) -> list[Send]:
+    """
+    承認されたアウトラインをセクションに分け、セクションごとにWriteSectionへのSendを作成します。
+    各Sendにはアウトライン全体ではなく、そのセクションの見出しと本文、アウトラインの見出しの一覧だけを渡します。
+    """
+    outline = str(next(m for m in reversed(state["messages"]) if isinstance(m, AIMessage)).content)
+    _, sections = split_outline(outline)
+    if not sections:
+        # 見出しで分割できない場合はアウトライン全体を1つのセクションとして執筆する
+        sections = [outline]
+    write_word = state["write_word"]
+    headings = outline_headings(outline)
+    return [
+        Send("WriteSection", {
+            "index": index,
+            "section": section,
+            "headings": headings,
+            "write_word": write_word,
+            **build_section_profile(state, config, f"{write_word}\n{section}"),
+        })
+        for index, section in enumerate(sections)
+    ]
+
+# セクションの本文を執筆するノード（承認後にセクションの数だけ並列に実行される）
+def WriteSection(task: SectionTask, config: RunnableConfig):
+    """
+    アウトラインの1つのセクションの本文を執筆します。
+    すべてのセクションが同じステップで並列に実行されるため、執筆時間は最も遅いセクションの時間で決まります。
+    """
+    messages = build_section_messages(
+        task["write_word"],
+        task["headings"],
+        render_profile(task["company"], task["product"], task["persona"]),
+        task["index"] + 1,
+        task["section"],
+        render_profile_excerpt(task["product"], task["persona"]),
+    )
+    response = invoke_model_once(messages, config, "WriteSection")
+    content = replace_section_body(task["section"], str(response.content))
+    return {"draft_sections": [{"index": task["index"], "content": content}]}
+
+# 並列に執筆したセクションを1つの記事にまとめるノード
+def AssembleArticle(state: AgentState, config: RunnableConfig):
+    """
+    並列に執筆したセクションをアウトラインの順に並べ、記事のタイトルと合わせて1つの記事にまとめます。
+    セクション間で重複した段落はここで取り除きます。
+    まとめる処理はLLMを呼び出さない決定的な処理です。記事全体をモデルに渡して整える処理を加えると、
+    記事の長さに比例する直列の呼び出しが増え、執筆時間が最も遅いセクションの時間で決まらなくなるためです。
+    セクション間の内容の重複は、各セクションの執筆時に見出しの一覧を渡して他のセクションの内容に触れないよう指示することで抑えます。
+    """
+    outline = str(next(m for m in reversed(state["messages"]) if isinstance(m, AIMessage)).content)
+    preamble, _ = split_outline(outline)
+    sections = sorted(state["draft_sections"], key=lambda draft: draft["index"])
+    return {"article": assemble_article(preamble, [draft["content"] for draft in sections])}
 
 #######------------------------------------------------------------
+# キーワードボリュームの取得に使う顧客IDとスレッドプール
+GOOGLE_ADS_CUSTOMER_ID = "9910458952"
+_ads_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="google-ads")
+
 #キーワードボリュームを取得するノード
-def QueryKeywordVolume(state: AgentState, config: RunnableConfig) -> str:
+async def QueryKeywordVolume(state: AgentState, config: RunnableConfig) -> str:
     """
     指定された設定に基づいて、キーワードボリュームをクエリします。
     この関数は、指定されたキーワードでGoogle Ads APIによるキーワードボリュームクエリを実行します。
+    Google Ads APIの呼び出しはブロッキングのため、イベントループを止めないようスレッドプールで実行します。
     結果として得られた内容をmarkdownの表形式で返します。
     """
+    # google-adsのインポートは重いため、このノードが実行されるまで遅延させる
+    from blog_makearticle2.src import utils as keyword_utils
+    from blog_makearticle2.src.keyword_batcher import get_keyword_batcher
+    from blog_makearticle2.src.keyword_store import get_keyword_store
+
     # stateからtarget_keywordを取得
     target_keyword = state["target_keyword"]
 
-    # コマンドライン引数の作成
-    result = subprocess.run([
-        "python", "src/blog_features/utils.py",
-        "-c", "9910458952",
-        "-k", target_keyword,
-        #"-l", "LOCATION_ID1", "LOCATION_ID2",
-        #"-i", "LANGUAGE_ID",
-        #"-p", "https://example.com"
-    ], capture_output=True, text=True)
+    # ロケーションのグループごとのリクエストを並行して実行し、このキーワードのアイデアを取得する
+    # KEYWORD_STORE_PATHが設定されている場合は、取得済みで古くなっていないキーワードをAPIを呼ばずにストアから答える
+    batcher = get_keyword_batcher(
+        GOOGLE_ADS_CUSTOMER_ID,
+        location_group_size=int(os.environ.get("KEYWORD_LOCATION_GROUP_SIZE") or "0") or None,
+        executor=_ads_executor,
+        store=get_keyword_store(),
+    )
+    # 同じキーワードの取得が実行中であれば、その結果を共有する
+    key = make_key(" ".join(normalize_text(target_keyword).split()))
+    df_keywords = await _keyword_flight.do(key, batcher.fetch, target_keyword)
 
     # 結果を文字列として返す
-    if result.stdout:
-        return {"messages":[result.stdout]}
+    if not df_keywords.empty:
+        return {"messages":[keyword_utils.format_markdown(df_keywords)]}
     else:
-        return "No matching records found."  # 空の場合は文字列を返す
+        return {"messages":["No matching records found."]}  # 空の場合は文字列を返す
 #######------------------------------------------------------------
 
 # ノード・エッジの定義
 import json
-from langchain_core.messages import ToolMessage, SystemMessage
+from langchain_core.messages import ToolMessage, SystemMessage, HumanMessage
 from langchain_core.runnables import RunnableConfig
 
 # Define the node that calls the model
 def call_model( state: AgentState, config: RunnableConfig):
     # this is similar to customizing the create_react_agent with 'prompt' parameter, but is more flexible
-    system_prompt = SystemMessage(
-        "あなたは優秀なデータアナリストです。特にBtoB向けのSEO施策に深い知見を持っています。"
-    )
-    response = model.invoke([system_prompt] + state["messages"], config)
+    # 変化しにくいシステムプロンプトとプロファイル情報を先頭に置き、プロンプトキャッシュが効くようにする
+    system_prompt = SystemMessage(ANALYST_SYSTEM_PROMPT)
+    has_profile = state.get("company") or state.get("product") or state.get("persona")
+    profile_context = [HumanMessage(state_profile(state))] if has_profile else []
+    response = get_model().invoke([system_prompt] + profile_context + state["messages"], config)
+    record_prompt_cache_usage(response, "call_model")
     # We return a list, because this will get added to the existing list
     return {"messages": [response]}
 
 # Define a new graph
 workflow = StateGraph(AgentState)
 
-# Define the nodes
-workflow.add_node("QueryCompanyInfo", QueryCompanyInfo)
-workflow.add_node("QueryServiceProduct", QueryServiceProduct)
-workflow.add_node("QueryCustomerPersona", QueryCustomerPersona)
-workflow.add_node("CreateOutline", CreateOutline)
-workflow.add_node("HumanFeedback", HumanFeedback)
-workflow.add_node("EvaluateFeedback", EvaluateFeedback)
-
-workflow.set_entry_point("QueryCompanyInfo")
-
-workflow.add_edge("QueryCompanyInfo", "QueryServiceProduct")
-workflow.add_edge("QueryServiceProduct", "QueryCustomerPersona")
-workflow.add_edge("QueryCustomerPersona", "CreateOutline")
+# Define the nodes（各ノードは実行時間を計測するラッパーで包む）
+workflow.add_node("QueryCompanyInfo", instrument_node("QueryCompanyInfo", QueryCompanyInfo))
+workflow.add_node("QueryServiceProduct", instrument_node("QueryServiceProduct", QueryServiceProduct))
+workflow.add_node("QueryCustomerPersona", instrument_node("QueryCustomerPersona", QueryCustomerPersona))
+workflow.add_node("CreateOutline", instrument_node("CreateOutline", CreateOutline))
+workflow.add_node("HumanFeedback", instrument_node("HumanFeedback", HumanFeedback))
+workflow.add_node("EvaluateFeedback", instrument_node("EvaluateFeedback", EvaluateFeedback))
+workflow.add_node("RegenerateSections", instrument_node("RegenerateSections", RegenerateSections))
+workflow.add_node("WriteSection", instrument_node("WriteSection", WriteSection))
+workflow.add_node("AssembleArticle", instrument_node("AssembleArticle", AssembleArticle))
+
+# 3つのクエリは互いに依存しないため、エントリーポイントから同じステップで並列に実行する
+workflow.add_edge(START, "QueryCompanyInfo")
+workflow.add_edge(START, "QueryServiceProduct")
+workflow.add_edge(START, "QueryCustomerPersona")
+
+# 3つのクエリがすべて完了してからアウトラインを作成する（レコードからプロンプトのテキストへの変換はCreateOutlineで行う）
+workflow.add_edge(["QueryCompanyInfo", "QueryServiceProduct", "QueryCustomerPersona"], "CreateOutline")
 workflow.add_edge("CreateOutline", "HumanFeedback")
 workflow.add_edge("HumanFeedback", "EvaluateFeedback")
+# 承認後は、EvaluateFeedbackからSendで並列に起動したWriteSectionがすべて完了してから記事にまとめる
+workflow.add_edge("WriteSection", "AssembleArticle")
+workflow.add_edge("AssembleArticle", END)
 
 
-memory = MemorySaver() # スレッド内記憶を維持するための設定
+memory = build_checkpointer() # スレッド内記憶を維持するための設定（CHECKPOINTER=sqliteで永続化）
 graph = workflow.compile(checkpointer=memory)
\ No newline at end of file
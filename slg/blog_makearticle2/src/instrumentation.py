@@ -0,0 +1,323 @@
+import cProfile
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langgraph.errors import GraphBubbleUp
+
+logger = logging.getLogger(__name__)
+
+# ノード実行時間のヒストグラムのバケット（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 100万トークンあたりの料金（USD）: (入力, キャッシュ済み入力, 出力)
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+}
+
+# LLMレスポンスキャッシュから返した生成結果のgeneration_infoに付けるキー
+LLM_CACHE_HIT = "llm_cache_hit"
+
+# 再生成回数を保持するスレッド数の上限（古いスレッドから破棄する）
+MAX_TRACKED_THREADS = 10000
+
+
+def estimate_cost(model_name: str, input_tokens: int, cached_tokens: int, output_tokens: int) -> float:
+    """トークン数から推定料金（USD）を算出します。料金表にないモデルは0として扱います。"""
+    # "gpt-4o-mini-2024-07-18" のような日付付きのモデル名にも対応するため、最長一致で料金を探す
+    matches = [name for name in MODEL_PRICES if model_name.startswith(name)]
+    if not matches:
+        return 0.0
+    input_price, cached_price, output_price = MODEL_PRICES[max(matches, key=len)]
+    return (
+        (input_tokens - cached_tokens) * input_price
+        + cached_tokens * cached_price
+        + output_tokens * output_price
+    ) / 1_000_000
+
+
+class Metrics:
+    """ノードの実行時間、LLMのトークン使用量・推定料金、キャッシュのヒット数、スレッドごとの再生成回数を集計します。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.node_latency = {}  # node -> {"count", "sum", "buckets"}
+            self.node_errors = {}  # node -> count
+            self.llm_usage = {}  # (node, model) -> {"calls", "cache_hits", "input", "cached", "output", "cost"}
+            self.cache = {"hit": 0, "miss": 0}
+            self.llm_requests = {}  # event（sent・retry・hedge・fallback・throttled など） -> count
+            self.singleflight = {}  # name -> {"leader": count, "shared": count}
+            self.regenerations = OrderedDict()  # thread_id -> count
+
+    def record_node(self, node: str, seconds: float, error: bool = False):
+        with self._lock:
+            stats = self.node_latency.setdefault(
+                node, {"count": 0, "sum": 0.0, "buckets": [0] * len(LATENCY_BUCKETS)}
+            )
+            stats["count"] += 1
+            stats["sum"] += seconds
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    stats["buckets"][i] += 1
+            if error:
+                self.node_errors[node] = self.node_errors.get(node, 0) + 1
+
+    def _llm_usage(self, node: str, model_name: str) -> dict:
+        return self.llm_usage.setdefault(
+            (node, model_name), {"calls": 0, "cache_hits": 0, "input": 0, "cached": 0, "output": 0, "cost": 0.0}
+        )
+
+    def record_llm(self, node: str, model_name: str, input_tokens: int, cached_tokens: int, output_tokens: int):
+        with self._lock:
+            usage = self._llm_usage(node, model_name)
+            usage["calls"] += 1
+            usage["input"] += input_tokens
+            usage["cached"] += cached_tokens
+            usage["output"] += output_tokens
+            usage["cost"] += estimate_cost(model_name, input_tokens, cached_tokens, output_tokens)
+
+    def record_llm_cache_hit(self, node: str, model_name: str):
+        """LLMレスポンスキャッシュから答えた呼び出しを数えます。APIを呼び出していないため、トークン数と料金には加えません。"""
+        with self._lock:
+            self._llm_usage(node, model_name)["cache_hits"] += 1
+
+    def record_cache(self, hit: bool):
+        with self._lock:
+            self.cache["hit" if hit else "miss"] += 1
+
+    def record_llm_request(self, event: str, count: int = 1):
+        with self._lock:
+            self.llm_requests[event] = self.llm_requests.get(event, 0) + count
+
+    def record_singleflight(self, name: str, shared: bool):
+        with self._lock:
+            counts = self.singleflight.setdefault(name, {"leader": 0, "shared": 0})
+            counts["shared" if shared else "leader"] += 1
+
+    def record_regeneration(self, thread_id: str):
+        with self._lock:
+            self.regenerations[thread_id] = self.regenerations.pop(thread_id, 0) + 1
+            while len(self.regenerations) > MAX_TRACKED_THREADS:
+                self.regenerations.popitem(last=False)
+
+    def snapshot(self) -> dict:
+        """集計結果をJSONに変換できる辞書で返します。"""
+        with self._lock:
+            return {
+                "nodes": {
+                    node: {
+                        "count": stats["count"],
+                        "sum_seconds": stats["sum"],
+                        "mean_seconds": stats["sum"] / stats["count"],
+                        "errors": self.node_errors.get(node, 0),
+                    }
+                    for node, stats in self.node_latency.items()
+                },
+                "llm": [
+                    {"node": node, "model": model_name, **usage}
+                    for (node, model_name), usage in self.llm_usage.items()
+                ],
+                "llm_cache": dict(self.cache),
+                "llm_requests": dict(self.llm_requests),
+                "singleflight": {name: dict(counts) for name, counts in self.singleflight.items()},
+                "regenerations": dict(self.regenerations),
+            }
+
+    def render_prometheus(self) -> str:
+        """集計結果をPrometheusのテキスト形式で返します。"""
+        lines = []
+        with self._lock:
+            lines.append("# HELP slg_node_duration_seconds Wall time of graph nodes.")
+            lines.append("# TYPE slg_node_duration_seconds histogram")
+            for node, stats in self.node_latency.items():
+                for bound, count in zip(LATENCY_BUCKETS, stats["buckets"]):
+                    lines.append(f'slg_node_duration_seconds_bucket{{node="{node}",le="{bound}"}} {count}')
+                lines.append(f'slg_node_duration_seconds_bucket{{node="{node}",le="+Inf"}} {stats["count"]}')
+                lines.append(f'slg_node_duration_seconds_sum{{node="{node}"}} {stats["sum"]}')
+                lines.append(f'slg_node_duration_seconds_count{{node="{node}"}} {stats["count"]}')
+
+            lines.append("# HELP slg_node_errors_total Graph node executions that raised.")
+            lines.append("# TYPE slg_node_errors_total counter")
+            for node, count in self.node_errors.items():
+                lines.append(f'slg_node_errors_total{{node="{node}"}} {count}')
+
+            lines.append("# HELP slg_llm_tokens_total LLM tokens by kind.")
+            lines.append("# TYPE slg_llm_tokens_total counter")
+            for (node, model_name), usage in self.llm_usage.items():
+                for kind in ("input", "cached", "output"):
+                    lines.append(
+                        f'slg_llm_tokens_total{{node="{node}",model="{model_name}",kind="{kind}"}} {usage[kind]}'
+                    )
+            lines.append("# HELP slg_llm_calls_total LLM calls.")
+            lines.append("# TYPE slg_llm_calls_total counter")
+            for (node, model_name), usage in self.llm_usage.items():
+                lines.append(f'slg_llm_calls_total{{node="{node}",model="{model_name}"}} {usage["calls"]}')
+            lines.append("# HELP slg_llm_cache_hits_total LLM calls answered from the response cache (no tokens or cost).")
+            lines.append("# TYPE slg_llm_cache_hits_total counter")
+            for (node, model_name), usage in self.llm_usage.items():
+                lines.append(f'slg_llm_cache_hits_total{{node="{node}",model="{model_name}"}} {usage["cache_hits"]}')
+            lines.append("# HELP slg_llm_cost_usd_total Estimated LLM cost in USD.")
+            lines.append("# TYPE slg_llm_cost_usd_total counter")
+            for (node, model_name), usage in self.llm_usage.items():
+                lines.append(f'slg_llm_cost_usd_total{{node="{node}",model="{model_name}"}} {usage["cost"]}')
+
+            lines.append("# HELP slg_llm_cache_requests_total LLM response cache lookups.")
+            lines.append("# TYPE slg_llm_cache_requests_total counter")
+            for result, count in self.cache.items():
+                lines.append(f'slg_llm_cache_requests_total{{result="{result}"}} {count}')
+
+            lines.append("# HELP slg_llm_requests_total LLM HTTP request events (sent, retry, hedge, fallback, throttled).")
+            lines.append("# TYPE slg_llm_requests_total counter")
+            for event, count in self.llm_requests.items():
+                lines.append(f'slg_llm_requests_total{{event="{event}"}} {count}')
+
+            lines.append("# HELP slg_singleflight_calls_total Single-flight calls that ran the work (leader) or shared an in-flight result.")
+            lines.append("# TYPE slg_singleflight_calls_total counter")
+            for name, counts in self.singleflight.items():
+                for role, count in counts.items():
+                    lines.append(f'slg_singleflight_calls_total{{name="{name}",role="{role}"}} {count}')
+
+            lines.append("# HELP slg_outline_regenerations_total Outline regenerations across threads.")
+            lines.append("# TYPE slg_outline_regenerations_total counter")
+            lines.append(f"slg_outline_regenerations_total {sum(self.regenerations.values())}")
+        return "\n".join(lines) + "\n"
+
+
+# プロセス内で共有する集計
+metrics = Metrics()
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    LLM呼び出しごとのトークン使用量と推定料金を、呼び出し元のノード名とともに記録するコールバックです。
+    LLMレスポンスキャッシュから返した生成結果は、トークン数と料金を加えずにキャッシュヒットとして数えます。
+    """
+
+    def __init__(self, metrics: Metrics = metrics):
+        self.metrics = metrics
+        self._nodes = {}  # run_id -> node
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        self._nodes[run_id] = (metadata or {}).get("langgraph_node", "unknown")
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        node = self._nodes.pop(run_id, "unknown")
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None)
+                model_name = (getattr(message, "response_metadata", None) or {}).get("model_name", "unknown")
+                if (generation.generation_info or {}).get(LLM_CACHE_HIT):
+                    self.metrics.record_llm_cache_hit(node, model_name)
+                    continue
+                if not usage:
+                    continue
+                self.metrics.record_llm(
+                    node,
+                    model_name,
+                    usage.get("input_tokens", 0),
+                    (usage.get("input_token_details") or {}).get("cache_read", 0),
+                    usage.get("output_tokens", 0),
+                )
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._nodes.pop(run_id, None)
+
+
+# モデルに登録するコールバック（プロセス内で共有する）
+metrics_callback = MetricsCallbackHandler()
+
+
+def _profile_path(node: str) -> str:
+    directory = os.environ.get("PROFILE_OUTPUT_DIR") or ".profiles"
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{node}-{time.strftime('%Y%m%d-%H%M%S')}-{time.perf_counter_ns()}.prof")
+
+
+def instrument_node(node: str, func):
+    """
+    ノード関数を計測用のラッパーで包みます。実行時間を`metrics`に記録します。
+    環境変数`PROFILE_NODE`がノード名と一致する場合は、cProfileの結果を`PROFILE_OUTPUT_DIR`に保存します（同期ノードのみ）。
+    """
+    profile = os.environ.get("PROFILE_NODE") == node
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            error = False
+            try:
+                return await func(*args, **kwargs)
+            except GraphBubbleUp:
+                # interruptによる中断（HumanFeedbackでの停止など）はエラーとして数えない
+                raise
+            except BaseException:
+                error = True
+                raise
+            finally:
+                metrics.record_node(node, time.perf_counter() - start, error)
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        error = False
+        profiler = cProfile.Profile() if profile else None
+        try:
+            if profiler is not None:
+                return profiler.runcall(func, *args, **kwargs)
+            return func(*args, **kwargs)
+        except GraphBubbleUp:
+            raise
+        except BaseException:
+            error = True
+            raise
+        finally:
+            metrics.record_node(node, time.perf_counter() - start, error)
+            if profiler is not None:
+                path = _profile_path(node)
+                profiler.dump_stats(path)
+                logger.info("Saved cProfile stats of %s to %s", node, path)
+
+    return wrapper
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = metrics.render_prometheus().encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path == "/metrics.json":
+            body = json.dumps(metrics.snapshot(), ensure_ascii=False).encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """`/metrics`（Prometheus形式）と`/metrics.json`を返すHTTPサーバーをバックグラウンドで起動します。"""
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,174 @@
+"""
+複数のジョブから同時に届いたシードキーワードのキーワードアイデアを、重複したリクエストを送らずに取得するモジュールです。
+同じシードキーワードの取得が実行中であればその結果を共有し、ロケーションのグループごとのリクエストは並行して実行して、
+返ってきたアイデアをキーワード単位で重複排除します。
+異なるシードキーワードは1つのリクエストにまとめません。まとめたリクエストの結果はどのシードキーワードのアイデアかを正確に分けられず、
+同時に届いた他のシードキーワードによって結果が変わってしまうためです。各シードキーワードには、単独で取得した場合と同じ結果を返します。
+キーワードのストア（keyword_store.KeywordStore）を渡した場合は、取得済みで古くなっていないシードキーワードをストアから答え、
+APIから取得した結果をストアに保存します。
+"""
+
+import asyncio
+import logging
+import weakref
+from types import SimpleNamespace
+
+from blog_makearticle2.src import utils as keyword_utils
+
+logger = logging.getLogger(__name__)
+
+# 国全体のロケーションID（日本）。同じ国の都道府県と一緒に指定された場合、地域が重なるためグループに分けない
+COUNTRY_LOCATION_IDS = frozenset({"2392"})
+
+
+def _chunk(items: list, size: int | None) -> list[list]:
+    if not size:
+        return [list(items)]
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+class KeywordIdeaBatcher:
+    """
+    シードキーワードごとにGenerateKeywordIdeasRequestを送るバッチャーです。
+    `fetch()`を同時に呼び出した複数の呼び出し元が同じシードキーワードを指定した場合は、1回のリクエストの結果を共有します。
+    `location_group_size`を指定した場合は、ロケーションIDをその件数ずつのグループに分けて並行にリクエストし、
+    キーワードごとに月平均検索ボリュームを合算します。合算できるのはグループ同士の地域が重ならない場合だけのため、
+    国全体のロケーション（COUNTRY_LOCATION_IDS）を含む場合は、その国の地域と重複して数えないようグループに分けずに1回でリクエストします。
+    """
+
+    def __init__(
+        self,
+        customer_id: str,
+        location_ids: list = keyword_utils._DEFAULT_LOCATION_IDS,
+        language_id: str = keyword_utils._DEFAULT_LANGUAGE_ID,
+        location_group_size: int | None = None,
+        executor=None,
+        client=None,
+        store=None,
+    ):
+        self.customer_id = customer_id
+        self.location_ids = list(location_ids)
+        self.language_id = language_id
+        self.location_group_size = location_group_size
+        if location_group_size and COUNTRY_LOCATION_IDS.intersection(map(str, self.location_ids)):
+            logger.warning(
+                "Not splitting locations into groups of %d: a country location overlaps its regions", location_group_size
+            )
+            self.location_group_size = None
+        self.executor = executor
+        self.client = client
+        self.store = store
+        self._inflight = {}  # シードキーワード -> 取得中のTask
+        self.requests_sent = 0
+        self.store_hits = 0
+
+    async def fetch(self, keyword: str, top_n: int | None = None):
+        """シードキーワードに該当するキーワードアイデアをデータフレームで返します。"""
+        loop = asyncio.get_running_loop()
+        if self.store is not None:
+            ideas = await loop.run_in_executor(
+                self.executor, self.store.ideas_for_seed, keyword, self.location_ids, self.language_id
+            )
+            if ideas is not None:
+                self.store_hits += 1
+                return keyword_utils.build_keyword_frame(ideas, top_n=top_n)
+
+        task = self._inflight.get(keyword)
+        if task is None:
+            task = loop.create_task(self._run(keyword))
+            self._inflight[keyword] = task
+            task.add_done_callback(lambda _: self._inflight.pop(keyword, None))
+        # 呼び出し元の1つがキャンセルされても、同じシードキーワードを待っている他の呼び出し元の取得は続ける
+        ideas = await asyncio.shield(task)
+        return keyword_utils.build_keyword_frame(ideas, top_n=top_n)
+
+    async def _run(self, keyword: str) -> list:
+        ideas = await self._fetch_ideas([keyword])
+        if self.store is not None:
+            await self._record({keyword: ideas})
+        return ideas
+
+    async def _record(self, ideas_by_seed: dict):
+        """取得したアイデアをストアに保存します。保存に失敗しても取得結果はそのまま返します。"""
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.store.record, ideas_by_seed, self.location_ids, self.language_id
+            )
+        except Exception as e:
+            logger.warning("Failed to record keyword ideas in the store: %r", e)
+
+    def _request_group(self, seeds: list, location_ids: list) -> list[tuple]:
+        """1つのロケーショングループに対してリクエストを送り、(キーワード, 検索ボリューム, 競合度) のリストを返します。"""
+        client = self.client or keyword_utils.get_googleads_client()
+        pager = keyword_utils.generate_keyword_ideas(
+            client, self.customer_id, location_ids, self.language_id, seeds, None
+        )
+        self.requests_sent += 1
+        return [
+            (
+                idea.text,
+                idea.keyword_idea_metrics.avg_monthly_searches,
+                idea.keyword_idea_metrics.competition.name,
+            )
+            for idea in pager
+        ]
+
+    async def _fetch_ideas(self, seeds: list) -> list:
+        """ロケーショングループごとのリクエストを並行に実行し、キーワード単位で重複排除したアイデアを返します。"""
+        loop = asyncio.get_running_loop()
+        groups = await asyncio.gather(*(
+            loop.run_in_executor(self.executor, self._request_group, seeds, location_ids)
+            for location_ids in _chunk(self.location_ids, self.location_group_size)
+        ))
+
+        # キーワードごとに検索ボリュームを合算し、競合度は検索ボリュームが最も大きいグループのものを使う
+        merged = {}
+        for rows in groups:
+            seen = set()
+            for text, volume, competition in rows:
+                if text in seen:
+                    continue
+                seen.add(text)
+                if text in merged:
+                    total, best_volume, best_competition = merged[text]
+                    if volume > best_volume:
+                        best_volume, best_competition = volume, competition
+                    merged[text] = (total + volume, best_volume, best_competition)
+                else:
+                    merged[text] = (volume, volume, competition)
+
+        # build_keyword_frameが読むGenerateKeywordIdeaResultと同じ属性を持つオブジェクトに変換する
+        return [
+            SimpleNamespace(
+                text=text,
+                keyword_idea_metrics=SimpleNamespace(
+                    avg_monthly_searches=total,
+                    competition=SimpleNamespace(name=competition),
+                ),
+            )
+            for text, (total, _, competition) in merged.items()
+        ]
+
+
+# イベントループごとに共有するバッチャー（Futureはループをまたいで使えないため）
+_batchers = weakref.WeakKeyDictionary()
+
+
+def get_keyword_batcher(customer_id: str, **kwargs) -> KeywordIdeaBatcher:
+    """実行中のイベントループで共有するバッチャーを返します。"""
+    loop = asyncio.get_running_loop()
+    batcher = _batchers.get(loop)
+    if batcher is None:
+        batcher = KeywordIdeaBatcher(customer_id, **kwargs)
+        _batchers[loop] = batcher
+    return batcher
+
+
+async def fetch_per_seed(customer_id: str, keyword_texts: list, top_n: int | None = None, **kwargs) -> dict:
+    """
+    複数のシードキーワードについて、キーワードごとのアイデアを並行して取得します。
+    シードキーワードをキー、データフレームを値とする辞書を返します。
+    """
+    batcher = KeywordIdeaBatcher(customer_id, **kwargs)
+    frames = await asyncio.gather(*(batcher.fetch(keyword, top_n=top_n) for keyword in keyword_texts))
+    return dict(zip(keyword_texts, frames))
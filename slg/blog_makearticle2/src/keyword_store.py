@@ -0,0 +1,317 @@
+"""
+Google Ads APIで取得したキーワードの指標（月平均検索ボリューム・広告競合度）をローカルのSQLiteに保存するストアです。
+
+- キーワードごとに、ロケーションの組み合わせ・言語・取得日時とともに保存します。
+- シードキーワードごとに最後に取得した日時と、そのとき返ってきたキーワードを記録し、
+  `max_age`秒以内に取得済みのシードはAPIに問い合わせずに、同じキーワードの組み合わせをストアから答えます。
+  古くなったシードは次の取得時に上書きします。
+- 保存したキーワードは、前方一致（B-treeインデックスの範囲検索）と部分一致（FTS5のtrigramインデックス）で検索できます。
+  trigramは3文字以上の語にのみ使えるため、2文字以下の語や、FTS5が使えない環境ではLIKEで検索します。
+
+検索例（slgディレクトリで実行）:
+    python -m blog_makearticle2.src.keyword_store .keywords/keywords.sqlite prefix 社員研修
+    python -m blog_makearticle2.src.keyword_store .keywords/keywords.sqlite search 研修
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from types import SimpleNamespace
+
+logger = logging.getLogger(__name__)
+
+# シードキーワードの取得結果を有効とみなす秒数（環境変数`KEYWORD_STORE_MAX_AGE`で上書きできる）
+DEFAULT_MAX_AGE = 7 * 24 * 60 * 60
+# FTS5のtrigramトークナイザで検索できる最小の文字数
+_TRIGRAM_MIN_CHARS = 3
+
+
+def normalize_keyword(text: str) -> str:
+    """全角・半角を揃え（NFKC）、小文字に変換し、連続する空白を1つにまとめます。"""
+    return " ".join(unicodedata.normalize("NFKC", text).lower().split())
+
+
+def location_key(location_ids) -> str:
+    """ロケーションIDの組み合わせを、順序に依存しない文字列に変換します。"""
+    return ",".join(sorted(str(location_id) for location_id in location_ids))
+
+
+def _escape_like(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def as_ideas(rows) -> list:
+    """
+    (キーワード, 検索ボリューム, 競合度) の行を、build_keyword_frameが読む
+    GenerateKeywordIdeaResultと同じ属性を持つオブジェクトに変換します。
+    """
+    return [
+        SimpleNamespace(
+            text=text,
+            keyword_idea_metrics=SimpleNamespace(
+                avg_monthly_searches=volume,
+                competition=SimpleNamespace(name=competition),
+            ),
+        )
+        for text, volume, competition in rows
+    ]
+
+
+class KeywordStore:
+    """
+    キーワードの指標を保存するSQLiteのストアです。接続はスレッド間で共有し、ロックで直列化します。
+    キーワードは (正規化したキーワード, ロケーション, 言語) ごとに1行で、取得し直すと上書きします。
+    """
+
+    def __init__(self, path: str, max_age: float | None = DEFAULT_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS keyword_metrics (
+                normalized TEXT NOT NULL,
+                locations TEXT NOT NULL,
+                language TEXT NOT NULL,
+                keyword TEXT NOT NULL,
+                avg_monthly_searches INTEGER NOT NULL,
+                competition TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (locations, language, normalized)
+            );
+            CREATE TABLE IF NOT EXISTS seed_fetches (
+                seed TEXT NOT NULL,
+                locations TEXT NOT NULL,
+                language TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (locations, language, seed)
+            );
+            CREATE TABLE IF NOT EXISTS seed_keywords (
+                locations TEXT NOT NULL,
+                language TEXT NOT NULL,
+                seed TEXT NOT NULL,
+                normalized TEXT NOT NULL,
+                PRIMARY KEY (locations, language, seed, normalized)
+            );
+            """
+        )
+        self.has_fts = self._setup_fts()
+        self._conn.commit()
+
+    def _setup_fts(self) -> bool:
+        """部分一致検索用のtrigramインデックスを作成します。FTS5・trigramが使えない場合はFalseを返します。"""
+        try:
+            self._conn.executescript(
+                """
+                CREATE VIRTUAL TABLE IF NOT EXISTS keyword_fts USING fts5(
+                    normalized, content='keyword_metrics', content_rowid='rowid', tokenize='trigram'
+                );
+                CREATE TRIGGER IF NOT EXISTS keyword_metrics_ai AFTER INSERT ON keyword_metrics BEGIN
+                    INSERT INTO keyword_fts (rowid, normalized) VALUES (new.rowid, new.normalized);
+                END;
+                CREATE TRIGGER IF NOT EXISTS keyword_metrics_ad AFTER DELETE ON keyword_metrics BEGIN
+                    INSERT INTO keyword_fts (keyword_fts, rowid, normalized) VALUES ('delete', old.rowid, old.normalized);
+                END;
+                CREATE TRIGGER IF NOT EXISTS keyword_metrics_au AFTER UPDATE ON keyword_metrics BEGIN
+                    INSERT INTO keyword_fts (keyword_fts, rowid, normalized) VALUES ('delete', old.rowid, old.normalized);
+                    INSERT INTO keyword_fts (rowid, normalized) VALUES (new.rowid, new.normalized);
+                END;
+                """
+            )
+            return True
+        except sqlite3.OperationalError as e:
+            logger.warning("FTS5 trigram index is unavailable (%s); substring lookups use LIKE", e)
+            return False
+
+    def _fresh_after(self, now: float | None = None) -> float:
+        """この時刻より後に取得した行を有効とみなす時刻を返します。"""
+        if self.max_age is None:
+            return float("-inf")
+        return (now or time.time()) - self.max_age
+
+    def is_fresh(self, seed: str, location_ids, language_id: str) -> bool:
+        """シードキーワードを`max_age`秒以内に取得済みかどうかを返します。"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fetched_at FROM seed_fetches WHERE locations = ? AND language = ? AND seed = ?",
+                (location_key(location_ids), str(language_id), normalize_keyword(seed)),
+            ).fetchone()
+        return row is not None and row[0] > self._fresh_after()
+
+    def record(self, ideas_by_seed: dict, location_ids, language_id: str, fetched_at: float | None = None):
+        """
+        シードキーワードごとに取得したキーワードアイデアを保存し、シードキーワードの取得日時とキーワードを記録します。
+        `ideas_by_seed`は {シードキーワード: アイデアのリスト} の辞書で、各アイデアは
+        GenerateKeywordIdeaResult、または同じ属性を持つオブジェクトです。
+        """
+        fetched_at = fetched_at or time.time()
+        locations = location_key(location_ids)
+        language = str(language_id)
+        rows = {}
+        seed_rows = []
+        for seed, ideas in ideas_by_seed.items():
+            seed = normalize_keyword(seed)
+            for idea in ideas:
+                metrics = idea.keyword_idea_metrics
+                normalized = normalize_keyword(idea.text)
+                rows[normalized] = (
+                    normalized, locations, language, idea.text,
+                    int(metrics.avg_monthly_searches), metrics.competition.name, fetched_at,
+                )
+                seed_rows.append((locations, language, seed, normalized))
+        seeds = [(normalize_keyword(seed), locations, language, fetched_at) for seed in ideas_by_seed]
+        with self._lock, self._conn:
+            # 更新トリガーでtrigramインデックスも更新するため、INSERT OR REPLACEではなくUPSERTを使う
+            self._conn.executemany(
+                """
+                INSERT INTO keyword_metrics
+                    (normalized, locations, language, keyword, avg_monthly_searches, competition, fetched_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (locations, language, normalized) DO UPDATE SET
+                    keyword = excluded.keyword,
+                    avg_monthly_searches = excluded.avg_monthly_searches,
+                    competition = excluded.competition,
+                    fetched_at = excluded.fetched_at
+                """,
+                rows.values(),
+            )
+            # 取得し直したシードキーワードのキーワードは、今回の結果で置き換える
+            self._conn.executemany(
+                "DELETE FROM seed_keywords WHERE seed = ? AND locations = ? AND language = ?",
+                [seed[:3] for seed in seeds],
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO seed_keywords (locations, language, seed, normalized) VALUES (?, ?, ?, ?)",
+                seed_rows,
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO seed_fetches (seed, locations, language, fetched_at) VALUES (?, ?, ?, ?)",
+                seeds,
+            )
+
+    def prefix(self, prefix: str, location_ids, language_id: str, limit: int | None = None, fresh_only: bool = True) -> list[tuple]:
+        """キーワードが`prefix`から始まる行を (キーワード, 検索ボリューム, 競合度) のリストで返します（検索ボリュームの降順）。"""
+        normalized = normalize_keyword(prefix)
+        # 主キーのインデックスを範囲検索に使うため、LIKEではなく上限・下限で指定する
+        return self._select(
+            "normalized >= ? AND normalized < ?",
+            (normalized, normalized + "\U0010ffff"),
+            location_ids, language_id, limit, fresh_only,
+        )
+
+    def search(self, text: str, location_ids, language_id: str, limit: int | None = None, fresh_only: bool = True) -> list[tuple]:
+        """キーワードに`text`を含む行を (キーワード, 検索ボリューム, 競合度) のリストで返します（検索ボリュームの降順）。"""
+        normalized = normalize_keyword(text)
+        if self.has_fts and len(normalized) >= _TRIGRAM_MIN_CHARS:
+            phrase = '"' + normalized.replace('"', '""') + '"'
+            return self._select(
+                "rowid IN (SELECT rowid FROM keyword_fts WHERE keyword_fts MATCH ?)",
+                (phrase,), location_ids, language_id, limit, fresh_only,
+            )
+        return self._select(
+            "normalized LIKE ? ESCAPE '\\'",
+            (f"%{_escape_like(normalized)}%",), location_ids, language_id, limit, fresh_only,
+        )
+
+    def _select(self, condition: str, params: tuple, location_ids, language_id, limit, fresh_only) -> list[tuple]:
+        sql = (
+            "SELECT keyword, avg_monthly_searches, competition FROM keyword_metrics "
+            f"WHERE locations = ? AND language = ? AND {condition}"
+        )
+        args = [location_key(location_ids), str(language_id), *params]
+        if fresh_only:
+            sql += " AND fetched_at > ?"
+            args.append(self._fresh_after())
+        sql += " ORDER BY avg_monthly_searches DESC"
+        if limit:
+            sql += " LIMIT ?"
+            args.append(limit)
+        with self._lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    def ideas_for_seed(self, seed: str, location_ids, language_id: str) -> list | None:
+        """
+        `max_age`秒以内に取得済みのシードキーワードであれば、そのとき返ってきたキーワードのアイデアを返します（検索ボリュームの降順）。
+        未取得または古い場合はNoneを返します（呼び出し側でAPIから取得し、recordで保存します）。
+        """
+        if not self.is_fresh(seed, location_ids, language_id):
+            return None
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT m.keyword, m.avg_monthly_searches, m.competition
+                FROM seed_keywords AS s
+                JOIN keyword_metrics AS m
+                    ON m.locations = s.locations AND m.language = s.language AND m.normalized = s.normalized
+                WHERE s.locations = ? AND s.language = ? AND s.seed = ?
+                ORDER BY m.avg_monthly_searches DESC
+                """,
+                (location_key(location_ids), str(language_id), normalize_keyword(seed)),
+            ).fetchall()
+        return as_ideas(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def build_keyword_store() -> KeywordStore | None:
+    """
+    環境変数からキーワードのストアを作成します。
+    `KEYWORD_STORE_PATH`が設定されている場合のみ有効になり（オプトイン）、未設定の場合はNoneを返します。
+    """
+    path = os.environ.get("KEYWORD_STORE_PATH")
+    if not path:
+        return None
+    max_age = os.environ.get("KEYWORD_STORE_MAX_AGE")
+    return KeywordStore(path, max_age=float(max_age) if max_age else DEFAULT_MAX_AGE)
+
+
+# プロセス内で共有するストア（.envの読み込み後に設定を反映させるため、初回参照時に作成する）
+_keyword_store = None
+_keyword_store_created = False
+_keyword_store_lock = threading.Lock()
+
+
+def get_keyword_store() -> KeywordStore | None:
+    """プロセス内で共有するストアを返します。KEYWORD_STORE_PATHが未設定の場合はNoneを返します。"""
+    global _keyword_store, _keyword_store_created
+    if not _keyword_store_created:
+        with _keyword_store_lock:
+            if not _keyword_store_created:
+                _keyword_store = build_keyword_store()
+                _keyword_store_created = True
+    return _keyword_store
+
+
+if __name__ == "__main__":
+    from blog_makearticle2.src import utils as keyword_utils
+
+    parser = argparse.ArgumentParser(description="Looks up stored keyword metrics by prefix or substring.")
+    parser.add_argument("path", type=str, help="Path of the keyword store SQLite file")
+    parser.add_argument("mode", choices=["prefix", "search"], help="Prefix or substring lookup")
+    parser.add_argument("text", type=str, help="Prefix or substring to look up")
+    parser.add_argument(
+        "-l", "--location_ids", nargs="+", type=str, default=keyword_utils._DEFAULT_LOCATION_IDS,
+        help="Space-delimited list of location criteria IDs",
+    )
+    parser.add_argument("-i", "--language_id", type=str, default=keyword_utils._DEFAULT_LANGUAGE_ID, help="The language criterion ID.")
+    parser.add_argument("-n", "--top_n", type=int, default=None, help="The maximum number of keywords to output")
+    parser.add_argument("--include_stale", action="store_true", help="Include entries older than the maximum age")
+    args = parser.parse_args()
+
+    store = KeywordStore(args.path)
+    lookup = store.prefix if args.mode == "prefix" else store.search
+    rows = lookup(args.text, args.location_ids, args.language_id, limit=args.top_n, fresh_only=not args.include_stale)
+    df = keyword_utils.build_keyword_frame(as_ideas(rows), min_monthly_searches=-1)
+    keyword_utils.write_keyword_ideas(df)
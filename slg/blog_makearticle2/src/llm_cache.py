@@ -0,0 +1,148 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.load import dumps, loads
+
+from blog_makearticle2.src.instrumentation import LLM_CACHE_HIT, metrics
+
+logger = logging.getLogger(__name__)
+
+# メッセージの正規化時に残すフィールド（idやレスポンスのメタデータは実行ごとに変わるため除外する）
+_MESSAGE_FIELDS = ("type", "content", "name", "tool_calls", "tool_call_id")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    シリアライズされたメッセージ列から、実行ごとに変わるフィールドを取り除きます。
+    同じ内容のプロンプトであれば、メッセージIDなどが異なっても同じ文字列になります。
+    """
+    try:
+        messages = json.loads(prompt)
+    except ValueError:
+        return prompt
+    if not isinstance(messages, list):
+        return prompt
+
+    normalized = []
+    for message in messages:
+        kwargs = message.get("kwargs", {}) if isinstance(message, dict) else {}
+        normalized.append({
+            field: kwargs[field] for field in _MESSAGE_FIELDS if kwargs.get(field)
+        })
+    return json.dumps(normalized, ensure_ascii=False, sort_keys=True)
+
+
+def make_cache_key(prompt: str, llm_string: str) -> str:
+    """モデル名・パラメータ（llm_string）と正規化したメッセージからキャッシュキーを作成します。"""
+    payload = llm_string + "\x00" + normalize_prompt(prompt)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SQLiteLLMCache(BaseCache):
+    """
+    LLMのレスポンスをローカルのSQLiteに保存するキャッシュです。
+    登録から`ttl`秒を過ぎたエントリは無効とし、`max_entries`件を超えた場合は最終参照が古いものから削除します（LRU）。
+    """
+
+    def __init__(self, path: str, ttl: float | None = None, max_entries: int = 1000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS llm_cache_accessed_at ON llm_cache (accessed_at)"
+        )
+        self._conn.commit()
+
+    def lookup(self, prompt: str, llm_string: str) -> RETURN_VAL_TYPE | None:
+        key = make_cache_key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                # TTLを過ぎたエントリは削除してミスとして扱う
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                logger.info("LLM cache miss: %s", key[:12])
+                metrics.record_cache(hit=False)
+                return None
+            self._conn.execute(
+                "UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+
+        logger.info("LLM cache hit: %s", key[:12])
+        metrics.record_cache(hit=True)
+        generations = loads(row[0])
+        # コールバックでAPI呼び出しと区別できるよう、キャッシュから返した生成結果に目印を付ける
+        for generation in generations:
+            generation.generation_info = {**(generation.generation_info or {}), LLM_CACHE_HIT: True}
+        return generations
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        key = make_cache_key(prompt, llm_string)
+        now = time.time()
+        value = dumps(list(return_val))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            # 上限を超えた分を最終参照が古い順に削除する
+            self._conn.execute(
+                """
+                DELETE FROM llm_cache WHERE key IN (
+                    SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def clear(self, **kwargs) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+
+
+def build_llm_cache() -> SQLiteLLMCache | None:
+    """
+    環境変数からLLMキャッシュを作成します。
+    `LLM_CACHE_PATH`が設定されている場合のみ有効になり（オプトイン）、未設定の場合はNoneを返します。
+    """
+    path = os.environ.get("LLM_CACHE_PATH")
+    if not path:
+        return None
+    ttl = os.environ.get("LLM_CACHE_TTL")
+    max_entries = os.environ.get("LLM_CACHE_MAX_ENTRIES")
+    return SQLiteLLMCache(
+        path,
+        ttl=float(ttl) if ttl else None,
+        max_entries=int(max_entries) if max_entries else 1000,
+    )
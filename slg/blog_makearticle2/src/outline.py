@@ -0,0 +1,159 @@
+"""
+markdownのアウトラインを見出し単位のセクションに分割・結合するモジュールです。
+セクション単位の再生成（RegenerateSections）で、変更しないセクションをそのまま再利用するために使います。
+"""
+
+import re
+import unicodedata
+
+_HEADING = re.compile(r"^(#{1,6})\s+(.*)$")
+
+
+def _heading_level(line: str) -> int | None:
+    match = _HEADING.match(line.strip())
+    return len(match.group(1)) if match else None
+
+
+def section_level(text: str) -> int | None:
+    """
+    セクションの区切りに使う見出しのレベルを返します。
+    2回以上現れる見出しのうち最も浅いレベルを使います（通常は記事タイトルの#の下にある##）。
+    """
+    counts = {}
+    for line in text.splitlines():
+        level = _heading_level(line)
+        if level is not None:
+            counts[level] = counts.get(level, 0) + 1
+    levels = [level for level, count in counts.items() if count >= 2]
+    return min(levels) if levels else None
+
+
+def split_outline(text: str) -> tuple[str, list[str]]:
+    """
+    アウトラインを、最初のセクションより前の部分（タイトルなど）とセクションのリストに分割します。
+    各セクションは見出しの行から次の同じレベル以上の見出しの直前までです。
+    `"".join([preamble, *sections])`で元のテキストに戻ります。
+    """
+    level = section_level(text)
+    if level is None:
+        return text, []
+
+    preamble = []
+    sections = []
+    for line in text.splitlines(keepends=True):
+        line_level = _heading_level(line)
+        if line_level is not None and line_level <= level and (sections or line_level == level):
+            sections.append([line])
+        elif sections:
+            sections[-1].append(line)
+        else:
+            preamble.append(line)
+    return "".join(preamble), ["".join(section) for section in sections]
+
+
+def join_outline(preamble: str, sections: list[str]) -> str:
+    """split_outlineで分割したアウトラインを結合します。セクションの末尾に改行がなければ補います。"""
+    parts = [preamble] if preamble else []
+    for section in sections:
+        parts.append(section if section.endswith("\n") else section + "\n")
+    return "".join(parts)
+
+
+def outline_headings(text: str) -> list[str]:
+    """
+    アウトラインのタイトルとセクションの見出しの行を、出現順に返します。
+    セクションの区切りより深い見出し（セクション内の小見出し）は含めません。
+    """
+    level = section_level(text)
+    headings = []
+    for line in text.splitlines():
+        line_level = _heading_level(line)
+        if line_level is not None and (level is None or line_level <= level):
+            headings.append(line.strip())
+    return headings
+
+
+def section_title(section: str) -> str:
+    """セクションの見出しの文字列（#を除いたもの）を返します。"""
+    first_line = section.strip().splitlines()[0] if section.strip() else ""
+    match = _HEADING.match(first_line)
+    return match.group(2).strip() if match else first_line
+
+
+def _normalize_title(title: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", title).lower().split())
+
+
+def replace_section_body(original: str, regenerated: str) -> str:
+    """
+    再生成したセクションを、元のセクションと同じレベルの見出しから始まる1つのセクションに整形します。
+    モデルがタイトルや他のセクションまで出力した場合は、元のセクションと見出しが一致するセクションを使います。
+    同じレベルの見出しが1つだけの場合は、見出しが変わっていてもそのセクションを使います。
+    同じレベルの見出しが複数あり、どれも元の見出しと一致しない場合は、別のセクションで上書きしないよう元のセクションを返します。
+    見出しの行がない場合は元のセクションの見出しを先頭に付けます。
+    """
+    original_lines = original.splitlines()
+    level = _heading_level(original_lines[0]) if original_lines else None
+    lines = regenerated.strip("\n").splitlines()
+
+    if level is not None:
+        starts = [i for i, line in enumerate(lines) if _heading_level(line) == level]
+        if not starts:
+            lines = [original_lines[0], *lines]
+        else:
+            if len(starts) == 1:
+                start = starts[0]
+            else:
+                title = _normalize_title(section_title(original))
+                start = next((i for i in starts if _normalize_title(section_title(lines[i])) == title), None)
+                if start is None:
+                    return original if original.endswith("\n") else original + "\n"
+            end = next(
+                (i for i in range(start + 1, len(lines))
+                 if (_heading_level(lines[i]) or level + 1) <= level),
+                len(lines),
+            )
+            lines = lines[start:end]
+    return "\n".join(lines).strip("\n") + "\n"
+
+
+def assemble_article(preamble: str, sections: list[str]) -> str:
+    """
+    並列に執筆したセクションを1つの記事に結合します。
+    セクション間の空行を揃え、別のセクションと同じ段落（見出しを除く）が繰り返されている場合は後の方を削除します。
+    """
+    seen = set()
+    parts = [preamble.strip()] if preamble.strip() else []
+    for section in sections:
+        paragraphs = []
+        for paragraph in re.split(r"\n\s*\n", section.strip()):
+            key = " ".join(paragraph.split())
+            if not key:
+                continue
+            if _heading_level(paragraph.splitlines()[0]) is None:
+                if key in seen:
+                    continue
+                seen.add(key)
+            paragraphs.append(paragraph.strip("\n"))
+        parts.append("\n\n".join(paragraphs))
+    return "\n\n".join(part for part in parts if part) + "\n"
+
+
+def parse_section_feedback(feedback) -> dict[int, str]:
+    """
+    セクション単位のフィードバックを {セクション番号(1始まり): コメント} の辞書に変換します。
+    `{"sections": {"2": "具体例を追加して", 3: "..."}}` の形式を受け付け、それ以外の場合は空の辞書を返します。
+    """
+    if not isinstance(feedback, dict):
+        return {}
+    sections = feedback.get("sections") or {}
+    if not isinstance(sections, dict):
+        return {}
+    parsed = {}
+    for key, comment in sections.items():
+        try:
+            index = int(key)
+        except (TypeError, ValueError):
+            continue
+        parsed[index] = str(comment)
+    return parsed
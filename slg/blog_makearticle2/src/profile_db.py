@@ -0,0 +1,129 @@
+"""
+顧客テーブル（会社・プロダクト・ペルソナ）のCSVを、キー列に複合インデックスを持つSQLiteファイルに変換し、読み出すモジュールです。
+行数が増えても、参照時はインデックスを引いて該当する1行だけを読み出すため、起動時間と参照ごとのメモリは一定に保たれます。
+
+変換の実行例（slgディレクトリで実行）:
+    python -m blog_makearticle2.src.profile_db --output db/profiles.sqlite
+"""
+
+import argparse
+import csv
+import os
+import sqlite3
+import threading
+
+from blog_makearticle2.src.profile_store import PROFILE_TABLES
+
+# 変換時に一度にINSERTする行数
+_INSERT_BATCH_SIZE = 1000
+
+
+def _quote(identifier: str) -> str:
+    """SQLiteの識別子としてエスケープします。"""
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def convert_csv_to_sqlite(output_path: str, tables: dict = PROFILE_TABLES) -> None:
+    """
+    各テーブルのCSVをSQLiteファイルに変換します。
+    CSVは1行ずつ読み込むため、全体をメモリに載せません。
+    一時ファイルに書き出してから置き換えるため、読み出し中のプロセスが書きかけのファイルを見ることはありません。
+    """
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = output_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        for table, (csv_path, key_columns) in tables.items():
+            with open(csv_path, newline="", encoding="utf-8") as f:
+                reader = csv.reader(f)
+                columns = next(reader)
+                column_defs = ", ".join(f"{_quote(c)} TEXT" for c in columns)
+                conn.execute(f"CREATE TABLE {_quote(table)} ({column_defs})")
+
+                insert = (
+                    f"INSERT INTO {_quote(table)} VALUES ({', '.join('?' for _ in columns)})"
+                )
+                batch = []
+                for row in reader:
+                    batch.append(row)
+                    if len(batch) >= _INSERT_BATCH_SIZE:
+                        conn.executemany(insert, batch)
+                        batch = []
+                if batch:
+                    conn.executemany(insert, batch)
+
+            # 参照に使うキー列の組み合わせに複合インデックスを作成する
+            key_defs = ", ".join(_quote(c) for c in key_columns)
+            conn.execute(f"CREATE INDEX {_quote(table + '_key')} ON {_quote(table)} ({key_defs})")
+        conn.commit()
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    os.replace(tmp_path, output_path)
+
+
+class SqliteProfileStore:
+    """
+    convert_csv_to_sqliteで作成したSQLiteファイルから、キーに一致する1行だけを読み出すストアです。
+    ProfileStoreと同じインターフェースを持ちます。接続はスレッドごとに読み取り専用で開き、
+    ファイルが置き換えられた場合は次回参照時に開き直します。
+    """
+
+    def __init__(self, path: str, tables: dict = PROFILE_TABLES):
+        self.path = path
+        self._tables = tables
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        stat = os.stat(self.path)
+        # ファイルの置き換えを検知するため、inodeと更新日時を接続と一緒に保持する
+        version = (stat.st_ino, stat.st_mtime_ns)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.version != version:
+            if conn is not None:
+                conn.close()
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            self._local.version = version
+        return conn
+
+    def lookup(self, table: str, *keys) -> dict | None:
+        """キーに一致する行を辞書で返します。見つからない場合はNoneを返します。"""
+        _, key_columns = self._tables[table]
+        where = " AND ".join(f"{_quote(c)} = ?" for c in key_columns)
+        row = self._connection().execute(
+            f"SELECT * FROM {_quote(table)} WHERE {where} LIMIT 1",
+            tuple(str(key) for key in keys),
+        ).fetchone()
+        return dict(row) if row is not None else None
+
+    def get_company(self, site_id, company_id) -> dict | None:
+        return self.lookup("companies", site_id, company_id)
+
+    def get_product(self, site_id, product_id) -> dict | None:
+        return self.lookup("products", site_id, product_id)
+
+    def get_persona(self, site_id, product_id, persona_id) -> dict | None:
+        return self.lookup("customerpersonas", site_id, product_id, persona_id)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Converts the customer table CSVs into an indexed SQLite file."
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default="db/profiles.sqlite",
+        help="Path of the SQLite file to write",
+    )
+    args = parser.parse_args()
+    convert_csv_to_sqlite(args.output)
+    print(f"Wrote {args.output}")
@@ -0,0 +1,180 @@
+"""
+会社・プロダクト・ペルソナの行を、stateに保持するコンパクトなレコード（state.pyのCompanyRecordなど）に変換し、
+LLMを呼び出すノードでプロンプトのテキストに変換するモジュールです。
+stateにはIDと項目の値だけを保持し、見出し・ラベル・締めの一文はプロンプトを組み立てる時にだけ付けます。
+プロダクト・ペルソナのレコードは、キーワードによらない部分（fields）とキーワードに関連する部分（excerpt）に分けて持ちます。
+fieldsは同じ行からは常に同じテキストになるため、テナントごとのプロンプトの先頭部分が一致し、プロンプトキャッシュが効きます。
+excerptはキーワードごとに変わるため、プロンプトのキーワードより後ろに置きます（render_profile_excerpt）。
+"""
+
+from blog_makearticle2.src.prompts import render_profile_block
+from blog_makearticle2.src.relevance import exclude_sentences, select_leading_fields, select_relevant_fields
+from blog_makearticle2.src.state import CompanyRecord, PersonaRecord, ProductRecord
+
+# 項目の定義（レコードのキー, プロンプトでのラベル, 元の列）。複数の列は", "で連結して1つの項目にする
+COMPANY_FIELDS = (
+    ("company_name", "会社名", ("company_name",)),
+    ("industry", "業界", ("industry",)),
+    ("location", "所在地", ("location",)),
+    ("website_url", "ウェブサイト", ("website_url",)),
+)
+
+PRODUCT_FIELDS = (
+    ("appeal_policy", "アピールポイント", ("appeal_policy",)),
+    ("product_introduction", "製品紹介", ("product_introduction",)),
+    ("functionality", "機能", ("functionality",)),
+    ("features", "特徴", ("feature_1", "feature_2", "feature_3")),
+    ("competitive_point", "競争優位性", ("competitive_point",)),
+    ("problem_and_solution", "課題と解決策", ("problem_and_solution_1", "problem_and_solution_2", "problem_and_solution_3")),
+    ("industry_pain_points", "業界のペインポイント", ("industry_pain_points",)),
+    ("target_approach_to_pain", "ペインに対するアプローチ", ("target_approach_to_pain",)),
+    ("service_record", "導入実績", ("service_record",)),
+    ("client_partners", "クライアント・パートナー", ("client_partners",)),
+    ("credentials", "認証・実績", ("credentials",)),
+    ("organization_size", "組織規模", ("organization_size",)),
+    ("external_review", "外部レビュー", ("external_review",)),
+    ("price_advantage", "価格の優位性", ("price_advantage",)),
+    ("support_system", "サポート体制", ("support_system",)),
+    ("faq", "FAQ", ("faq",)),
+)
+
+PERSONA_FIELDS = (
+    ("industry", "業界", ("industry",)),
+    ("companySize", "企業規模", ("companySize",)),
+    ("employeeSize", "従業員数", ("employeeSize",)),
+    ("targetRegion", "ターゲット地域", ("targetRegion",)),
+    ("existingClients", "既存クライアント", ("existingClients",)),
+    ("customerPriceRange", "顧客の価格帯", ("customerPriceRange",)),
+    ("leadTimeToAdoption", "導入までのリードタイム", ("leadTimeToAdoption",)),
+    ("serviceDepartment", "サービス部門", ("serviceDepartment",)),
+    ("position", "ポジション", ("position",)),
+    ("roleAndMission", "役割とミッション", ("roleAndMission",)),
+    ("infoMethods", "情報収集方法", ("infoMethods",)),
+    ("selectionCriteria", "選定基準", ("selectionCriteria",)),
+    ("considerationTrigger", "検討のきっかけ", ("considerationTrigger",)),
+    ("businessIssues", "ビジネス課題", ("businessIssues",)),
+    ("currentSolutionMethods", "現在の解決策", ("currentSolutionMethods",)),
+    ("productKnowledge", "プロダクトの知識", ("productKnowledge",)),
+    ("persona_title", "ペルソナのタイトル", ("persona_title",)),
+    ("age", "年齢", ("age",)),
+    ("value", "価値観", ("value",)),
+    ("pain", "ペインポイント", ("pain",)),
+)
+
+# 該当する行がない場合のテキスト
+COMPANY_NOT_FOUND = "該当するデータが見つかりませんでした。"
+NOT_FOUND = "No matching records found."
+
+
+def _row_fields(definitions: tuple, row: dict) -> list[tuple[str, str]]:
+    """行を (ラベル, 値) のリストに変換します。"""
+    return [(label, ", ".join(row[column] for column in columns)) for _, label, columns in definitions]
+
+
+def _select_fields(
+    definitions: tuple, row: dict, query: str, budget: int | None, excerpt_budget: int | None
+) -> tuple[dict[str, str], dict[str, str]]:
+    """
+    キーワードによらない項目・文を`budget`まで選び、残りの文からクエリに関連するものを`excerpt_budget`まで選びます。
+    それぞれ {レコードのキー: 値} の辞書で返します。
+    """
+    keys = {label: key for key, label, _ in definitions}
+    fields = _row_fields(definitions, row)
+    stable = select_leading_fields(fields, budget)
+    excerpt = []
+    if query and excerpt_budget:
+        excerpt = select_relevant_fields(exclude_sentences(fields, stable), query, excerpt_budget)
+    return {keys[label]: value for label, value in stable}, {keys[label]: value for label, value in excerpt}
+
+
+def build_company_record(site_id, company_id, row: dict | None) -> CompanyRecord | None:
+    """会社の行から、すべての項目を持つレコードを作成します。"""
+    if row is None:
+        return None
+    return {
+        "site_id": str(site_id),
+        "company_id": str(company_id),
+        "fields": {key: ", ".join(row[column] for column in columns) for key, _, columns in COMPANY_FIELDS},
+    }
+
+
+def build_product_record(
+    site_id, product_id, row: dict | None, query: str, budget: int | None, excerpt_budget: int | None = None
+) -> ProductRecord | None:
+    """プロダクトの行から、キーワードによらない項目・文と、クエリに関連する項目・文を持つレコードを作成します。"""
+    if row is None:
+        return None
+    fields, excerpt = _select_fields(PRODUCT_FIELDS, row, query, budget, excerpt_budget)
+    return {"site_id": str(site_id), "product_id": str(product_id), "fields": fields, "excerpt": excerpt}
+
+
+def build_persona_record(
+    site_id, product_id, persona_id, row: dict | None, query: str, budget: int | None, excerpt_budget: int | None = None
+) -> PersonaRecord | None:
+    """ペルソナの行から、キーワードによらない項目・文と、クエリに関連する項目・文を持つレコードを作成します。"""
+    if row is None:
+        return None
+    fields, excerpt = _select_fields(PERSONA_FIELDS, row, query, budget, excerpt_budget)
+    return {
+        "site_id": str(site_id),
+        "product_id": str(product_id),
+        "persona_id": str(persona_id),
+        "fields": fields,
+        "excerpt": excerpt,
+    }
+
+
+def _render(title: str, definitions: tuple, fields: dict, footer: str) -> str:
+    """見出し・項目ごとの行（定義の順）・締めの一文からなるテキストにまとめます。"""
+    text = f"{title}\n"
+    for key, label, _ in definitions:
+        if key in fields:
+            text += f"{label}: {fields[key]}\n"
+    return text + footer
+
+
+def render_company(record: CompanyRecord | None) -> str:
+    """会社のレコードをプロンプトに渡すテキストにまとめます。レコードがない場合は該当なしのテキストを返します。"""
+    if record is None:
+        return COMPANY_NOT_FOUND
+    return _render("# 会社情報", COMPANY_FIELDS, record["fields"], "\n会社情報のクエリ結果は以上です。\n")
+
+
+def render_product(record: ProductRecord | None) -> str:
+    """プロダクトのレコードをプロンプトに渡すテキストにまとめます。"""
+    if record is None:
+        return NOT_FOUND
+    return _render("# 自社プロダクトの情報", PRODUCT_FIELDS, record["fields"], "自社プロダクトのクエリ結果は以上です。\n")
+
+
+def render_persona(record: PersonaRecord | None) -> str:
+    """ペルソナのレコードをプロンプトに渡すテキストにまとめます。"""
+    if record is None:
+        return NOT_FOUND
+    return _render("# 顧客ペルソナの情報", PERSONA_FIELDS, record["fields"], "顧客ペルソナのクエリ結果は以上です。\n")
+
+
+def render_profile(company: CompanyRecord | None, product: ProductRecord | None, persona: PersonaRecord | None) -> str:
+    """
+    会社・プロダクト・ペルソナのレコードを、プロンプトに渡すプロファイル情報のテキストにまとめます。
+    キーワードによらない部分（fields）だけを使うため、同じテナントでは常に同じテキストになります。
+    """
+    return render_profile_block(render_company(company), render_product(product), render_persona(persona))
+
+
+def render_profile_excerpt(product: ProductRecord | None, persona: PersonaRecord | None) -> str:
+    """
+    プロダクト・ペルソナのレコードのうち、キーワードに関連して追加で選んだ部分（excerpt）をテキストにまとめます。
+    追加で選んだ部分がない場合は空文字を返します。
+    """
+    parts = [
+        _render(title, definitions, record["excerpt"], "")
+        for title, definitions, record in (
+            ("## 自社プロダクトの情報", PRODUCT_FIELDS, product),
+            ("## 顧客ペルソナの情報", PERSONA_FIELDS, persona),
+        )
+        if record and record.get("excerpt")
+    ]
+    if not parts:
+        return ""
+    return "# 指定キーワードに関連する追加の情報\n" + "\n".join(parts)
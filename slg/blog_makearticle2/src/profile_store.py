@@ -0,0 +1,104 @@
+import os
+import threading
+
+# テーブル定義（テーブル名: (CSVファイルのパス, インデックスに使うキー列)）
+PROFILE_TABLES = {
+    "companies": (
+        "db/aibow_customerTable - companies.csv",
+        ("site_id", "company_id"),
+    ),
+    "products": (
+        "db/aibow_customerTable - products.csv",
+        ("site_id", "product_id"),
+    ),
+    "customerpersonas": (
+        "db/aibow_customerTable - customerpersonas.csv",
+        ("site_id", "product_id", "persona_id"),
+    ),
+}
+
+
+class ProfileStore:
+    """
+    顧客テーブル（会社・プロダクト・ペルソナ）をメモリ上に保持するストアです。
+    各CSVは初回参照時に一度だけ読み込み、キー列のタプルでハッシュインデックスを作成します。
+    CSVの更新日時（mtime）が変わった場合は、次回参照時に読み込み直します。
+    """
+
+    def __init__(self, tables: dict = PROFILE_TABLES):
+        self._tables = tables
+        self._indexes = {}  # テーブル名 -> {キーのタプル: 行の辞書}
+        self._mtimes = {}  # テーブル名 -> 読み込み時のmtime
+        self._lock = threading.Lock()
+
+    def _load(self, table: str) -> dict:
+        """CSVを読み込み、キー列のタプルをキーとする辞書を作成します。"""
+        # pandasはインポートに時間がかかるため、初回の読み込み時にインポートする
+        import pandas as pd
+
+        path, key_columns = self._tables[table]
+        # すべての列を文字列として読み込み、空欄は空文字のまま扱う
+        df = pd.read_csv(path, dtype=str, keep_default_na=False)
+        index = {}
+        for row in df.to_dict("records"):
+            # キーが重複している場合は、従来の参照（.iloc[0]）と同じく最初の行を使う
+            index.setdefault(tuple(row[column] for column in key_columns), row)
+        return index
+
+    def _get_index(self, table: str) -> dict:
+        """テーブルのインデックスを返します。CSVが更新されていれば読み込み直します。"""
+        path, _ = self._tables[table]
+        mtime = os.stat(path).st_mtime_ns
+        if self._mtimes.get(table) == mtime:
+            return self._indexes[table]
+
+        with self._lock:
+            # 別スレッドが先に読み込み直している場合はそれを使う
+            if self._mtimes.get(table) != mtime:
+                # 読み込みが完了してからインデックスを差し替えるため、参照中のスレッドは古いインデックスを使い続けられる
+                self._indexes[table] = self._load(table)
+                self._mtimes[table] = mtime
+            return self._indexes[table]
+
+    def lookup(self, table: str, *keys) -> dict | None:
+        """キーに一致する行を辞書で返します。見つからない場合はNoneを返します。"""
+        index = self._get_index(table)
+        return index.get(tuple(str(key) for key in keys))
+
+    def get_company(self, site_id, company_id) -> dict | None:
+        return self.lookup("companies", site_id, company_id)
+
+    def get_product(self, site_id, product_id) -> dict | None:
+        return self.lookup("products", site_id, product_id)
+
+    def get_persona(self, site_id, product_id, persona_id) -> dict | None:
+        return self.lookup("customerpersonas", site_id, product_id, persona_id)
+
+
+def build_profile_store():
+    """
+    環境変数`PROFILE_DB_PATH`が設定されている場合は、インデックス付きのSQLiteファイルから1行ずつ読み出すストアを返します。
+    未設定の場合は、CSVをメモリに読み込むProfileStoreを返します。
+    """
+    path = os.environ.get("PROFILE_DB_PATH")
+    if path:
+        # profile_dbはこのモジュールのテーブル定義を参照するため、循環しないようここでインポートする
+        from blog_makearticle2.src.profile_db import SqliteProfileStore
+
+        return SqliteProfileStore(path)
+    return ProfileStore()
+
+
+# プロセス内で共有するストア（.envの読み込み後に設定を反映させるため、初回参照時に作成する）
+_profile_store = None
+_profile_store_lock = threading.Lock()
+
+
+def get_profile_store():
+    """プロセス内で共有するストアを返します。"""
+    global _profile_store
+    if _profile_store is None:
+        with _profile_store_lock:
+            if _profile_store is None:
+                _profile_store = build_profile_store()
+    return _profile_store
@@ -0,0 +1,131 @@
+import logging
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+
+logger = logging.getLogger(__name__)
+
+# プロンプトは変化しにくい順（指示 → 会社・プロダクト・ペルソナ → キーワード・キーワードに関連する情報 → アウトライン・フィードバック）に並べる
+# OpenAIのプロンプトキャッシュは先頭から一致した部分にのみ効くため、先頭側の内容は実行ごとに1バイトも変えないこと
+
+# アウトライン作成の定義と指示（全テナント共通）
+OUTLINE_SYSTEM_PROMPT = """# 定義
+あなたはBtoB領域に特化した優秀なSEOライターです。
+
+# 指示
+与えられた会社情報・自社プロダクトの情報・顧客ペルソナの情報をもとにして、指定キーワードで検索順位上位を獲得するためのブログ記事のアウトラインを作成してください。
+## 補足情報
+- アウトラインを作成する際は、ペルソナが抱えているであろう課題や疑問に焦点を当ててください。
+- 記事内での比率は、ペルソナの課題や疑問に対する解決策が70%、自社プロダクトが30%程度となるよう記載してください。
+- ペルソナが抱えている課題や疑問に対して、自社のサービス・プロダクトがどのように解決できるかを明確に示してください。
+- 記事のタイトルは、ペルソナが検索するであろうキーワードを含むものにしてください。
+- 記事の内容は、与えられている情報をすべて活用しようとせず、ペルソナが抱えている課題や疑問の解消を第一の目的としてください。
+"""
+
+# 記事本文のセクションを執筆する際の定義と指示（全テナント共通）
+ARTICLE_SYSTEM_PROMPT = """# 定義
+あなたはBtoB領域に特化した優秀なSEOライターです。
+
+# 指示
+承認済みのブログ記事のアウトラインのうち、指定された1つのセクションの本文を執筆してください。
+## 補足情報
+- 指定されたセクションの見出しから始め、そのセクションの本文だけをmarkdownで出力してください。
+- アウトラインの他のセクションで扱う内容には触れず、重複を避けてください。
+- 与えられた会社情報・自社プロダクトの情報・顧客ペルソナの情報は、このセクションに関係するものだけを使ってください。
+- ペルソナが抱えている課題や疑問の解消を第一の目的とし、自社プロダクトの紹介は必要な場合に留めてください。
+"""
+
+# call_modelで使うシステムプロンプト
+ANALYST_SYSTEM_PROMPT = "あなたは優秀なデータアナリストです。特にBtoB向けのSEO施策に深い知見を持っています。"
+
+
+def render_profile_block(company_info: str, product_info: str, persona_info: str) -> str:
+    """会社・プロダクト・ペルソナの情報を常に同じ順序・同じ区切りで1つのテキストにまとめます。"""
+    return "\n".join([company_info, product_info, persona_info])
+
+
+def render_keyword_prompt(write_word: str) -> str:
+    """キーワードごとに変わる指示を作成します。"""
+    return f"# 指定キーワード\n{write_word}\n\n上記の指定キーワードでブログ記事のアウトラインを作成してください。"
+
+
+def render_feedback_prompt(feedback: str | None) -> str:
+    """直前のアウトラインに対するフィードバックを作成します。"""
+    text = "ユーザーは直前のアウトラインに満足していません。内容を見直して、改善したアウトラインを作成してください。"
+    if feedback and feedback.strip().lower() != "no":
+        text += f"\n# フィードバック\n{feedback}"
+    return text
+
+
+def render_section_feedback_prompt(number: int, section: str, comment: str) -> str:
+    """直前のアウトラインのうち、1つのセクションだけを作り直すための指示を作成します。"""
+    return (
+        f"直前のアウトラインのうち、{number}番目のセクションだけを改善してください。\n"
+        "他のセクションとの重複を避け、同じ見出しレベルの見出しから始まるそのセクションのmarkdownのみを出力してください。\n"
+        f"# 対象のセクション\n{section}\n"
+        f"# フィードバック\n{comment}"
+    )
+
+
+def build_outline_messages(
+    seed_messages: list,
+    profile_block: str,
+    write_word: str,
+    latest_outline: BaseMessage | None = None,
+    feedback: str | None = None,
+    feedback_prompt: str | None = None,
+    profile_excerpt: str = "",
+) -> list:
+    """
+    アウトライン作成用のメッセージ列を、変化しにくい順に組み立てます。
+    システムプロンプトと依頼文 → プロファイル情報 → キーワード → キーワードに関連するプロファイル情報 → 直前のアウトライン → フィードバック
+    の順になります。`profile_excerpt`が空の場合は、キーワードに関連するプロファイル情報のメッセージを省きます。
+    `feedback_prompt`を指定した場合は、フィードバックの指示の代わりにそれを使います（セクション単位の再生成など）。
+    """
+    messages = [SystemMessage(OUTLINE_SYSTEM_PROMPT), *seed_messages, HumanMessage(profile_block)]
+    messages.append(HumanMessage(render_keyword_prompt(write_word)))
+    if profile_excerpt:
+        messages.append(HumanMessage(profile_excerpt))
+    if latest_outline is not None:
+        messages.append(latest_outline)
+        messages.append(HumanMessage(feedback_prompt or render_feedback_prompt(feedback)))
+    return messages
+
+
+def render_article_outline_prompt(write_word: str, headings: list[str]) -> str:
+    """記事全体で共通の、キーワードと承認済みのアウトラインの見出しの一覧を作成します。"""
+    return f"# 指定キーワード\n{write_word}\n\n# 承認済みのアウトラインの見出し\n" + "\n".join(headings)
+
+
+def render_section_writer_prompt(number: int, section: str) -> str:
+    """執筆するセクションの指示を作成します。"""
+    return f"# 執筆するセクション（{number}番目）\n{section}\n\n上記のセクションの本文を執筆してください。"
+
+
+def build_section_messages(
+    write_word: str, headings: list[str], profile_block: str, number: int, section: str, profile_excerpt: str = ""
+) -> list:
+    """
+    セクション執筆用のメッセージ列を、変化しにくい順に組み立てます。
+    システムプロンプト → プロファイル情報（同じテナントで共通） → キーワードとアウトラインの見出し（同じ記事のセクション間で共通）
+    → セクションに関連するプロファイル情報 → セクションの指示（見出しと本文） の順になります。
+    他のセクションの本文は渡さず、見出しの一覧だけで記事全体の構成を伝えます。
+    """
+    messages = [
+        SystemMessage(ARTICLE_SYSTEM_PROMPT),
+        HumanMessage(profile_block),
+        HumanMessage(render_article_outline_prompt(write_word, headings)),
+    ]
+    if profile_excerpt:
+        messages.append(HumanMessage(profile_excerpt))
+    messages.append(HumanMessage(render_section_writer_prompt(number, section)))
+    return messages
+
+
+def record_prompt_cache_usage(response: BaseMessage, node: str) -> int:
+    """レスポンスのusage_metadataから、プロンプトキャッシュが効いたトークン数をログに記録して返します。"""
+    usage = getattr(response, "usage_metadata", None) or {}
+    cached_tokens = (usage.get("input_token_details") or {}).get("cache_read", 0)
+    logger.info(
+        "%s prompt tokens: %s (cached: %s)", node, usage.get("input_tokens", 0), cached_tokens
+    )
+    return cached_tokens
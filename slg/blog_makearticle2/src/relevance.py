@@ -0,0 +1,186 @@
+"""
+プロファイル情報（プロダクト・ペルソナの各項目）から、プロンプトに渡す内容を選び出すモジュールです。
+キーワードによらない部分（select_leading_fields）は、項目の定義順に先頭の文からトークン数の上限まで採用します。
+キーワードに関連する部分（select_relevant_fields）は、日本語は単語の区切りがないため、文字バイグラムを語とするBM25で
+項目内の文ごとにスコアを付け、スコアの高い文からトークン数の上限まで採用します。採用した文は元の項目・元の順序に戻して返します。
+"""
+
+import math
+import re
+import unicodedata
+from collections import Counter
+
+from blog_makearticle2.src.context import count_text_tokens
+
+# プロダクト・ペルソナの情報それぞれについて、キーワードによらずプロンプトの先頭側に置く部分のトークン数の上限
+# （configの`profileTokenBudget`、環境変数`PROFILE_TOKEN_BUDGET`で上書きできる）
+DEFAULT_PROFILE_TOKEN_BUDGET = 800
+# アウトライン作成時に、指定キーワードに関連する内容として追加するトークン数の上限
+# （configの`profileExcerptTokenBudget`、環境変数`PROFILE_EXCERPT_TOKEN_BUDGET`で上書きできる）
+DEFAULT_PROFILE_EXCERPT_TOKEN_BUDGET = 400
+# 記事本文のセクションごとに、セクションに関連する内容として追加するトークン数の上限
+# （configの`sectionProfileTokenBudget`、環境変数`SECTION_PROFILE_TOKEN_BUDGET`で上書きできる）
+DEFAULT_SECTION_PROFILE_TOKEN_BUDGET = 400
+
+# 項目1件あたりのラベル（"ラベル: "）と改行によるトークンのオーバーヘッド
+_TOKENS_PER_FIELD = 4
+
+# 文の区切り（句点・感嘆符・疑問符・改行、空白や読点に続く箇条書きの「・」）
+# 「サービス・企業」のような語の間の「・」では区切らない
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[。！？!?])|\n|(?<=[\s,、])(?=・)")
+# n-gramの作成時に取り除く文字（空白・記号）
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def normalize_text(text: str) -> str:
+    """全角・半角を揃え（NFKC）、小文字に変換します。"""
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def char_ngrams(text: str, n: int = 2) -> list[str]:
+    """
+    テキストを文字n-gramに分割します。記号や空白で区切られた部分ごとに作成し、n文字未満の部分はそのまま1語とします。
+    """
+    grams = []
+    for run in _NON_WORD.split(normalize_text(text)):
+        if not run:
+            continue
+        if len(run) < n:
+            grams.append(run)
+        else:
+            grams.extend(run[i:i + n] for i in range(len(run) - n + 1))
+    return grams
+
+
+def split_sentences(text: str) -> list[str]:
+    """テキストを文（箇条書きの項目を含む）に分割します。空の文は除きます。"""
+    return [sentence.strip() for sentence in _SENTENCE_BOUNDARY.split(text) if sentence and sentence.strip()]
+
+
+class BM25Index:
+    """文字n-gramを語とするBM25のインデックスです。"""
+
+    def __init__(self, documents: list[str], k1: float = 1.5, b: float = 0.75, n: int = 2):
+        self.k1 = k1
+        self.b = b
+        self.n = n
+        self._term_freqs = [Counter(char_ngrams(document, n)) for document in documents]
+        self._lengths = [sum(tf.values()) for tf in self._term_freqs]
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+        document_freqs = Counter(term for tf in self._term_freqs for term in tf)
+        count = len(documents)
+        self._idf = {
+            term: math.log(1 + (count - df + 0.5) / (df + 0.5)) for term, df in document_freqs.items()
+        }
+
+    def scores(self, query: str) -> list[float]:
+        """クエリに対する各文書のスコアを返します。"""
+        terms = set(char_ngrams(query, self.n))
+        results = []
+        for tf, length in zip(self._term_freqs, self._lengths):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * length / self._avg_length) if self._avg_length else self.k1
+            for term in terms:
+                freq = tf.get(term)
+                if freq:
+                    score += self._idf[term] * freq * (self.k1 + 1) / (freq + norm)
+            results.append(score)
+        return results
+
+
+def _fits(fields: list[tuple[str, str]], max_tokens: int | None, model_name: str) -> bool:
+    if not max_tokens:
+        return True
+    return sum(count_text_tokens(value, model_name) + _TOKENS_PER_FIELD for _, value in fields) <= max_tokens
+
+
+def select_leading_fields(
+    fields: list[tuple[str, str]],
+    max_tokens: int | None,
+    model_name: str = "gpt-4o-mini",
+) -> list[tuple[str, str]]:
+    """
+    (ラベル, 値) のリストから、項目の順に先頭の文を`max_tokens`トークン以内で選び、同じ形式で返します。
+    キーワードを使わないため、同じ行からは常に同じ結果になります（プロンプトキャッシュが効く先頭側に置く部分に使う）。
+    全体が上限に収まる場合や、上限が指定されていない場合はそのまま返します。上限に収まらない文は飛ばします。
+    """
+    if _fits(fields, max_tokens, model_name):
+        return fields
+    selected = []
+    remaining = max_tokens
+    for label, value in fields:
+        sentences = []
+        for sentence in split_sentences(value):
+            cost = count_text_tokens(sentence, model_name) + (0 if sentences else _TOKENS_PER_FIELD)
+            if cost > remaining:
+                continue
+            remaining -= cost
+            sentences.append(sentence)
+        if sentences:
+            selected.append((label, " ".join(sentences)))
+    return selected
+
+
+def exclude_sentences(fields: list[tuple[str, str]], excluded: list[tuple[str, str]]) -> list[tuple[str, str]]:
+    """(ラベル, 値) のリストから、`excluded`に含まれる文を除いたものを返します。文が残らない項目は除きます。"""
+    seen = {normalize_text(sentence) for _, value in excluded for sentence in split_sentences(value)}
+    remaining = []
+    for label, value in fields:
+        sentences = [sentence for sentence in split_sentences(value) if normalize_text(sentence) not in seen]
+        if sentences:
+            remaining.append((label, " ".join(sentences)))
+    return remaining
+
+
+def select_relevant_fields(
+    fields: list[tuple[str, str]],
+    query: str,
+    max_tokens: int | None,
+    model_name: str = "gpt-4o-mini",
+) -> list[tuple[str, str]]:
+    """
+    (ラベル, 値) のリストから、クエリに関連する文を`max_tokens`トークン以内で選び、同じ形式で返します。
+    全体が上限に収まる場合や、上限が指定されていない場合はそのまま返します。
+    ラベルも文のスコアに含めるため、「価格」のようなキーワードでは価格の項目全体が優先されます。
+    同じ文が複数の項目に含まれている場合は最初の1つだけを採用します。
+    """
+    if not query or _fits(fields, max_tokens, model_name):
+        return fields
+
+    # 文単位に分割し、重複する文を除く（位置はスコアが同じ場合の並び順と、元の順序への復元に使う）
+    units = []
+    seen = set()
+    for field_index, (label, value) in enumerate(fields):
+        for sentence in split_sentences(value):
+            key = normalize_text(sentence)
+            if key in seen:
+                continue
+            seen.add(key)
+            units.append((field_index, len(units), label, sentence))
+    if not units:
+        return []
+
+    index = BM25Index([f"{label} {sentence}" for _, _, label, sentence in units])
+    scores = index.scores(query)
+
+    # スコアの高い順（同点の場合は元の順序）に、上限に収まる文を採用する
+    selected = []
+    used_fields = set()
+    remaining = max_tokens
+    for position in sorted(range(len(units)), key=lambda i: (-scores[i], i)):
+        field_index, _, _, sentence = units[position]
+        cost = count_text_tokens(sentence, model_name)
+        if field_index not in used_fields:
+            cost += _TOKENS_PER_FIELD
+        if cost > remaining:
+            continue
+        remaining -= cost
+        used_fields.add(field_index)
+        selected.append(position)
+
+    # 採用した文を元の項目・元の順序に戻す
+    grouped = {}
+    for position in sorted(selected):
+        field_index, _, _, sentence = units[position]
+        grouped.setdefault(field_index, []).append(sentence)
+    return [(fields[field_index][0], " ".join(sentences)) for field_index, sentences in sorted(grouped.items())]
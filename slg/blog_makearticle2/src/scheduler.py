@@ -0,0 +1,468 @@
+"""
+OpenAI APIへのHTTPリクエストを、プロセス内のすべてのスレッドで共有する方針で送るスケジューラです。
+ChatOpenAIに渡すhttpxのトランスポートとして動作し、次の処理を行います。
+
+- リクエスト数・トークン数のトークンバケットによる流量制限（プロセス内で共有）
+- 429・5xx・タイムアウトに対する、ジッター付き指数バックオフでの再試行（Retry-Afterがあればそれに従う）
+- 応答ヘッダーが返るまでの時間が直近のパーセンタイルを超えた場合の、重複リクエスト（ヘッジ）の送信
+- 一定回数失敗した後の、代替モデルへの切り替え
+
+ストリーミングの場合も応答ヘッダーが返った時点でトランスポートから戻るため、ヘッジの判定は最初のトークンまでの時間に近くなります。
+ヘッダーの受信後に本文の途中で止まった場合は、ここでは再試行しません。
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import httpx
+
+from blog_makearticle2.src.instrumentation import metrics
+
+logger = logging.getLogger(__name__)
+
+# 再試行するステータスコード
+RETRYABLE_STATUS_CODES = frozenset({408, 409, 429, 500, 502, 503, 504})
+
+# リクエストにmax_tokensの指定がない場合に見込む出力トークン数
+DEFAULT_COMPLETION_TOKENS = 1000
+
+# ヘッジを有効にした場合に、リクエストを送るスレッドの数（同時に送るリクエスト数×2より少ないと、スレッドの空き待ちが遅延として計測されてヘッジが増える）
+DEFAULT_HEDGE_WORKERS = 128
+
+
+class TokenBucket:
+    """
+    1分あたりの量で指定するトークンバケットです。
+    予約した量を先に差し引き、不足分が補充されるまでの待ち時間を返すため、待っている呼び出し元には先着順に枠が割り当てられます。
+    一度に使える量（capacity）の既定値は10秒分とし、バッチの開始時に1分間の枠を一度に使い切らないようにします。
+    """
+
+    def __init__(self, per_minute: float, capacity: float | None = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or max(1.0, per_minute / 6)
+        self._available = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._available = min(self.capacity, self._available + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """`amount`を予約し、利用できるようになるまでの秒数を返します。"""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill(time.monotonic())
+            self._available -= amount
+            return 0.0 if self._available >= 0 else -self._available / self.rate
+
+    def try_reserve(self, amount: float) -> bool:
+        """待たずに利用できる場合だけ`amount`を予約します。"""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._available < amount:
+                return False
+            self._available -= amount
+            return True
+
+
+class LatencyTracker:
+    """直近の応答時間（応答ヘッダーが返るまでの秒数）を保持し、パーセンタイルを返します。"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p: float) -> float | None:
+        """サンプル数が`min_samples`に満たない場合はNoneを返します。"""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def estimate_request_tokens(body: bytes) -> int:
+    """
+    リクエストの本文から、流量制限で予約するトークン数を見積もります。
+    日本語は1文字あたりおよそ1トークンのため、メッセージの文字数に出力トークンの上限（未指定の場合は既定値）を加えます。
+    """
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return DEFAULT_COMPLETION_TOKENS
+    prompt = 0
+    for message in payload.get("messages") or []:
+        content = message.get("content")
+        if isinstance(content, str):
+            prompt += len(content)
+        elif isinstance(content, list):
+            prompt += sum(len(part.get("text", "")) for part in content if isinstance(part, dict))
+    completion = payload.get("max_completion_tokens") or payload.get("max_tokens") or DEFAULT_COMPLETION_TOKENS
+    return prompt + completion
+
+
+def _with_model(request: httpx.Request, body: bytes, model: str | None) -> httpx.Request:
+    """リクエストを作り直します。`model`を指定した場合は本文のモデル名を置き換えます。"""
+    if model is not None:
+        try:
+            payload = json.loads(body)
+            payload["model"] = model
+            body = json.dumps(payload).encode("utf-8")
+        except ValueError:
+            pass
+    headers = [(k, v) for k, v in request.headers.multi_items() if k.lower() != "content-length"]
+    return httpx.Request(
+        request.method, request.url, headers=headers, content=body, extensions=request.extensions
+    )
+
+
+def _retry_after(response: httpx.Response | None) -> float | None:
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _is_retryable(response: httpx.Response) -> bool:
+    return response.status_code in RETRYABLE_STATUS_CODES
+
+
+class ModelCallScheduler:
+    """
+    流量制限・再試行・ヘッジ・代替モデルへの切り替えの方針と、プロセス内で共有する状態（バケット・応答時間）を保持します。
+    同期版（ScheduledTransport）と非同期版（AsyncScheduledTransport）のトランスポートから共有して使います。
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 20.0,
+        hedge_percentile: float | None = None,
+        hedge_min_samples: int = 20,
+        fallback_model: str | None = None,
+        fallback_after: int = 2,
+        hedge_workers: int = DEFAULT_HEDGE_WORKERS,
+    ):
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_percentile = hedge_percentile
+        self.latencies = LatencyTracker(min_samples=hedge_min_samples)
+        self.fallback_model = fallback_model
+        self.fallback_after = fallback_after
+        self.hedge_workers = hedge_workers
+        self._hedge_executor = None
+        self._hedge_executor_lock = threading.Lock()
+
+    # 方針
+
+    def reserve(self, tokens: int) -> float:
+        """1リクエスト分とトークン数を予約し、送信まで待つ秒数を返します。"""
+        delay = 0.0
+        if self.request_bucket is not None:
+            delay = max(delay, self.request_bucket.reserve(1))
+        if self.token_bucket is not None:
+            delay = max(delay, self.token_bucket.reserve(tokens))
+        if delay > 0:
+            metrics.record_llm_request("throttled")
+        return delay
+
+    def try_reserve_hedge(self, tokens: int) -> bool:
+        """待たずに送れる場合だけヘッジ用の枠を予約します（ヘッジで過負荷を悪化させないため）。"""
+        if self.request_bucket is not None and not self.request_bucket.try_reserve(1):
+            return False
+        if self.token_bucket is not None and not self.token_bucket.try_reserve(tokens):
+            return False
+        return True
+
+    def hedge_delay(self) -> float | None:
+        """ヘッジを送るまでの秒数を返します。ヘッジが無効、またはサンプルが足りない場合はNoneを返します。"""
+        if self.hedge_percentile is None:
+            return None
+        return self.latencies.percentile(self.hedge_percentile)
+
+    def backoff(self, attempt: int, response: httpx.Response | None) -> float:
+        """再試行までの秒数を返します（フルジッター付きの指数バックオフ。Retry-Afterがあればそれ以上待つ）。"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        retry_after = _retry_after(response)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    def model_for_attempt(self, attempt: int) -> str | None:
+        """試行ごとに使うモデル名を返します。Noneの場合はリクエストのモデル名をそのまま使います。"""
+        if self.fallback_model and attempt >= self.fallback_after:
+            return self.fallback_model
+        return None
+
+    # 同期版
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._hedge_executor is None:
+            with self._hedge_executor_lock:
+                if self._hedge_executor is None:
+                    self._hedge_executor = ThreadPoolExecutor(self.hedge_workers, thread_name_prefix="llm-hedge")
+        return self._hedge_executor
+
+    def _timed_send(self, send, request: httpx.Request) -> httpx.Response:
+        start = time.monotonic()
+        response = send(request)
+        if response.status_code < 400:
+            self.latencies.record(time.monotonic() - start)
+        return response
+
+    def _send_hedged(self, send, request: httpx.Request, body: bytes, model: str | None, tokens: int):
+        delay = self.hedge_delay()
+        if delay is None:
+            return self._timed_send(send, request)
+
+        executor = self._executor()
+        first = executor.submit(self._timed_send, send, request)
+        done, _ = wait([first], timeout=delay)
+        if done or not self.try_reserve_hedge(tokens):
+            return first.result()
+
+        metrics.record_llm_request("hedge")
+        second = executor.submit(self._timed_send, send, _with_model(request, body, model))
+        pending = {first, second}
+        finished = []
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            finished.extend(done)
+            for future in done:
+                if future.exception() is None and not _is_retryable(future.result()):
+                    if future is second:
+                        metrics.record_llm_request("hedge_won")
+                    # 返さない応答は閉じる（遅れた方の応答は受け取った時点で閉じる）
+                    for other in finished:
+                        if other is not future:
+                            _close_result(other)
+                    for other in pending:
+                        other.add_done_callback(_close_result)
+                    return future.result()
+        # どちらも失敗した場合は最初のリクエストの結果を使う（再試行の判定は呼び出し元で行う）
+        _close_result(second)
+        return first.result()
+
+    def send(self, request: httpx.Request, send) -> httpx.Response:
+        """同期版のトランスポートから呼び出し、流量制限・ヘッジ・再試行を適用して応答を返します。"""
+        body = request.read()
+        tokens = estimate_request_tokens(body)
+        for attempt in range(self.max_retries + 1):
+            model = self.model_for_attempt(attempt)
+            if model is not None and attempt == self.fallback_after:
+                metrics.record_llm_request("fallback")
+                logger.warning("Falling back to %s after %d failed attempts", model, attempt)
+            delay = self.reserve(tokens)
+            if delay > 0:
+                time.sleep(delay)
+
+            metrics.record_llm_request("sent")
+            response, error = None, None
+            try:
+                response = self._send_hedged(send, _with_model(request, body, model), body, model, tokens)
+            except httpx.TransportError as e:
+                error = e
+            if response is not None and not _is_retryable(response):
+                return response
+            if attempt == self.max_retries:
+                # 最後の試行の結果は、そのまま呼び出し元（OpenAIクライアント）に返して例外に変換させる
+                if response is not None:
+                    return response
+                raise error
+
+            wait_seconds = self.backoff(attempt, response)
+            logger.info(
+                "Retrying LLM request in %.2fs (attempt %d, %s)",
+                wait_seconds, attempt + 1, response.status_code if response is not None else repr(error),
+            )
+            if response is not None:
+                response.close()
+            metrics.record_llm_request("retry")
+            time.sleep(wait_seconds)
+
+    # 非同期版
+
+    async def _atimed_send(self, send, request: httpx.Request) -> httpx.Response:
+        start = time.monotonic()
+        response = await send(request)
+        if response.status_code < 400:
+            self.latencies.record(time.monotonic() - start)
+        return response
+
+    async def _asend_hedged(self, send, request: httpx.Request, body: bytes, model: str | None, tokens: int):
+        delay = self.hedge_delay()
+        if delay is None:
+            return await self._atimed_send(send, request)
+
+        first = asyncio.ensure_future(self._atimed_send(send, request))
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done or not self.try_reserve_hedge(tokens):
+            return await first
+
+        metrics.record_llm_request("hedge")
+        second = asyncio.ensure_future(self._atimed_send(send, _with_model(request, body, model)))
+        pending = {first, second}
+        finished = []
+        winner = None
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                finished.extend(done)
+                winner = next(
+                    (task for task in done if task.exception() is None and not _is_retryable(task.result())), None
+                )
+            if winner is second:
+                metrics.record_llm_request("hedge_won")
+            # どちらも失敗した場合は最初のリクエストの結果を使う（再試行の判定は呼び出し元で行う）
+            winner = winner or first
+            return winner.result()
+        finally:
+            # 返さない応答は閉じ、遅れた方のリクエストは取り消す（取り消す前に応答が届いていた場合も閉じる）
+            for task in finished:
+                if task is not winner:
+                    await _aclose_result(task)
+            for task in pending:
+                task.cancel()
+                task.add_done_callback(_schedule_aclose_result)
+
+    async def asend(self, request: httpx.Request, send) -> httpx.Response:
+        """非同期版のトランスポートから呼び出し、流量制限・ヘッジ・再試行を適用して応答を返します。"""
+        body = await request.aread()
+        tokens = estimate_request_tokens(body)
+        for attempt in range(self.max_retries + 1):
+            model = self.model_for_attempt(attempt)
+            if model is not None and attempt == self.fallback_after:
+                metrics.record_llm_request("fallback")
+                logger.warning("Falling back to %s after %d failed attempts", model, attempt)
+            delay = self.reserve(tokens)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            metrics.record_llm_request("sent")
+            response, error = None, None
+            try:
+                response = await self._asend_hedged(send, _with_model(request, body, model), body, model, tokens)
+            except httpx.TransportError as e:
+                error = e
+            if response is not None and not _is_retryable(response):
+                return response
+            if attempt == self.max_retries:
+                if response is not None:
+                    return response
+                raise error
+
+            wait_seconds = self.backoff(attempt, response)
+            logger.info(
+                "Retrying LLM request in %.2fs (attempt %d, %s)",
+                wait_seconds, attempt + 1, response.status_code if response is not None else repr(error),
+            )
+            if response is not None:
+                await response.aclose()
+            metrics.record_llm_request("retry")
+            await asyncio.sleep(wait_seconds)
+
+
+class ScheduledTransport(httpx.BaseTransport):
+    """ModelCallSchedulerを通してリクエストを送る同期版のトランスポートです。"""
+
+    def __init__(self, scheduler: ModelCallScheduler, transport: httpx.BaseTransport | None = None):
+        self.scheduler = scheduler
+        self._transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        return self.scheduler.send(request, self._transport.handle_request)
+
+    def close(self):
+        self._transport.close()
+
+
+class AsyncScheduledTransport(httpx.AsyncBaseTransport):
+    """ModelCallSchedulerを通してリクエストを送る非同期版のトランスポートです。"""
+
+    def __init__(self, scheduler: ModelCallScheduler, transport: httpx.AsyncBaseTransport | None = None):
+        self.scheduler = scheduler
+        self._transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self.scheduler.asend(request, self._transport.handle_async_request)
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+def _env_float(name: str) -> float | None:
+    value = os.environ.get(name)
+    return float(value) if value else None
+
+
+def _close_result(future):
+    """完了したリクエストのFutureが応答を持っていれば閉じます。"""
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+async def _aclose_result(task: asyncio.Future):
+    """完了したリクエストのタスクが応答を持っていれば閉じます。"""
+    if not task.cancelled() and task.exception() is None:
+        await task.result().aclose()
+
+
+def _schedule_aclose_result(task: asyncio.Future):
+    # 取り消したタスクのdone callbackから呼ぶため、応答を閉じる処理は別のタスクで実行する
+    if not task.cancelled() and task.exception() is None:
+        asyncio.ensure_future(task.result().aclose())
+
+
+def build_scheduler() -> ModelCallScheduler:
+    """
+    環境変数からスケジューラを作成します。
+    再試行は既定で有効（3回）です。流量制限（LLM_RATE_LIMIT_RPM・LLM_RATE_LIMIT_TPM）、
+    ヘッジ（LLM_HEDGE_PERCENTILE）、代替モデル（LLM_FALLBACK_MODEL）は設定した場合のみ有効になります。
+    """
+    max_retries = os.environ.get("LLM_MAX_RETRIES")
+    fallback_after = os.environ.get("LLM_FALLBACK_AFTER")
+    hedge_min_samples = os.environ.get("LLM_HEDGE_MIN_SAMPLES")
+    return ModelCallScheduler(
+        requests_per_minute=_env_float("LLM_RATE_LIMIT_RPM"),
+        tokens_per_minute=_env_float("LLM_RATE_LIMIT_TPM"),
+        max_retries=int(max_retries) if max_retries else 3,
+        backoff_base=_env_float("LLM_BACKOFF_BASE") or 0.5,
+        backoff_max=_env_float("LLM_BACKOFF_MAX") or 20.0,
+        hedge_percentile=_env_float("LLM_HEDGE_PERCENTILE"),
+        hedge_min_samples=int(hedge_min_samples) if hedge_min_samples else 20,
+        fallback_model=os.environ.get("LLM_FALLBACK_MODEL") or None,
+        fallback_after=int(fallback_after) if fallback_after else 2,
+    )
+
+
+def build_http_clients(scheduler: ModelCallScheduler, timeout: float | None = None) -> tuple[httpx.Client, httpx.AsyncClient]:
+    """スケジューラを通す同期・非同期のhttpxクライアントを作成します（ChatOpenAIのhttp_client・http_async_clientに渡す）。"""
+    if timeout is None:
+        timeout = _env_float("LLM_REQUEST_TIMEOUT") or 60.0
+    return (
+        httpx.Client(transport=ScheduledTransport(scheduler), timeout=timeout),
+        httpx.AsyncClient(transport=AsyncScheduledTransport(scheduler), timeout=timeout),
+    )
@@ -0,0 +1,130 @@
+"""
+同じ入力に対する処理が同時に複数届いた場合に、1回だけ実行して結果を共有するモジュールです（single-flight）。
+最初の呼び出し元（リーダー）が処理を実行し、実行中に同じキーで呼び出した側はその完了を待って同じ結果・同じ例外を受け取ります。
+完了した結果は保持しないため、キャッシュとは異なり、処理が終わった後の呼び出しは改めて実行されます。
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+import weakref
+from concurrent.futures import Future
+
+from blog_makearticle2.src.instrumentation import metrics
+
+
+def make_key(*parts) -> str:
+    """
+    JSONに変換できる値からキーを作成します。辞書のキーの順序や全角・半角の違いに依存しないよう、呼び出し側で正規化した値を渡します。
+    """
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Cancelled(Exception):
+    """リーダーの処理が例外ではなく中断（KeyboardInterruptなど）で終わったことを待機側に伝えるための例外です。"""
+
+
+class SingleFlight:
+    """
+    スレッド間で同じキーの処理をまとめるsingle-flightです。
+    リーダーが送出した例外は待機側にもそのまま送出します。リーダーが中断された場合は、待機側のうち1つが新しいリーダーとして実行し直します。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}  # キー -> 実行中の処理のFuture
+
+    def do(self, key, fn, *args, timeout: float | None = None, **kwargs):
+        """
+        キーに対応する処理が実行中であればその結果を待って返し、そうでなければ`fn(*args, **kwargs)`を実行して返します。
+        `timeout`を指定した場合、待機側は指定秒数で`TimeoutError`を送出します（リーダーの処理は続行します）。
+        """
+        while True:
+            with self._lock:
+                future = self._calls.get(key)
+                leader = future is None
+                if leader:
+                    future = Future()
+                    self._calls[key] = future
+
+            if leader:
+                metrics.record_singleflight(self.name, shared=False)
+                return self._run(key, future, fn, args, kwargs)
+
+            metrics.record_singleflight(self.name, shared=True)
+            try:
+                return future.result(timeout)
+            except _Cancelled:
+                continue
+
+    def _run(self, key, future: Future, fn, args, kwargs):
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self._finish(key)
+            future.set_exception(e)
+            raise
+        except BaseException:
+            self._finish(key)
+            future.set_exception(_Cancelled())
+            raise
+        self._finish(key)
+        future.set_result(result)
+        return result
+
+    def _finish(self, key):
+        # 結果を設定する前に取り除き、完了後に届いた呼び出しが終わった処理を待たないようにする
+        with self._lock:
+            self._calls.pop(key, None)
+
+
+class AsyncSingleFlight:
+    """
+    イベントループ内で同じキーのコルーチンをまとめるsingle-flightです。
+    処理はタスクとして実行し、待機側ごとのキャンセルはその呼び出し元にだけ伝わります。
+    待機しているすべての呼び出し元がキャンセルされた場合は、実行中のタスクもキャンセルします。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        # イベントループ -> {キー: [タスク, 待機中の呼び出し元の数]}（タスクはループをまたいで待てないため）
+        self._calls = weakref.WeakKeyDictionary()
+
+    async def do(self, key, fn, *args, **kwargs):
+        """キーに対応するタスクが実行中であればその結果を待って返し、そうでなければ`await fn(*args, **kwargs)`を実行して返します。"""
+        loop = asyncio.get_running_loop()
+        calls = self._calls.setdefault(loop, {})
+        while True:
+            entry = calls.get(key)
+            if entry is None:
+                entry = [loop.create_task(fn(*args, **kwargs)), 0]
+                calls[key] = entry
+                entry[0].add_done_callback(lambda _, entry=entry: self._finish(calls, key, entry))
+                metrics.record_singleflight(self.name, shared=False)
+            else:
+                metrics.record_singleflight(self.name, shared=True)
+
+            task = entry[0]
+            entry[1] += 1
+            try:
+                # shieldにより、この呼び出し元がキャンセルされてもタスク自体は他の呼び出し元のために続行する
+                return await asyncio.shield(task)
+            except asyncio.CancelledError:
+                if task.cancelled() and not asyncio.current_task().cancelling():
+                    # 他の呼び出し元によってタスクがキャンセルされた場合は、この呼び出し元のために実行し直す
+                    continue
+                raise
+            finally:
+                entry[1] -= 1
+                if entry[1] == 0 and not task.done():
+                    # 待っている呼び出し元がいなくなったタスクは中断し、以後の呼び出しは新しいタスクで実行する
+                    self._finish(calls, key, entry)
+                    task.cancel()
+
+    @staticmethod
+    def _finish(calls: dict, key, entry):
+        if calls.get(key) is entry:
+            del calls[key]
@@ -1,10 +1,69 @@
+from typing import Annotated, TypedDict
+
 from langgraph.graph import MessagesState
 
+
+def merge_draft_sections(current: list | None, new: list | None) -> list:
+    """並列に執筆されたセクションを追加します。Noneを渡すと空にします（執筆を始める前のリセットに使う）。"""
+    if new is None:
+        return []
+    return (current or []) + new
+
+
+class CompanyRecord(TypedDict):
+    """会社の行のレコードです。fieldsはprofile_records.COMPANY_FIELDSのキーと値の辞書です。"""
+    site_id: str
+    company_id: str
+    fields: dict[str, str]
+
+
+class ProductRecord(TypedDict):
+    """
+    プロダクトの行のレコードです。fieldsはキーワードによらずトークン数の上限まで選んだ項目・文、
+    excerptはそれ以外の文からキーワードに関連するものを選んだ項目・文です。
+    """
+    site_id: str
+    product_id: str
+    fields: dict[str, str]
+    excerpt: dict[str, str]
+
+
+class PersonaRecord(TypedDict):
+    """ペルソナの行のレコードです。fieldsとexcerptはProductRecordと同じです。"""
+    site_id: str
+    product_id: str
+    persona_id: str
+    fields: dict[str, str]
+    excerpt: dict[str, str]
+
+
 class AgentState(MessagesState):
     #target_keyword: str
     write_word: str
-    feedback: str
+    # 並列に取得したプロファイル情報のレコード（該当する行がない場合はNone）
+    # チェックポイントごとに保存されるため、プロンプトのテキストにはLLMを呼び出すノードで変換する（profile_records.py）
+    company: CompanyRecord | None
+    product: ProductRecord | None
+    persona: PersonaRecord | None
+    # "yes"・"no"・自由記述、またはセクション単位のフィードバック（{"sections": {セクション番号: コメント}}）
+    feedback: str | dict
     remake_flag: bool
+    # 承認後に並列に執筆したセクション（{"index": セクション番号, "content": 本文}）と、それらを結合した記事
+    draft_sections: Annotated[list, merge_draft_sections]
+    article: str
+
+
+class SectionTask(TypedDict):
+    """セクションを執筆するノード（WriteSection）にSendで渡す入力です。"""
+    index: int
+    section: str
+    # アウトラインのタイトルとセクションの見出しの一覧（他のセクションの本文は渡さない）
+    headings: list[str]
+    write_word: str
+    # プロファイル情報のレコード（excerptはこのセクションに関連する内容を選んだもの）
+    company: CompanyRecord | None
+    product: ProductRecord | None
+    persona: PersonaRecord | None
 
 initial_state = {
     "messages": [
@@ -16,10 +16,11 @@
 
 
 import argparse
+import heapq
 import sys
-from google.ads.googleads.client import GoogleAdsClient
-from google.ads.googleads.errors import GoogleAdsException
-import pandas as pd
+import threading
+from array import array
+# google-ads・numpy・pandasはインポートに時間がかかるため、利用する関数の中でインポートする
 
 import os
 from dotenv import load_dotenv
@@ -49,10 +50,108 @@ _DEFAULT_LOCATION_IDS = list(ParentIDs)[0:11]  # location ID for New York, NY
 # https://developers.google.com/google-ads/api/reference/data/codes-formats#expandable-7
 _DEFAULT_LANGUAGE_ID = "1005"  # language ID 1005 for 日本語
 
+# 広告競合度の並び順（UNSPECIFIED・UNKNOWNは結果から除外する）
+COMPETITION_LEVELS = ["LOW", "MEDIUM", "HIGH"]
+_COMPETITION_RANK = {level: rank for rank, level in enumerate(COMPETITION_LEVELS)}
+# 月平均検索ボリュームがこの値以下のキーワードは結果から除外する
+_DEFAULT_MIN_MONTHLY_SEARCHES = 100
+
+# プロセス内で共有するGoogleAdsClient（初回利用時に一度だけ作成する）
+_googleads_client = None
+_googleads_client_lock = threading.Lock()
+
+
+def get_googleads_client(path=None):
+    """Returns the process-wide GoogleAdsClient, creating it on first use.
+
+    Args:
+        path: an optional path to the google-ads.yaml configuration file. If
+            not given, the client library reads the file named by the
+            GOOGLE_ADS_CONFIGURATION_FILE_PATH environment variable or
+            ~/google-ads.yaml.
+
+    Returns:
+        a shared GoogleAdsClient instance.
+    """
+    global _googleads_client
+    if _googleads_client is None:
+        with _googleads_client_lock:
+            if _googleads_client is None:
+                from google.ads.googleads.client import GoogleAdsClient
+
+                _googleads_client = GoogleAdsClient.load_from_storage(path)
+    return _googleads_client
+
+
+def set_googleads_client(client):
+    """Replaces the process-wide client, e.g. with a fake for local runs.
+
+    Args:
+        client: a GoogleAdsClient or a compatible fake, or None to reset.
+    """
+    global _googleads_client
+    with _googleads_client_lock:
+        _googleads_client = client
+
 # [START generate_keyword_ideas]
 def main(
+    client,
+    customer_id,
+    location_ids,
+    language_id,
+    keyword_texts,
+    page_url,
+    top_n=None,
+    min_monthly_searches=_DEFAULT_MIN_MONTHLY_SEARCHES,
+):
+    """Generates keyword ideas and returns them as a DataFrame.
+
+    The client is not created here, so a long-lived shared client (see
+    get_googleads_client) can be reused across calls.
+
+    Args:
+        client: an initialized GoogleAdsClient instance.
+        customer_id: a client customer ID.
+        location_ids: a list of location ID strings.
+        language_id: a language criterion ID string.
+        keyword_texts: a list of seed keyword strings.
+        page_url: an optional URL string related to your business.
+        top_n: an optional maximum number of rows to return. A top_n of zero
+            or less returns an empty DataFrame.
+        min_monthly_searches: rows at or below this volume are dropped.
+
+    Returns:
+        a DataFrame with the columns キーワード, 月平均検索ボリューム and
+        広告競合度, filtered and sorted (see build_keyword_frame).
+    """
+    # キーワードアイデアを生成
+    keyword_ideas = generate_keyword_ideas(
+        client, customer_id, location_ids, language_id, keyword_texts, page_url
+    )
+
+    # ページを取得しながら絞り込み・上位抽出を行い、データフレームに変換
+    return build_keyword_frame(
+        keyword_ideas, top_n=top_n, min_monthly_searches=min_monthly_searches
+    )
+    # [END generate_keyword_ideas]
+
+
+def generate_keyword_ideas(
     client, customer_id, location_ids, language_id, keyword_texts, page_url
 ):
+    """Sends one GenerateKeywordIdeasRequest and returns the result pager.
+
+    Args:
+        client: an initialized GoogleAdsClient instance.
+        customer_id: a client customer ID.
+        location_ids: a list of location ID strings.
+        language_id: a language criterion ID string.
+        keyword_texts: a list of seed keyword strings.
+        page_url: an optional URL string related to your business.
+
+    Returns:
+        an iterable of GenerateKeywordIdeaResult messages.
+    """
     # KeywordPlanIdeaServiceを取得
     keyword_plan_idea_service = client.get_service("KeywordPlanIdeaService")
     # キーワード競争レベルの列挙型を取得
@@ -104,53 +203,132 @@ def main(
         request.keyword_and_url_seed.keywords.extend(keyword_texts)
 
     # キーワードアイデアを生成
-    keyword_ideas = keyword_plan_idea_service.generate_keyword_ideas(
+    return keyword_plan_idea_service.generate_keyword_ideas(
         request=request
     )
 
-    # 生成されたキーワードアイデアをデータフレームに格納
-    data = []
+
+def build_keyword_frame(keyword_ideas, top_n=None, min_monthly_searches=_DEFAULT_MIN_MONTHLY_SEARCHES):
+    """Builds the sorted keyword DataFrame from a stream of keyword ideas.
+
+    Ideas are consumed one by one (the pager fetches further pages lazily),
+    filtered as they arrive and stored in typed arrays instead of per-row
+    dicts. When top_n is given only the best top_n rows are kept in a
+    bounded heap.
+
+    Args:
+        keyword_ideas: an iterable of GenerateKeywordIdeaResult messages.
+        top_n: an optional maximum number of rows to return. A top_n of zero
+            or less returns an empty DataFrame.
+        min_monthly_searches: rows at or below this volume are dropped.
+
+    Returns:
+        a DataFrame with the columns キーワード, 月平均検索ボリューム and
+        広告競合度 (an ordered categorical LOW < MEDIUM < HIGH), sorted by
+        competition and then by descending search volume.
+    """
+    texts = []
+    volumes = array("q")
+    competitions = array("b")
+    heap = []  # top_n指定時: (-競合度, 検索ボリューム, キーワード) の最小ヒープ（先頭が最も順位の低い行）
+
     for idea in keyword_ideas:
-        competition_value = idea.keyword_idea_metrics.competition.name
-        data.append({
-            "Keyword": idea.text,
-            "Avg Monthly Searches": idea.keyword_idea_metrics.avg_monthly_searches,
-            "Competition": competition_value
-        })
-
-    df_keywords = pd.DataFrame(data)
-
-    # ヘッダー名を変更
-    df_keywords.rename(columns={
-        "Keyword": "キーワード",
-        "Avg Monthly Searches": "月平均検索ボリューム",
-        "Competition": "広告競合度"
-    }, inplace=True)
-
-    # CompetitionがUNSPECIFIEDのものを削除
-    df_filtered = df_keywords[~df_keywords["広告競合度"].isin(["UNSPECIFIED"])]
-
-    # 月平均検索ボリュームが100以下の行を削除
-    df_filtered = df_filtered[df_filtered["月平均検索ボリューム"] > 100]
-
-    # CompetitionがLOW, MEDIUMの順に並べ替え、次に月平均検索数の降順で並べ替え
-    df_sorted = df_filtered.sort_values(
+        metrics = idea.keyword_idea_metrics
+        # UNSPECIFIED・UNKNOWNの競合度は削除する
+        competition = _COMPETITION_RANK.get(metrics.competition.name)
+        if competition is None:
+            continue
+        # 月平均検索ボリュームが基準以下の行を削除する
+        volume = metrics.avg_monthly_searches
+        if volume <= min_monthly_searches:
+            continue
+
+        if top_n is None:
+            texts.append(idea.text)
+            volumes.append(volume)
+            competitions.append(competition)
+        else:
+            entry = (-competition, volume, idea.text)
+            if len(heap) < top_n:
+                heapq.heappush(heap, entry)
+            elif heap and entry[:2] > heap[0][:2]:
+                heapq.heapreplace(heap, entry)
+
+    if top_n is not None:
+        for negative_competition, volume, text in heap:
+            texts.append(text)
+            volumes.append(volume)
+            competitions.append(-negative_competition)
+
+    import numpy as np
+    import pandas as pd
+
+    df_keywords = pd.DataFrame({
+        "キーワード": texts,
+        "月平均検索ボリューム": np.frombuffer(volumes, dtype=np.int64) if volumes else np.array([], dtype=np.int64),
+        "広告競合度": pd.Categorical.from_codes(
+            np.frombuffer(competitions, dtype=np.int8) if competitions else np.array([], dtype=np.int8),
+            categories=COMPETITION_LEVELS,
+            ordered=True,
+        ),
+    })
+
+    # 競合度の低い順（LOW → MEDIUM → HIGH）に並べ替え、次に月平均検索ボリュームの降順で並べ替え
+    return df_keywords.sort_values(
         by=["広告競合度", "月平均検索ボリューム"],
-        key=lambda col: col.map({"LOW": 0, "MEDIUM": 1, "HIGH": 2, "UNSPECIFIED": 3}) if col.name == "競合度" else col,
-        ascending=[True, False]
+        ascending=[True, False],
+        kind="stable",
+        ignore_index=True,
     )
 
-    # データフレームの内容をMarkdown形式でファイルに出力
-    with open("/Users/suzukiren/blog_features/keyword_ideas.md", "w") as f:
-        f.write(df_sorted.to_markdown(index=False))
 
-    # データフレームの内容をMarkdown形式でコンソールに出力
-    markdown_text = df_sorted.to_markdown(index=False)
+def format_markdown(df):
+    """Formats keyword ideas as a Markdown table."""
+    return df.to_markdown(index=False)
 
-    # マークダウンテキストを出力
-    print(markdown_text)
 
-    # [END generate_keyword_ideas]
+def format_csv(df):
+    """Formats keyword ideas as CSV."""
+    return df.to_csv(index=False)
+
+
+def format_json(df):
+    """Formats keyword ideas as a JSON array of records."""
+    return df.to_json(orient="records", force_ascii=False)
+
+
+# 出力形式ごとのフォーマッタ（register_output_formatで追加できる）
+OUTPUT_FORMATS = {
+    "markdown": format_markdown,
+    "csv": format_csv,
+    "json": format_json,
+}
+
+
+def register_output_format(name, formatter):
+    """Registers a formatter that turns the keyword DataFrame into text.
+
+    Args:
+        name: the format name used with --format.
+        formatter: a callable taking a DataFrame and returning a string.
+    """
+    OUTPUT_FORMATS[name] = formatter
+
+
+def write_keyword_ideas(df, output_format="markdown", output_path=None):
+    """Writes keyword ideas in the given format to a file or stdout.
+
+    Args:
+        df: the DataFrame returned by main.
+        output_format: a key of OUTPUT_FORMATS.
+        output_path: an optional file path; stdout is used if omitted.
+    """
+    text = OUTPUT_FORMATS[output_format](df)
+    if output_path:
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
 
 
 def map_locations_ids_to_resource_names(client, location_ids):
@@ -221,8 +399,53 @@ if __name__ == "__main__":
         help="A URL string related to your business",
     )
 
+    parser.add_argument(
+        "-n",
+        "--top_n",
+        type=int,
+        required=False,
+        help="The maximum number of keyword ideas to output",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        type=str,
+        required=False,
+        default="markdown",
+        choices=sorted(OUTPUT_FORMATS),
+        help="The output format",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        required=False,
+        help="A file path to write the keyword ideas to (stdout if omitted)",
+    )
+    parser.add_argument(
+        "--per_seed",
+        action="store_true",
+        help="Output the ideas for each seed keyword separately, with a シード column",
+    )
+    parser.add_argument(
+        "--location_group_size",
+        type=int,
+        required=False,
+        help="With --per_seed, split the locations into groups of this size and request them concurrently",
+    )
+    parser.add_argument(
+        "--store",
+        type=str,
+        required=False,
+        help="With --per_seed, a keyword store SQLite file to answer fresh seeds from and record fetched ideas in",
+    )
+
     args = parser.parse_args()
 
+    import pandas as pd
+    from google.ads.googleads.client import GoogleAdsClient
+    from google.ads.googleads.errors import GoogleAdsException
+
     # GoogleAdsClient will read the google-ads.yaml configuration file in the
     # home directory if none is specified.
 
@@ -231,14 +454,39 @@ if __name__ == "__main__":
     googleads_client = GoogleAdsClient.load_from_storage("/Users/suzukiren/blog_features/google-ads.yaml")
 
     try:
-        main(
-            googleads_client,
-            args.customer_id,
-            args.location_ids,
-            args.language_id,
-            args.keyword_texts,
-            args.page_url,
-        )
+        if args.per_seed:
+            # シードキーワードごとのリクエストを並行して実行し、シードキーワードごとに結果を出力する
+            import asyncio
+            from blog_makearticle2.src.keyword_batcher import fetch_per_seed
+            from blog_makearticle2.src.keyword_store import KeywordStore
+
+            frames = asyncio.run(fetch_per_seed(
+                args.customer_id,
+                args.keyword_texts,
+                top_n=args.top_n,
+                location_ids=args.location_ids,
+                language_id=args.language_id,
+                location_group_size=args.location_group_size,
+                client=googleads_client,
+                store=KeywordStore(args.store) if args.store else None,
+            ))
+            df_sorted = pd.concat(
+                [df.assign(シード=seed) for seed, df in frames.items()],
+                ignore_index=True,
+            )
+        else:
+            df_sorted = main(
+                googleads_client,
+                args.customer_id,
+                args.location_ids,
+                args.language_id,
+                args.keyword_texts,
+                args.page_url,
+                top_n=args.top_n,
+            )
+
+        # 指定された形式でファイル（未指定の場合はコンソール）に出力
+        write_keyword_ideas(df_sorted, args.format, args.output)
     except GoogleAdsException as ex:
         print(
             f'Request with ID "{ex.request_id}" failed with status '
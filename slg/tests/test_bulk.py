@@ -0,0 +1,64 @@
+"""大量実行のCLI（bulk.py）の再実行のテストです。"""
+
+import json
+import os
+
+import pytest
+
+from blog_makearticle2.src.bulk import _init_worker, load_done_keys, run_bulk, worker_rate_limits
+from blog_makearticle2.src.fake_openai import FakeOpenAIServer
+
+SLG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+JOBS = [
+    {"siteId": "c15000000001", "companyId": 1, "productId": 1, "personaId": persona_id, "write_word": f"btob マーケティング {persona_id}"}
+    for persona_id in (1, 2)
+]
+
+
+@pytest.fixture
+def bulk_env(tmp_path, monkeypatch):
+    # ワーカープロセスはspawnで起動するため、環境変数と作業ディレクトリ（顧客テーブルのCSVの相対パス）を引き継がせる
+    monkeypatch.chdir(SLG_DIR)
+    with FakeOpenAIServer() as server:
+        monkeypatch.setenv("OPENAI_API_KEY", "test")
+        monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+        monkeypatch.setenv("CHECKPOINTER", "sqlite")
+        monkeypatch.setenv("CHECKPOINT_DB_PATH", str(tmp_path / "checkpoints.sqlite"))
+        manifest = tmp_path / "manifest.jsonl"
+        manifest.write_text("".join(json.dumps(job, ensure_ascii=False) + "\n" for job in JOBS), encoding="utf-8")
+        yield server, str(manifest), tmp_path
+
+
+def test_restart_does_not_call_the_model_for_finished_jobs(bulk_env):
+    server, manifest, tmp_path = bulk_env
+    output = str(tmp_path / "results.jsonl")
+
+    summary = run_bulk(manifest, output, workers=1, concurrency=2)
+    assert summary["completed"] == len(JOBS)
+    calls = len(server.requests)
+    assert calls > 0
+
+    # 結果を書き込む前に停止した場合と同じく、チェックポイントには完了済みのジョブが残り、出力には結果がない状態から再実行する
+    os.remove(output)
+    summary = run_bulk(manifest, output, workers=1, concurrency=2)
+
+    assert summary["completed"] == len(JOBS)
+    assert len(server.requests) == calls
+    assert len(load_done_keys(output)) == len(JOBS)
+    with open(output, encoding="utf-8") as f:
+        assert all(json.loads(line)["outline"] for line in f)
+
+
+def test_rate_limits_are_divided_among_the_workers(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("LLM_RATE_LIMIT_RPM", "600")
+    monkeypatch.delenv("LLM_RATE_LIMIT_TPM", raising=False)
+    limits = worker_rate_limits(4)
+    assert limits == {"LLM_RATE_LIMIT_RPM": "150.0"}
+
+    # ワーカーでは分割した値でスケジューラを作成する
+    _init_worker(None, 1, "yes", False, limits)
+    from blog_makearticle2.src.scheduler import build_scheduler
+
+    assert build_scheduler().request_bucket.rate * 60 == 150.0
@@ -0,0 +1,41 @@
+"""アウトライン再生成ループのコンテキスト（context.py）のテストです。"""
+
+import logging
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from blog_makearticle2.src.context import build_outline_context, count_message_tokens
+
+SEED = [HumanMessage("BtoB向けのブログ記事のアウトラインを作成します。")]
+PROFILE = "# 会社情報\n会社名: テスト株式会社\n" * 20
+
+
+def _history(outline: str) -> list:
+    return [*SEED, AIMessage("# 古いアウトライン\n## 1. はじめに\n"), AIMessage(outline)]
+
+
+def test_fits_without_truncation():
+    messages = build_outline_context(_history("## 1. はじめに\n- 概要\n"), PROFILE, "社員研修", feedback="no")
+    assert messages[2].content == PROFILE
+
+
+def test_oversized_outline_is_truncated_to_the_limit():
+    outline = "## 1. はじめに\n" + "- 社員研修の目的と効果を詳しく説明する\n" * 400
+    max_tokens = 1000
+    messages = build_outline_context(_history(outline), PROFILE, "社員研修", feedback="no", max_tokens=max_tokens)
+
+    assert count_message_tokens(messages) <= max_tokens
+    # プロファイル情報は切り捨て、依頼文・キーワード・フィードバックは残し、アウトラインは先頭から残す
+    assert messages[1].content == SEED[0].content
+    assert messages[2].content == ""
+    truncated = next(m for m in messages if isinstance(m, AIMessage))
+    assert truncated.content and outline.startswith(truncated.content)
+    assert "社員研修" in messages[3].content
+    assert messages[-1].content.startswith("ユーザーは直前のアウトラインに満足していません")
+
+
+def test_logs_when_the_limit_cannot_be_met(caplog):
+    with caplog.at_level(logging.WARNING, logger="blog_makearticle2.src.context"):
+        messages = build_outline_context(_history("## 1. はじめに\n"), PROFILE, "社員研修", feedback="no", max_tokens=10)
+    assert messages[2].content == ""
+    assert "still exceeds the budget" in caplog.text
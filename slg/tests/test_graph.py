@@ -0,0 +1,56 @@
+"""グラフのノード（graph.py）のテストです。"""
+
+import threading
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_openai import ChatOpenAI
+
+from blog_makearticle2.src import graph
+from blog_makearticle2.src.fake_openai import FakeOpenAIServer
+
+OUTLINE = """# 社員研修の進め方
+## 1. 社員研修とは
+- 研修の目的を整理する
+## 2. 研修の種類
+- OJTとOff-JTの違い
+## 3. まとめ
+- 自社に合った研修を選ぶ
+"""
+
+
+@pytest.fixture
+def fake_model():
+    with FakeOpenAIServer(latency=0.3) as server:
+        graph.set_model(ChatOpenAI(model="gpt-4o-mini", api_key="test", base_url=server.base_url, max_retries=0))
+        try:
+            yield server
+        finally:
+            graph.set_model(None)
+
+
+def test_concurrent_identical_section_regenerations_share_the_calls(fake_model):
+    state = {
+        "messages": [HumanMessage("アウトラインを作成して。"), AIMessage(OUTLINE)],
+        "write_word": "社員研修",
+        "company": None,
+        "product": None,
+        "persona": None,
+        "feedback": {"sections": {1: "具体例を増やして", 3: "短くして"}},
+    }
+    results = []
+
+    def regenerate(thread_id):
+        results.append(graph.RegenerateSections(state, {"configurable": {"thread_id": thread_id}}))
+
+    threads = [threading.Thread(target=regenerate, args=(f"thread-{i}",)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 3つのスレッドが同じ2つのセクションを再生成しても、モデルの呼び出しはセクションごとに1回にまとまる
+    assert len(fake_model.requests) == 2
+    outlines = [result.update["messages"][0].content for result in results]
+    assert len(outlines) == 3 and len(set(outlines)) == 1
+    assert "## 2. 研修の種類\n- OJTとOff-JTの違い\n" in outlines[0]
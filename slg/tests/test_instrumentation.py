@@ -0,0 +1,35 @@
+"""LLM呼び出しの計測（instrumentation.py）のテストです。"""
+
+from langchain_core.messages import HumanMessage
+from langchain_openai import ChatOpenAI
+
+from blog_makearticle2.src.fake_openai import FakeOpenAIServer
+from blog_makearticle2.src.instrumentation import Metrics, MetricsCallbackHandler
+from blog_makearticle2.src.llm_cache import SQLiteLLMCache
+
+
+def test_cache_hits_are_counted_without_tokens_or_cost(tmp_path):
+    metrics = Metrics()
+    callback = MetricsCallbackHandler(metrics)
+    with FakeOpenAIServer() as server:
+        model = ChatOpenAI(
+            model="gpt-4o-mini",
+            api_key="test",
+            base_url=server.base_url,
+            cache=SQLiteLLMCache(str(tmp_path / "llm_cache.sqlite")),
+            callbacks=[callback],
+        )
+        config = {"metadata": {"langgraph_node": "CreateOutline"}}
+        first = model.invoke([HumanMessage("btob マーケティング")], config)
+        second = model.invoke([HumanMessage("btob マーケティング")], config)
+        assert len(server.requests) == 1
+
+    assert second.content == first.content
+    usage = metrics.snapshot()["llm"]
+    assert len(usage) == 1
+    assert usage[0]["node"] == "CreateOutline"
+    assert usage[0]["calls"] == 1
+    assert usage[0]["cache_hits"] == 1
+    assert usage[0]["input"] == first.usage_metadata["input_tokens"]
+    assert usage[0]["output"] == first.usage_metadata["output_tokens"]
+    assert 'slg_llm_cache_hits_total{node="CreateOutline",model="' in metrics.render_prometheus()
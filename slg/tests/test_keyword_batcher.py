@@ -0,0 +1,90 @@
+"""キーワードアイデアのバッチャー（keyword_batcher.py）とストア（keyword_store.py）のテストです。"""
+
+import asyncio
+
+from blog_makearticle2.src import utils as keyword_utils
+from blog_makearticle2.src.fake_ads import FakeGoogleAdsClient, FakeKeywordPlanIdeaService, _make_idea
+from blog_makearticle2.src.keyword_batcher import KeywordIdeaBatcher
+from blog_makearticle2.src.keyword_store import KeywordStore
+
+SEED = "btob デジタル マーケティング"
+# シードキーワードのすべての語は含まないが、APIが関連キーワードとして返すアイデア
+RELATED = "デジタルマーケティング とは"
+
+
+class _RelatedIdeaService(FakeKeywordPlanIdeaService):
+    """シードキーワードの派生キーワードに加えて、関連キーワードも返すフェイクです。"""
+
+    def generate_keyword_ideas(self, request):
+        return [*super().generate_keyword_ideas(request), _make_idea(RELATED)]
+
+
+def _fetch(seeds, client, **kwargs):
+    async def main():
+        batcher = KeywordIdeaBatcher("1234567890", client=client, **kwargs)
+        frames = await asyncio.gather(*(batcher.fetch(seed) for seed in seeds))
+        return batcher, frames
+
+    return asyncio.run(main())
+
+
+def _unbatched(seed, client):
+    return keyword_utils.main(
+        client, "1234567890", keyword_utils._DEFAULT_LOCATION_IDS, keyword_utils._DEFAULT_LANGUAGE_ID, [seed], None
+    )
+
+
+def test_lone_seed_returns_the_unbatched_result():
+    client = FakeGoogleAdsClient(_RelatedIdeaService())
+    _, (frame,) = _fetch([SEED], client)
+    assert RELATED in set(frame["キーワード"])
+    assert frame.reset_index(drop=True).equals(_unbatched(SEED, client).reset_index(drop=True))
+
+
+def test_seed_gets_the_same_frame_alone_and_with_other_seeds():
+    client = FakeGoogleAdsClient(_RelatedIdeaService())
+    _, (alone,) = _fetch([SEED], client)
+    batcher, (together, _, _) = _fetch([SEED, "社員研修", SEED], client)
+    # 異なるシードキーワードはまとめずにリクエストし、同じシードキーワードは1回のリクエストを共有する
+    assert batcher.requests_sent == 2
+    assert RELATED in set(together["キーワード"])
+    assert together.reset_index(drop=True).equals(alone.reset_index(drop=True))
+
+
+def test_country_location_is_not_split_into_groups():
+    client = FakeGoogleAdsClient(_RelatedIdeaService())
+    batcher, _ = _fetch([SEED], client, location_group_size=3)
+    assert batcher.location_group_size is None
+    assert batcher.requests_sent == 1
+
+
+def test_store_answers_fresh_seeds_and_refreshes_stale_ones(tmp_path):
+    client = FakeGoogleAdsClient(_RelatedIdeaService())
+    store = KeywordStore(str(tmp_path / "keywords.sqlite"), max_age=3600)
+    seeds = [SEED, "社員研修"]
+
+    first, fetched = _fetch(seeds, client, store=store)
+    second, stored = _fetch(seeds, client, store=store)
+    assert (first.requests_sent, second.requests_sent, second.store_hits) == (2, 0, 2)
+    # シードキーワードのすべての語を含まない関連キーワードも含めて、ストアから同じ結果を返す
+    assert RELATED in set(stored[0]["キーワード"])
+    for a, b in zip(fetched, stored):
+        assert a.reset_index(drop=True).equals(b.reset_index(drop=True))
+
+    store.max_age = 0
+    stale, _ = _fetch(seeds, client, store=store)
+    assert (stale.requests_sent, stale.store_hits) == (2, 0)
+
+
+def test_store_prefix_and_substring_lookup(tmp_path):
+    client = FakeGoogleAdsClient(_RelatedIdeaService())
+    store = KeywordStore(str(tmp_path / "keywords.sqlite"))
+    batcher, _ = _fetch(["社員研修"], client, store=store)
+    location_ids, language_id = batcher.location_ids, batcher.language_id
+
+    prefix = store.prefix("社員", location_ids, language_id)
+    assert prefix and all(keyword.startswith("社員") for keyword, _, _ in prefix)
+    # trigramのインデックス（3文字以上）とLIKE（2文字以下）のどちらでも部分一致で検索できる
+    for text in ("員研修", "研修"):
+        rows = store.search(text, location_ids, language_id)
+        assert rows and all(text in keyword for keyword, _, _ in rows)
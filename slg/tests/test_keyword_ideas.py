@@ -0,0 +1,69 @@
+"""キーワードアイデアの取得（utils.main）をフェイクのGoogleAdsClientで実行するテストです。"""
+
+import pytest
+
+from blog_makearticle2.src import utils as keyword_utils
+from blog_makearticle2.src.fake_ads import FakeGoogleAdsClient, FakeKeywordPlanIdeaService, _make_idea
+
+CUSTOMER_ID = "1234567890"
+SEED = "社員研修"
+
+
+@pytest.fixture
+def shared_client():
+    client = FakeGoogleAdsClient(FakeKeywordPlanIdeaService())
+    keyword_utils.set_googleads_client(client)
+    try:
+        yield client
+    finally:
+        keyword_utils.set_googleads_client(None)
+
+
+def _expected_rows(service: FakeKeywordPlanIdeaService, seed: str) -> list[tuple]:
+    """フェイクが返すアイデアを、build_keyword_frameと同じ条件で絞り込み・並べ替えた行を返します。"""
+    texts = [seed, *(f"{seed} {suffix}" for suffix in service.suffixes)]
+    rows = []
+    for idea in map(_make_idea, texts):
+        metrics = idea.keyword_idea_metrics
+        if metrics.competition.name in keyword_utils.COMPETITION_LEVELS and metrics.avg_monthly_searches > 100:
+            rows.append((idea.text, metrics.avg_monthly_searches, metrics.competition.name))
+    return sorted(rows, key=lambda row: (keyword_utils.COMPETITION_LEVELS.index(row[2]), -row[1]))
+
+
+def test_main_uses_the_shared_client_in_process(shared_client):
+    for _ in range(2):
+        df = keyword_utils.main(
+            keyword_utils.get_googleads_client(),
+            CUSTOMER_ID,
+            keyword_utils._DEFAULT_LOCATION_IDS,
+            keyword_utils._DEFAULT_LANGUAGE_ID,
+            [SEED],
+            None,
+        )
+
+    # プロセス内で共有するクライアントを使い、呼び出しごとにクライアントを作り直さない
+    assert keyword_utils.get_googleads_client() is shared_client
+    service = shared_client.keyword_plan_idea_service
+    assert len(service.requests) == 2
+    request = service.requests[-1]
+    assert request.customer_id == CUSTOMER_ID
+    assert list(request.keyword_seed.keywords) == [SEED]
+    assert request.language == f"languageConstants/{keyword_utils._DEFAULT_LANGUAGE_ID}"
+    assert len(request.geo_target_constants) == len(keyword_utils._DEFAULT_LOCATION_IDS)
+
+    assert list(df.columns) == ["キーワード", "月平均検索ボリューム", "広告競合度"]
+    rows = [(text, int(volume), str(competition)) for text, volume, competition in df.itertuples(index=False)]
+    assert rows == _expected_rows(service, SEED)
+
+
+def test_main_keeps_the_top_n_rows(shared_client):
+    full = keyword_utils.main(shared_client, CUSTOMER_ID, ["2392"], "1005", [SEED], None)
+    top = keyword_utils.main(shared_client, CUSTOMER_ID, ["2392"], "1005", [SEED], None, top_n=3)
+    assert top.equals(full.head(3))
+
+
+@pytest.mark.parametrize("top_n", [0, -1])
+def test_main_returns_an_empty_frame_when_top_n_is_not_positive(shared_client, top_n):
+    df = keyword_utils.main(shared_client, CUSTOMER_ID, ["2392"], "1005", [SEED], None, top_n=top_n)
+    assert df.empty
+    assert list(df.columns) == ["キーワード", "月平均検索ボリューム", "広告競合度"]
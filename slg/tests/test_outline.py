@@ -0,0 +1,49 @@
+"""アウトラインの分割（outline.py）と、セクションの執筆に渡す入力のテストです。"""
+
+import os
+
+from langchain_core.messages import AIMessage
+
+from blog_makearticle2.src.graph import build_section_tasks
+from blog_makearticle2.src.outline import outline_headings, split_outline
+from blog_makearticle2.src.prompts import build_section_messages
+
+SLG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+OUTLINE = """# 社員研修の進め方
+## 1. 社員研修とは
+### 目的
+- 研修の目的を整理する
+## 2. 研修の種類
+- OJTとOff-JTの違い
+## 3. まとめ
+- 自社に合った研修を選ぶ
+"""
+
+
+def test_outline_headings_skip_subheadings():
+    assert outline_headings(OUTLINE) == ["# 社員研修の進め方", "## 1. 社員研修とは", "## 2. 研修の種類", "## 3. まとめ"]
+
+
+def test_section_tasks_carry_only_their_section_and_the_headings(monkeypatch):
+    # 顧客テーブルのCSVを相対パスで読み込むため、slgディレクトリで実行する
+    monkeypatch.chdir(SLG_DIR)
+    state = {"messages": [AIMessage(OUTLINE)], "write_word": "社員研修", "company": None}
+    config = {"configurable": {"siteId": "c15000000001", "productId": 1, "personaId": 1}}
+
+    sends = build_section_tasks(state, config)
+    _, sections = split_outline(OUTLINE)
+    assert [send.arg["section"] for send in sends] == sections
+    for send in sends:
+        task = send.arg
+        assert "outline" not in task
+        assert task["headings"] == outline_headings(OUTLINE)
+
+        messages = build_section_messages(
+            task["write_word"], task["headings"], "", task["index"] + 1, task["section"]
+        )
+        prompt = "\n".join(str(message.content) for message in messages)
+        # 自分のセクションの本文は含み、他のセクションの本文は含まない
+        for index, section in enumerate(sections):
+            body = section.splitlines()[-1]
+            assert (body in prompt) == (index == task["index"])
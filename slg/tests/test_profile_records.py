@@ -0,0 +1,68 @@
+"""プロファイル情報のレコード（profile_records.py）のテストです。"""
+
+from blog_makearticle2.src.context import count_text_tokens
+from blog_makearticle2.src.profile_records import (
+    PERSONA_FIELDS,
+    PRODUCT_FIELDS,
+    build_persona_record,
+    build_product_record,
+    render_profile,
+    render_profile_excerpt,
+)
+from blog_makearticle2.src.prompts import build_outline_messages
+
+PRICE = "月額料金は1ユーザーあたり980円からで、初期費用は無料です。"
+SECURITY = "データは国内のデータセンターで暗号化して保管し、ISMS認証を取得しています。"
+
+
+def _row(definitions: tuple, extra: dict) -> dict:
+    """各列に同じ長さの一般的な説明を入れ、`extra`の列の末尾にだけ固有の文を加えた行を作成します。"""
+    return {
+        column: "".join(f"{column}はマーケティング業務の効率化に役立つ項目{i}です。" for i in range(8)) + extra.get(column, "")
+        for _, _, columns in definitions
+        for column in columns
+    }
+
+
+PRODUCT_ROW = _row(PRODUCT_FIELDS, {"price_advantage": PRICE, "support_system": SECURITY})
+PERSONA_ROW = _row(PERSONA_FIELDS, {})
+
+
+def _records(query: str, budget: int = 300, excerpt_budget: int = 100):
+    product = build_product_record("s1", "p1", PRODUCT_ROW, query, budget, excerpt_budget)
+    persona = build_persona_record("s1", "p1", "1", PERSONA_ROW, query, budget, excerpt_budget)
+    return product, persona
+
+
+def test_profile_block_does_not_depend_on_the_keyword():
+    price = _records("料金 価格")
+    security = _records("セキュリティ 暗号化 データセンター")
+
+    assert render_profile(None, *price) == render_profile(None, *security)
+    profile = render_profile(None, *price)
+    assert PRICE not in profile and SECURITY not in profile
+    assert count_text_tokens(profile) < count_text_tokens(str(PRODUCT_ROW) + str(PERSONA_ROW))
+
+    # キーワードに関連する内容は、先頭側のプロファイル情報に含まれない文から選ぶ
+    assert PRICE in render_profile_excerpt(*price)
+    assert SECURITY in render_profile_excerpt(*security)
+
+
+def test_outline_prompt_prefix_is_shared_across_keywords():
+    prompts = []
+    for keyword in ("btob 月額料金 比較", "btob セキュリティ 暗号化 データセンター"):
+        product, persona = _records(keyword)
+        prompts.append(build_outline_messages(
+            [], render_profile(None, product, persona), keyword, profile_excerpt=render_profile_excerpt(product, persona)
+        ))
+    price, security = prompts
+    # システムプロンプトとプロファイル情報までは一致し、キーワードとキーワードに関連する情報はその後ろに置く
+    assert [m.content for m in price[:2]] == [m.content for m in security[:2]]
+    assert price[2].content != security[2].content
+    assert PRICE in price[3].content and SECURITY in security[3].content
+
+
+def test_no_excerpt_when_everything_fits():
+    product, persona = _records("料金", budget=0)
+    assert render_profile_excerpt(product, persona) == ""
+    assert PRICE in render_profile(None, product, persona)
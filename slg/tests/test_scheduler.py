@@ -0,0 +1,121 @@
+"""スケジューラ（scheduler.py）とget_modelのタイムアウト・ヘッジのテストです。"""
+
+import asyncio
+import threading
+import time
+
+import httpx
+import openai
+import pytest
+
+from blog_makearticle2.src import graph
+from blog_makearticle2.src.fake_openai import FakeOpenAIServer
+from blog_makearticle2.src.scheduler import ModelCallScheduler
+
+
+class _TrackedStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """閉じられたかどうかを記録する応答の本文です。"""
+
+    def __init__(self):
+        self.closed = False
+
+    def __iter__(self):
+        yield b"{}"
+
+    async def __aiter__(self):
+        yield b"{}"
+
+    def close(self):
+        self.closed = True
+
+    async def aclose(self):
+        self.closed = True
+
+
+@pytest.fixture
+def stalled_model(monkeypatch):
+    with FakeOpenAIServer(stall_rate=1.0, stall_seconds=5.0) as server:
+        monkeypatch.setenv("OPENAI_API_KEY", "test")
+        monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+        monkeypatch.setenv("LLM_REQUEST_TIMEOUT", "0.5")
+        monkeypatch.setenv("LLM_MAX_RETRIES", "1")
+        monkeypatch.setenv("LLM_BACKOFF_BASE", "0.01")
+        graph.set_model(None)
+        try:
+            yield server, graph.get_model()
+        finally:
+            graph.set_model(None)
+
+
+def test_stalled_request_times_out_and_is_retried(stalled_model):
+    server, model = stalled_model
+    assert model.root_client.timeout == 0.5
+
+    start = time.perf_counter()
+    with pytest.raises(openai.APITimeoutError):
+        model.invoke("社員研修のアウトラインを作成してください。")
+    elapsed = time.perf_counter() - start
+
+    # 5秒止まる応答を待たずに0.5秒でタイムアウトし、1回再試行する
+    assert elapsed < 3.0
+    assert len(server.requests) == 2
+
+
+def _hedging_scheduler() -> ModelCallScheduler:
+    scheduler = ModelCallScheduler(hedge_percentile=90)
+    scheduler.hedge_delay = lambda: 0.01
+    return scheduler
+
+
+def test_async_hedge_closes_the_response_it_does_not_return():
+    streams = []
+
+    async def main():
+        gate = asyncio.Event()
+
+        async def send(request):
+            await gate.wait()
+            stream = _TrackedStream()
+            streams.append(stream)
+            return httpx.Response(200, stream=stream)
+
+        async def open_gate():
+            # 最初のリクエストとヘッジの両方が送られてから同時に応答させる
+            await asyncio.sleep(0.05)
+            gate.set()
+
+        request = httpx.Request("POST", "http://test/v1/chat/completions", content=b"{}")
+        opener = asyncio.ensure_future(open_gate())
+        response = await _hedging_scheduler()._asend_hedged(send, request, b"{}", None, 1)
+        await opener
+        await asyncio.sleep(0.01)
+        return response
+
+    response = asyncio.run(main())
+    assert len(streams) == 2
+    assert not response.stream.closed
+    assert [stream.closed for stream in streams if stream is not response.stream] == [True]
+
+
+def test_sync_hedge_closes_the_response_it_does_not_return():
+    gate = threading.Event()
+    streams = []
+    lock = threading.Lock()
+
+    def send(request):
+        gate.wait()
+        stream = _TrackedStream()
+        with lock:
+            streams.append(stream)
+        return httpx.Response(200, stream=stream)
+
+    threading.Timer(0.05, gate.set).start()
+    request = httpx.Request("POST", "http://test/v1/chat/completions", content=b"{}")
+    response = _hedging_scheduler()._send_hedged(send, request, b"{}", None, 1)
+
+    deadline = time.monotonic() + 1.0
+    while time.monotonic() < deadline and not all(s.closed for s in streams if s is not response.stream):
+        time.sleep(0.01)
+    assert len(streams) == 2
+    assert not response.stream.closed
+    assert [stream.closed for stream in streams if stream is not response.stream] == [True]